@@ -1,22 +1,54 @@
 """
 KnowledgeExplorer Backend Configuration
-Central configuration loader using python-dotenv and Pydantic BaseSettings
+Central configuration loader using Pydantic BaseSettings (reads .env directly)
 """
 
-import os
+import dataclasses
 from pathlib import Path
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+
+class SettingsHelpers:
+    """Helper methods shared by Settings and its frozen runtime copy."""
+    
+    __slots__ = ()
+    
+    def validate_api_keys(self) -> dict:
+        """
+        Validate that required API keys are present.
+        Returns a dict of validation status for each service.
+        """
+        validation = {
+            "groq": bool(self.groq_api_key and self.groq_api_key != ""),
+            "pinecone": bool(self.pinecone_api_key and self.pinecone_api_key != ""),
+            "jina": bool(self.jina_api_key and self.jina_api_key != "")
+        }
+        return validation
+    
+    def get_embedding_cache_dir(self) -> str:
+        """Return the persistent embedding cache directory, or "" if disabled."""
+        if not self.embedding_cache_persist:
+            return ""
+        return self.embedding_cache_dir or str(Path(self.upload_dir) / ".emb_cache")
+    
+    def get_upsert_tuning_path(self) -> str:
+        """Return the file where the tuned Pinecone upsert batch size is kept."""
+        # Inside a hidden directory so /upload/status doesn't list it as a document
+        return self.pinecone_upsert_tuning_file or str(Path(self.upload_dir) / ".state" / "upsert_tuning.json")
+    
+    def ensure_upload_dir(self):
+        """Create upload directory if it doesn't exist."""
+        Path(self.upload_dir).mkdir(parents=True, exist_ok=True)
 
 
-class Settings(BaseSettings):
+class Settings(SettingsHelpers, BaseSettings):
     """
     Central configuration class for KnowledgeExplorer backend.
     All settings are loaded from environment variables or .env file.
+    
+    Only used to parse and validate configuration at startup; the rest of
+    the backend reads the frozen copy exposed as `settings`.
     """
     
     # Groq API Configuration
@@ -24,20 +56,67 @@ class Settings(BaseSettings):
     groq_model: str = Field(default="mixtral-8x7b-32768", env="GROQ_MODEL")
     groq_temperature: float = Field(default=0.7, env="GROQ_TEMPERATURE")
     groq_max_tokens: int = Field(default=2048, env="GROQ_MAX_TOKENS")
+    groq_max_concurrent: int = Field(default=8, env="GROQ_MAX_CONCURRENT")  # requests in flight
+    groq_requests_per_minute: int = Field(default=0, env="GROQ_REQUESTS_PER_MINUTE")  # 0 disables rate limiting
+    
+    # LLM Response Cache Configuration (0 disables a tier)
+    llm_cache_size: int = Field(default=1024, env="LLM_CACHE_SIZE")
+    llm_semantic_cache_size: int = Field(default=512, env="LLM_SEMANTIC_CACHE_SIZE")
+    llm_semantic_cache_threshold: float = Field(default=0.95, env="LLM_SEMANTIC_CACHE_THRESHOLD")
     
     # Pinecone Configuration
     pinecone_api_key: str = Field(default="", env="PINECONE_API_KEY")
     pinecone_env: str = Field(default="us-west1-gcp", env="PINECONE_ENV")
     pinecone_index: str = Field(default="knowledge-explorer", env="PINECONE_INDEX")
+    stats_cache_ttl: float = Field(default=30.0, env="STATS_CACHE_TTL")  # seconds
+    pinecone_pool_size: int = Field(default=32, env="PINECONE_POOL_SIZE")  # pooled keep-alive connections
+    pinecone_use_grpc: bool = Field(default=False, env="PINECONE_USE_GRPC")
+    pinecone_upsert_batch_size: int = Field(default=64, env="PINECONE_UPSERT_BATCH_SIZE")  # vectors per request
+    pinecone_upsert_concurrency: int = Field(default=8, env="PINECONE_UPSERT_CONCURRENCY")  # requests in flight (1-64)
+    pinecone_upsert_autotune: bool = Field(default=True, env="PINECONE_UPSERT_AUTOTUNE")  # adapt batch size to latency
+    pinecone_upsert_tuning_file: str = Field(default="", env="PINECONE_UPSERT_TUNING_FILE")  # defaults to <UPLOAD_DIR>/.state/upsert_tuning.json
+    query_cache_size: int = Field(default=1024, env="QUERY_CACHE_SIZE")  # 0 disables
+    query_cache_threshold: float = Field(default=0.95, env="QUERY_CACHE_THRESHOLD")  # cosine similarity
+    query_cache_ttl: float = Field(default=60.0, env="QUERY_CACHE_TTL")  # seconds
+    query_preview_threshold: float = Field(default=0.85, env="QUERY_PREVIEW_THRESHOLD")  # streamed partial sources; 0 disables
+    local_index_max_vectors: int = Field(default=0, env="LOCAL_INDEX_MAX_VECTORS")  # 0 disables
+    local_index_quantize: bool = Field(default=False, env="LOCAL_INDEX_QUANTIZE")  # int8 rows, 4x less memory
     
     # Jina AI Configuration
     jina_api_key: str = Field(default="", env="JINA_API_KEY")
     
+    # Local Embedding Model Configuration (used when Jina is unavailable)
+    local_embedding_backend: str = Field(default="torch", env="LOCAL_EMBEDDING_BACKEND")  # torch, onnx or openvino
+    local_embedding_model_file: str = Field(default="", env="LOCAL_EMBEDDING_MODEL_FILE")
+    
+    # Embedding Cache Configuration
+    embedding_cache_size: int = Field(default=10000, env="EMBEDDING_CACHE_SIZE")
+    embedding_cache_persist: bool = Field(default=True, env="EMBEDDING_CACHE_PERSIST")
+    embedding_cache_dir: str = Field(default="", env="EMBEDDING_CACHE_DIR")  # defaults to <UPLOAD_DIR>/.emb_cache
+    embedding_cache_disk_entries: int = Field(default=100000, env="EMBEDDING_CACHE_DISK_ENTRIES")
+    
+    # Ingestion Embedding Batches
+    embed_batch_size: int = Field(default=64, env="EMBED_BATCH_SIZE")  # chunks per embedding request
+    embed_max_concurrent: int = Field(default=4, env="EMBED_MAX_CONCURRENT")  # Jina requests in flight across all ingestions
+    
     # Document Processing Configuration
     chunk_size: int = Field(default=1000, env="CHUNK_SIZE")
     chunk_overlap: int = Field(default=200, env="CHUNK_OVERLAP")
     min_relevance_score: float = Field(default=0.7, env="MIN_RELEVANCE_SCORE")
     
+    # Answer Cache Configuration (non-streaming /api/query; 0 disables)
+    enable_answer_cache: bool = Field(default=True, env="ENABLE_ANSWER_CACHE")
+    answer_cache_size: int = Field(default=1024, env="ANSWER_CACHE_SIZE")
+    answer_cache_ttl: float = Field(default=60.0, env="ANSWER_CACHE_TTL")
+    answer_semantic_threshold: float = Field(default=0.97, env="ANSWER_SEMANTIC_THRESHOLD")  # cosine similarity
+    warmup_questions_file: str = Field(default="", env="WARMUP_QUESTIONS_FILE")  # one question per line
+    
+    # Batch Prewarm Configuration (offline chunk summaries via Groq's batch API)
+    enable_batch_prewarm: bool = Field(default=False, env="ENABLE_BATCH_PREWARM")
+    batch_prewarm_max_chunks: int = Field(default=64, env="BATCH_PREWARM_MAX_CHUNKS")  # per file
+    batch_prewarm_poll_interval: float = Field(default=60.0, env="BATCH_PREWARM_POLL_INTERVAL")  # seconds
+    batch_prewarm_timeout: float = Field(default=1800.0, env="BATCH_PREWARM_TIMEOUT")  # seconds before online fallback
+    
     # Server Configuration
     host: str = Field(default="0.0.0.0", env="HOST")
     port: int = Field(default=8000, env="PORT")
@@ -46,31 +125,51 @@ class Settings(BaseSettings):
     # Upload Configuration
     upload_dir: str = Field(default="./uploads", env="UPLOAD_DIR")
     max_upload_size: int = Field(default=10485760, env="MAX_UPLOAD_SIZE")  # 10MB
+    ingest_max_concurrent: int = Field(default=8, env="INGEST_MAX_CONCURRENT")  # chunk windows embedded at once (files are parsed one at a time)
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = False
+    # .env is parsed by pydantic-settings itself; the core schema is only
+    # built when Settings() is first instantiated
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        case_sensitive=False,
+        defer_build=True
+    )
+
+
+def freeze_settings(parsed: Settings):
+    """
+    Copy validated settings into a frozen, slotted dataclass.
     
-    def validate_api_keys(self) -> dict:
-        """
-        Validate that required API keys are present.
-        Returns a dict of validation status for each service.
-        """
-        validation = {
-            "groq": bool(self.groq_api_key and self.groq_api_key != ""),
-            "pinecone": bool(self.pinecone_api_key and self.pinecone_api_key != ""),
-            "jina": bool(self.jina_api_key and self.jina_api_key != "")
-        }
-        return validation
+    Pydantic attribute access goes through descriptors on every read; the
+    frozen copy turns hot-path reads like settings.min_relevance_score into
+    plain slot lookups. Fields mirror Settings, so new settings only need
+    to be declared once.
     
-    def ensure_upload_dir(self):
-        """Create upload directory if it doesn't exist."""
-        Path(self.upload_dir).mkdir(parents=True, exist_ok=True)
+    Args:
+        parsed: Validated Settings instance
+        
+    Returns:
+        Immutable FrozenSettings instance with the same fields and helpers
+    """
+    fields = [(name, info.annotation) for name, info in Settings.model_fields.items()]
+    frozen_cls = dataclasses.make_dataclass(
+        "FrozenSettings",
+        fields,
+        bases=(SettingsHelpers,),
+        namespace={"__module__": __name__},
+        frozen=True,
+        slots=True
+    )
+    return frozen_cls(**parsed.model_dump())
+
 
+# Global settings instance (validated once, then frozen)
+settings = freeze_settings(Settings())
 
-# Global settings instance
-settings = Settings()
+# Hot-path values cached as module constants
+LOG_LEVEL = settings.log_level
+MIN_SCORE = settings.min_relevance_score
 
 # Ensure upload directory exists on import
 settings.ensure_upload_dir()
@@ -3,18 +3,22 @@ KnowledgeExplorer FastAPI Main Application
 FastAPI app with CORS, health endpoints, and logging setup
 """
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
+from pathlib import Path
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import time
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+from time import perf_counter_ns
 
-from backend_config import settings
+from backend_config import settings, LOG_LEVEL
+from routes.responses import ORJSONResponse
 
 # Configure logging
 logging.basicConfig(
-    level=getattr(logging, settings.log_level),
+    level=getattr(logging, LOG_LEVEL),
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
@@ -36,10 +40,41 @@ async def lifespan(app: FastAPI):
     if not all(validation.values()):
         logger.warning("⚠️  Some API keys are missing. Check your .env file.")
     
+    # Connect to the Pinecone index once so the first query doesn't pay for it;
+    # this also builds the (lazy) Pinecone client off the event loop
+    from services.embeddings import embeddings_service
+    from services.llm import llm_service
+    from services.prewarm import prewarm_service
+    from services.vectorstore import vectorstore_service
+    if vectorstore_service.api_key and vectorstore_service.index is None:
+        await asyncio.to_thread(
+            vectorstore_service.ensure_index,
+            dimension=embeddings_service.get_dimension()
+        )
+    
+    # Embed and retrieve the configured hot questions before serving traffic
+    if settings.warmup_questions_file and vectorstore_service.index is not None:
+        from pipeline.query import query_pipeline
+        try:
+            questions = Path(settings.warmup_questions_file).read_text(encoding="utf-8").splitlines()
+            await query_pipeline.warmup(questions)
+        except OSError as e:
+            logger.warning(f"⚠️  Could not read warmup questions: {e}")
+    
+    # Collect finished prewarm batches in the background
+    prewarm_task = asyncio.create_task(prewarm_service.run()) if prewarm_service.enabled else None
+    
     yield
     
     # Shutdown
     logger.info("👋 Shutting down KnowledgeExplorer backend...")
+    
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    
+    await embeddings_service.aclose()
+    await llm_service.aclose()
+    vectorstore_service.close()
 
 
 # Initialize FastAPI app
@@ -47,7 +82,8 @@ app = FastAPI(
     title="KnowledgeExplorer API",
     description="RAG-powered document Q&A system with streaming support",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS for React frontend
@@ -62,19 +98,30 @@ app.add_middleware(
         "http://127.0.0.1:8080"
     ],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Concrete lists skip Starlette's header reflection on every preflight
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    allow_headers=["Accept", "Authorization", "Content-Type", "X-Requested-With"],
+    max_age=600  # Let browsers cache preflight responses for 10 minutes
 )
 
 
+# Compress JSON and SSE responses. Starlette skips event streams by default,
+# but it Z_SYNC_FLUSHes every chunk, so coalesced token frames still reach
+# the client immediately and SSE text compresses several-fold
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=500,
+    compresslevel=6,  # per-chunk latency matters more than the last few percent
+    exclude_content_types=tuple(t for t in DEFAULT_EXCLUDED_CONTENT_TYPES if t != "text/event-stream")
+)
+
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     """Add processing time header to all responses."""
-    start_time = time.time()
+    start_ns = perf_counter_ns()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+    response.headers["X-Process-Time-ms"] = f"{(perf_counter_ns() - start_ns) / 1e6:.2f}"
     return response
 
 
@@ -83,11 +130,11 @@ async def add_process_time_header(request: Request, call_next):
 async def global_exception_handler(request: Request, exc: Exception):
     """Handle uncaught exceptions."""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal server error",
-            "detail": str(exc) if settings.log_level == "DEBUG" else "An unexpected error occurred"
+            "detail": str(exc) if LOG_LEVEL == "DEBUG" else "An unexpected error occurred"
         }
     )
 
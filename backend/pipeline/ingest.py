@@ -3,19 +3,110 @@ KnowledgeExplorer Document Ingestion Pipeline
 Loaders for PDF & TXT with chunking and vector storage
 """
 
+import asyncio
 import logging
+import uuid
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 
 from backend_config import settings
+from pipeline.text_splitter import FastRecursiveSplitter
 from services.embeddings import embeddings_service
+from services.llm import llm_service
+from services.prewarm import prewarm_service
 from services.vectorstore import vectorstore_service
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class Chunks:
+    """
+    Chunked documents in struct-of-arrays form.
+    
+    One entry per chunk in texts/doc_indices/chunk_indices; the loader's
+    per-page metadata is kept once per source document instead of being
+    copied into every chunk. Pinecone-shaped metadata dicts are only built
+    at the upsert boundary by metadata().
+    
+    doc_indices are local to this batch of documents; doc_offset is the
+    index of its first document within the file, so windows of a large
+    file keep file-wide chunk ids.
+    
+    Chunks are identified by a packed uint64 uid, doc_index << 32 |
+    chunk_index; it is only formatted to a string for the Pinecone id.
+    """
+    
+    texts: List[str] = field(default_factory=list)
+    doc_indices: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    chunk_indices: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    doc_chunk_counts: List[int] = field(default_factory=list)
+    doc_metadata: List[Dict[str, Any]] = field(default_factory=list)
+    doc_offset: int = 0
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+    
+    @property
+    def chunk_uids(self) -> np.ndarray:
+        """Stable per-file chunk identifiers, (doc_index << 32) | chunk_index as uint64."""
+        doc_indices = self.doc_indices.astype(np.uint64) + np.uint64(self.doc_offset)
+        return (doc_indices << np.uint64(32)) | self.chunk_indices.astype(np.uint64)
+    
+    def metadata(self, filename: str) -> List[Dict[str, Any]]:
+        """
+        Build the per-vector metadata dicts stored in Pinecone.
+        
+        Args:
+            filename: Original filename to tag every chunk with
+        
+        Returns:
+            List of metadata dicts aligned with texts, including the FULL chunk text
+        """
+        # Page-level fields are merged once per document; each chunk then
+        # costs a single dict literal on top of its document's base dict
+        bases = [
+            {
+                "doc_index": doc_idx + self.doc_offset,
+                "total_chunks": count,
+                **meta,  # Original metadata (page, source, etc.)
+                "filename": filename
+            }
+            for doc_idx, (count, meta) in enumerate(zip(self.doc_chunk_counts, self.doc_metadata))
+        ]
+        return [
+            {
+                "chunk_uid": chunk_uid,
+                "chunk_index": chunk_idx,
+                **bases[doc_idx],
+                "text": text  # Store FULL text for better retrieval
+            }
+            for chunk_uid, doc_idx, chunk_idx, text in zip(
+                self.chunk_uids.tolist(), self.doc_indices.tolist(), self.chunk_indices.tolist(), self.texts
+            )
+        ]
+
+
+@dataclass
+class _FileProgress:
+    """Bookkeeping for one file moving through the ingest_files stages."""
+    
+    filename: str
+    run_id: str
+    chunks: int = 0
+    upserted: int = 0
+    pending: int = 0  # windows handed to the embed stage and not yet stored
+    prewarmed: int = 0  # chunks submitted for batch prewarming
+    producing: bool = True
+    error: Optional[Exception] = None
+    # Ids sent to Pinecone so far; deleted again if the file fails part-way
+    stored_ids: List[str] = field(default_factory=list)
+
+
 class IngestionPipeline:
     """
     Document ingestion pipeline that:
@@ -25,12 +116,16 @@ class IngestionPipeline:
     4. Stores in Pinecone
     """
     
+    # Chunk windows buffered between pipeline stages in ingest_files
+    STAGE_QUEUE_SIZE = 4
+    # Windows upserted at once, so the client building one window's request
+    # (CPU) overlaps the previous window's requests in flight (network)
+    STORE_WORKERS = 2
+    
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = FastRecursiveSplitter(
             chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+            chunk_overlap=settings.chunk_overlap
         )
         logger.info(
             f"📝 Text splitter initialized: "
@@ -38,16 +133,19 @@ class IngestionPipeline:
             f"chunk_overlap={settings.chunk_overlap}"
         )
     
-    def load_document(self, file_path: str) -> List[Any]:
+    def load_document(self, file_path: str) -> Iterator[Any]:
         """
-        Load a document based on file extension.
+        Lazily load a document based on file extension.
+        
+        Pages are parsed one at a time as the iterator is consumed, so a
+        large PDF never has to be resident all at once.
         
         Args:
             file_path: Path to the document file
-            
+        
         Returns:
-            List of LangChain Document objects
-            
+            Iterator of LangChain Document objects (one per PDF page)
+        
         Raises:
             ValueError: If file type is not supported
         """
@@ -64,141 +162,353 @@ class IngestionPipeline:
             else:
                 raise ValueError(f"Unsupported file type: {extension}. Only PDF and TXT are supported.")
             
-            documents = loader.load()
-            logger.info(f"✅ Loaded {len(documents)} page(s) from {path.name}")
-            return documents
-            
+            return self._log_load_errors(loader.lazy_load(), path.name)
+        
         except Exception as e:
             logger.error(f"❌ Failed to load document {path.name}: {e}")
             raise
     
-    def chunk_documents(self, documents: List[Any]) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _log_load_errors(pages: Iterator[Any], name: str) -> Iterator[Any]:
+        """Pass pages through, logging parse errors that only surface mid-iteration."""
+        try:
+            yield from pages
+        except Exception as e:
+            logger.error(f"❌ Failed to load document {name}: {e}")
+            raise
+    
+    def chunk_documents(self, documents: Iterable[Any]) -> Chunks:
         """
-        Split documents into chunks with metadata.
+        Split documents into chunks.
         
         Args:
-            documents: List of LangChain Document objects
-            
+            documents: LangChain Document objects
+        
         Returns:
-            List of chunk dicts with text and metadata
+            Chunks holding chunk texts, their document/chunk indices and per-document metadata
+        """
+        window = next(self.iter_chunk_windows(documents, window_size=None), None)
+        chunks = window if window is not None else Chunks()
+        logger.info(f"✅ Created {len(chunks)} chunks")
+        return chunks
+    
+    def iter_chunk_windows(
+        self,
+        documents: Iterable[Any],
+        window_size: Optional[int] = None
+    ) -> Iterator[Chunks]:
+        """
+        Split documents into chunks, yielding them in windows.
+        
+        A window is emitted as soon as the pages read so far produced at
+        least window_size chunks, so downstream embedding can start before
+        the rest of the document has been parsed.
+        
+        Args:
+            documents: LangChain Document objects (may be a lazy iterator)
+            window_size: Minimum chunks per window; None yields a single window
+        
+        Yields:
+            Non-empty Chunks, with doc_offset set to their first page's index
         """
-        logger.info(f"✂️  Splitting {len(documents)} document(s) into chunks...")
+        texts: List[str] = []
+        counts: List[int] = []
+        metadata: List[Dict[str, Any]] = []
+        doc_offset = 0
         
-        chunks = []
-        for doc_idx, doc in enumerate(documents):
-            # Split document
+        for doc in documents:
             splits = self.text_splitter.split_text(doc.page_content)
+            texts.extend(splits)
+            counts.append(len(splits))
+            metadata.append(doc.metadata)
             
-            # Create chunk metadata
-            for chunk_idx, chunk_text in enumerate(splits):
-                chunk = {
-                    "text": chunk_text,
-                    "metadata": {
-                        "chunk_id": f"{doc_idx}_{chunk_idx}",
-                        "doc_index": doc_idx,
-                        "chunk_index": chunk_idx,
-                        "total_chunks": len(splits),
-                        **doc.metadata  # Include original metadata (page, source, etc.)
-                    }
-                }
-                chunks.append(chunk)
+            if window_size is not None and len(texts) >= window_size:
+                yield self._build_chunks(texts, counts, metadata, doc_offset)
+                doc_offset += len(counts)
+                texts, counts, metadata = [], [], []
         
-        logger.info(f"✅ Created {len(chunks)} chunks")
-        return chunks
+        if texts:
+            yield self._build_chunks(texts, counts, metadata, doc_offset)
     
-    async def ingest_file(self, file_path: str, filename: str) -> Dict[str, Any]:
+    @staticmethod
+    def _build_chunks(
+        texts: List[str],
+        counts: List[int],
+        metadata: List[Dict[str, Any]],
+        doc_offset: int
+    ) -> Chunks:
+        """Assemble a Chunks from per-page splits, deriving the index arrays with NumPy."""
+        counts_array = np.asarray(counts, dtype=np.int32)
+        doc_indices = np.repeat(np.arange(len(counts), dtype=np.int32), counts_array)
+        # Position within each document: global position minus the document's start offset
+        starts = np.cumsum(counts_array) - counts_array
+        chunk_indices = np.arange(len(texts), dtype=np.int32) - np.repeat(starts, counts_array)
+        
+        return Chunks(
+            texts=texts,
+            doc_indices=doc_indices,
+            chunk_indices=chunk_indices.astype(np.int32),
+            doc_chunk_counts=counts,
+            doc_metadata=metadata,
+            doc_offset=doc_offset
+        )
+    
+    async def embed_in_batches(self, texts: List[str]) -> np.ndarray:
         """
-        Complete ingestion pipeline for a single file.
+        Embed chunk texts in batches via embeddings_service.embed_documents.
+        
+        Byte-identical chunks (repeated headers, footers, legal boilerplate)
+        are embedded once and the vector is reused for every occurrence.
+        
+        Args:
+            texts: Chunk texts
+        
+        Returns:
+            Embedding matrix aligned with texts
+        """
+        # text -> row in the unique list; str hashes are cached, so this is one pass
+        rows: Dict[str, int] = {}
+        positions = [rows.setdefault(text, len(rows)) for text in texts]
+        unique_texts = list(rows)
+        
+        if len(unique_texts) < len(texts):
+            logger.info(f"♻️  Skipping {len(texts) - len(unique_texts)} duplicate chunks")
+            embeddings = await embeddings_service.embed_documents(unique_texts)
+            return embeddings[np.asarray(positions, dtype=np.intp)]
+        return await embeddings_service.embed_documents(texts)
+    
+    def _iter_file_windows(self, file_path: str) -> Iterator[Chunks]:
+        """Lazily load a file and yield its chunks in embedding-sized windows."""
+        window_size = settings.embed_batch_size * settings.embed_max_concurrent
+        return self.iter_chunk_windows(self.load_document(file_path), window_size)
+    
+    async def _store_chunks(
+        self,
+        filename: str,
+        chunks: Chunks,
+        embeddings: np.ndarray,
+        run_id: str
+    ) -> int:
+        """
+        Upsert embedded chunks to Pinecone.
         
         Args:
-            file_path: Full path to the file
             filename: Original filename for metadata
-            
+            chunks: Chunked window of the document
+            embeddings: Embedding matrix aligned with chunks
+            run_id: Random id shared by every chunk of this ingestion
+        
         Returns:
-            Dict with ingestion stats
+            Number of chunks stored, counting skipped duplicates
+        """
+        # Prepare metadata with filename and full text
+        metadata_list = chunks.metadata(filename)
+        ids = self._chunk_ids(filename, chunks, run_id)
+        
+        logger.info(f"💾 Upserting {len(embeddings)} vectors to Pinecone...")
+        
+        # Normally connected at startup; otherwise connect once, sized by the
+        # vectors we actually have, without blocking the event loop
+        if vectorstore_service.index is None:
+            await asyncio.to_thread(vectorstore_service.ensure_index, embeddings.shape[1])
+        
+        result = await asyncio.to_thread(
+            vectorstore_service.upsert_vectors,
+            vectors=embeddings,
+            metadata=metadata_list,
+            ids=ids
+        )
+        # Duplicates skipped by the vector store are already stored for this file
+        return result.get("upserted_count", 0) + result.get("skipped_count", 0)
+    
+    @staticmethod
+    def _chunk_ids(filename: str, chunks: Chunks, run_id: str) -> List[str]:
+        """Vector ids for a window: chunk_uid is unique within the file, and the run id keeps re-uploads distinct."""
+        return [f"{filename}_{uid:016x}_{run_id}" for uid in chunks.chunk_uids.tolist()]
+    
+    async def _discard_partial(self, state: _FileProgress) -> Optional[Exception]:
         """
-        logger.info(f"🚀 Starting ingestion pipeline for: {filename}")
+        Delete the vectors a failed ingestion already upserted.
+        
+        Windows are stored as soon as they are embedded, so a parse error on
+        a later page would otherwise leave part of the file searchable.
         
+        Returns:
+            The exception if the cleanup itself failed, else None
+        """
+        # Summaries of this run would describe a file that isn't stored
+        prewarm_service.discard(state.filename)
+        if not state.stored_ids:
+            return None
         try:
-            # Step 1: Load document
-            documents = self.load_document(file_path)
-            
-            # Step 2: Chunk documents
-            chunks = self.chunk_documents(documents)
-            
-            if not chunks:
-                logger.warning(f"⚠️  No chunks generated for {filename}")
-                return {
-                    "filename": filename,
-                    "status": "warning",
-                    "message": "No content extracted",
-                    "chunks": 0
-                }
-            
-            # Step 3: Generate embeddings
-            logger.info(f"🔢 Generating embeddings for {len(chunks)} chunks...")
-            texts = [chunk["text"] for chunk in chunks]
-            embeddings = await embeddings_service.embed_texts(texts)
-            
-            # Step 4: Prepare metadata with filename and full text
-            metadata_list = []
-            for chunk in chunks:
-                meta = chunk["metadata"].copy()
-                meta["filename"] = filename
-                meta["text"] = chunk["text"]  # Store FULL text for better retrieval
-                metadata_list.append(meta)
-            
-            # Step 5: Generate unique IDs
-            import uuid
-            ids = [f"{filename}_{chunk['metadata']['chunk_id']}_{uuid.uuid4().hex[:8]}" 
-                   for chunk in chunks]
-            
-            # Step 6: Upsert to Pinecone
-            logger.info(f"💾 Upserting {len(embeddings)} vectors to Pinecone...")
-            
-            # Initialize index if not already done
-            if not vectorstore_service.index:
-                dimension = embeddings_service.get_dimension()
-                vectorstore_service.init_index(dimension=dimension)
-            
-            result = vectorstore_service.upsert_vectors(
-                vectors=embeddings,
-                metadata=metadata_list,
-                ids=ids
+            await asyncio.to_thread(vectorstore_service.delete_by_ids, state.stored_ids, state.filename)
+            logger.info(f"🗑️  Removed {len(state.stored_ids)} vectors of failed ingestion of {state.filename}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Failed to remove partial ingestion of {state.filename}: {e}")
+            return e
+    
+    async def _submit_prewarm(self, state: _FileProgress, chunks: Chunks, embeddings: np.ndarray):
+        """Queue summaries for the file's first chunks with the batch prewarm service."""
+        count = min(len(chunks), settings.batch_prewarm_max_chunks - state.prewarmed)
+        if count <= 0:
+            return
+        
+        state.prewarmed += count
+        chunk_ids = [f"{uid:016x}" for uid in chunks.chunk_uids[:count].tolist()]
+        try:
+            await asyncio.to_thread(
+                prewarm_service.submit, state.filename, chunk_ids, chunks.texts[:count], embeddings[:count]
             )
-            
-            logger.info(f"✅ Ingestion complete for {filename}")
+        except Exception as e:
+            # Prewarming is best-effort and never fails the ingestion
+            logger.warning(f"⚠️  Prewarm submission failed for {state.filename}: {e}")
+    
+    async def _file_result(self, progress: _FileProgress) -> Dict[str, Any]:
+        """Build the final result dict for a file once all its windows are done."""
+        filename = progress.filename
+        
+        if progress.error is not None:
+            logger.error(f"❌ Ingestion failed for {filename}: {progress.error}")
+            message = str(progress.error)
+            cleanup_error = await self._discard_partial(progress)
+            if cleanup_error is not None:
+                message += f" ({len(progress.stored_ids)} vectors already stored could not be removed: {cleanup_error})"
             return {
                 "filename": filename,
-                "status": "success",
-                "chunks": len(chunks),
-                "upserted": result.get("upserted_count", 0)
+                "status": "error",
+                "message": message,
+                "chunks": 0
             }
-            
-        except Exception as e:
-            logger.error(f"❌ Ingestion failed for {filename}: {e}")
+        
+        if progress.chunks == 0:
+            logger.warning(f"⚠️  No chunks generated for {filename}")
             return {
                 "filename": filename,
-                "status": "error",
-                "message": str(e),
+                "status": "warning",
+                "message": "No content extracted",
                 "chunks": 0
             }
+        
+        # Answers grounded in an earlier version of this file are stale now
+        llm_service.invalidate(filename)
+        
+        logger.info(f"✅ Ingestion complete for {filename}")
+        return {
+            "filename": filename,
+            "status": "success",
+            "chunks": progress.chunks,
+            "upserted": progress.upserted
+        }
+    
+    async def ingest_file(self, file_path: str, filename: str) -> Dict[str, Any]:
+        """
+        Complete ingestion pipeline for a single file.
+        
+        Args:
+            file_path: Full path to the file
+            filename: Original filename for metadata
+        
+        Returns:
+            Dict with ingestion stats
+        """
+        results = await self.ingest_files([(file_path, filename)])
+        return results[0]
     
-    async def ingest_files(self, file_paths: List[tuple]) -> List[Dict[str, Any]]:
+    async def ingest_files(
+        self,
+        file_paths: List[tuple],
+        max_concurrent: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Ingest multiple files.
+        Ingest files as a three-stage pipeline.
+        
+        Stages are connected by bounded queues so they overlap: a producer
+        parses pages lazily in a worker thread and hands out chunk windows,
+        up to max_concurrent embedders embed them, and STORE_WORKERS
+        upserters write them to Pinecone. Embedding of a large PDF starts after its first
+        window rather than its last page, and full queues apply
+        backpressure so a slow stage never lets work pile up in memory.
         
         Args:
             file_paths: List of (file_path, filename) tuples
-            
+            max_concurrent: Windows embedded at once (default: settings.ingest_max_concurrent)
+        
         Returns:
-            List of ingestion results
+            List of ingestion results, in the same order as file_paths
         """
-        results = []
-        for file_path, filename in file_paths:
-            result = await self.ingest_file(file_path, filename)
-            results.append(result)
+        workers = max_concurrent or settings.ingest_max_concurrent
+        progress: List[_FileProgress] = []
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        to_embed: asyncio.Queue = asyncio.Queue(maxsize=self.STAGE_QUEUE_SIZE)
+        to_store: asyncio.Queue = asyncio.Queue(maxsize=self.STAGE_QUEUE_SIZE)
+        
+        async def window_done(index: int):
+            state = progress[index]
+            state.pending -= 1
+            if not state.producing and state.pending == 0:
+                results[index] = await self._file_result(state)
+        
+        async def produce():
+            for index, (file_path, filename) in enumerate(file_paths):
+                logger.info(f"🚀 Starting ingestion pipeline for: {filename}")
+                state = _FileProgress(filename=filename, run_id=uuid.uuid4().hex[:8])
+                progress.append(state)
+                # Summaries of a previous upload of this file would be stale
+                prewarm_service.discard(filename)
+                
+                try:
+                    windows = await asyncio.to_thread(self._iter_file_windows, file_path)
+                    # Each next() parses pages, so it runs off the event loop too
+                    while (chunks := await asyncio.to_thread(next, windows, None)) is not None:
+                        state.pending += 1
+                        await to_embed.put((index, chunks))
+                except Exception as e:
+                    state.error = e
+                
+                state.producing = False
+                if state.pending == 0:
+                    results[index] = await self._file_result(state)
+            
+            for _ in range(workers):
+                await to_embed.put(None)
+        
+        async def embed():
+            while (item := await to_embed.get()) is not None:
+                index, chunks = item
+                state = progress[index]
+                if state.error is None:
+                    logger.info(f"🔢 Generating embeddings for {len(chunks)} chunks of {state.filename}...")
+                    try:
+                        embeddings = await self.embed_in_batches(chunks.texts)
+                        await to_store.put((index, chunks, embeddings))
+                        continue
+                    except Exception as e:
+                        state.error = e
+                await window_done(index)
+        
+        async def embed_stage():
+            await asyncio.gather(*(embed() for _ in range(workers)))
+            for _ in range(self.STORE_WORKERS):
+                await to_store.put(None)
+        
+        async def store():
+            while (item := await to_store.get()) is not None:
+                index, chunks, embeddings = item
+                state = progress[index]
+                if state.error is None:
+                    # Recorded up front: a failed upsert may still have stored some batches
+                    state.stored_ids.extend(self._chunk_ids(state.filename, chunks, state.run_id))
+                    try:
+                        state.upserted += await self._store_chunks(state.filename, chunks, embeddings, state.run_id)
+                        state.chunks += len(chunks)
+                        if prewarm_service.enabled:
+                            await self._submit_prewarm(state, chunks, embeddings)
+                    except Exception as e:
+                        state.error = e
+                await window_done(index)
         
+        await asyncio.gather(produce(), embed_stage(), *(store() for _ in range(self.STORE_WORKERS)))
         return results
 
 
@@ -3,16 +3,60 @@ KnowledgeExplorer Query Pipeline
 RAG query processing with retrieval and generation
 """
 
+import asyncio
 import logging
-from typing import List, Dict, Any, Iterator, Optional
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple, FrozenSet
 
-from backend_config import settings
+import numpy as np
+
+from backend_config import MIN_SCORE, settings
+from services.cache import SemanticCache, TTLCache
 from services.embeddings import embeddings_service
 from services.vectorstore import vectorstore_service
-from services.llm import llm_service
+from services.llm import format_context, llm_service
 
 logger = logging.getLogger(__name__)
 
+# Number of characters of chunk text shown in source previews
+SOURCE_PREVIEW_CHARS = 200
+
+
+def _chunk_id(metadata: Dict[str, Any]) -> str:
+    """Client-facing <doc_index>_<chunk_index> label for a match's metadata."""
+    uid = metadata.get("chunk_uid")
+    if uid is None:
+        # Vectors ingested before packed uids store the label directly
+        return metadata.get("chunk_id", "")
+    uid = int(uid)  # Pinecone returns numeric metadata as floats
+    return f"{uid >> 32}_{uid & 0xFFFFFFFF}"
+
+
+def _normalize_question(question: str) -> str:
+    """Collapse whitespace so trivially different spellings of a question share cache entries."""
+    return " ".join(question.split())
+
+
+@dataclass
+class _HotQuestion:
+    """A warmed-up question: its embedding and its retrievals per top_k."""
+    
+    vector: np.ndarray
+    # top_k -> (corpus_version, documents)
+    retrievals: Dict[int, Tuple[int, List[Dict[str, Any]]]] = field(default_factory=dict)
+
+
+def _make_source(filename: str, chunk_id: str, score: float, text: str) -> Dict[str, Any]:
+    """Client-facing source entry with a preview of at most SOURCE_PREVIEW_CHARS characters."""
+    preview = text[:SOURCE_PREVIEW_CHARS]
+    return {
+        "filename": filename,
+        "chunk_id": chunk_id,
+        "score": score,
+        "preview": preview + "..." if len(preview) < len(text) else preview
+    }
+
 
 class QueryPipeline:
     """
@@ -26,9 +70,26 @@ class QueryPipeline:
     
     def __init__(self, top_k: int = 5):
         self.top_k = top_k
-        logger.info(f"🔍 Query pipeline initialized with top_k={top_k}")
+        # (question, top_k, force_documents, corpus_version) -> task running that query
+        self._inflight: Dict[Tuple[str, Optional[int], bool, int], asyncio.Task] = {}
+        # Same key -> finished result; corpus_version retires entries on upload/delete
+        cache_enabled = settings.enable_answer_cache and settings.answer_cache_ttl > 0
+        self._answer_cache = (
+            TTLCache(maxsize=settings.answer_cache_size, ttl=settings.answer_cache_ttl)
+            if cache_enabled else None
+        )
+        # Question embedding -> (corpus_version, top_k, force_documents, expires_at, result)
+        # for RAG answers, so paraphrases skip retrieval and generation too
+        self._similar_answers = (
+            SemanticCache(maxsize=settings.answer_cache_size, threshold=settings.answer_semantic_threshold)
+            if cache_enabled else None
+        )
+        # Normalized question -> embedding and retrievals, for questions
+        # warmed up at startup; refreshed once per corpus_version, never evicted
+        self._hot_questions: Dict[str, _HotQuestion] = {}
+        logger.info("🔍 Query pipeline initialized with top_k=%d", top_k)
     
-    async def embed_question(self, question: str) -> List[float]:
+    async def embed_question(self, question: str) -> np.ndarray:
         """
         Embed the user's question.
         
@@ -38,13 +99,111 @@ class QueryPipeline:
         Returns:
             Embedding vector
         """
-        logger.info(f"🔢 Embedding question: {question[:100]}...")
+        # Whitespace-only variants of a question share one cached embedding
+        question = _normalize_question(question)
+        hot = self._hot_questions.get(question)
+        if hot is not None:
+            return hot.vector
+        
+        logger.debug("🔢 Embedding question: %.100s...", question)
         embedding = await embeddings_service.embed_query(question)
         return embedding
     
+    async def warmup(self, questions: List[str]) -> int:
+        """
+        Embed and retrieve frequently asked questions ahead of time.
+        
+        Warmed questions skip embedding for good and skip Pinecone until the
+        corpus changes, after which their next retrieval is stored again.
+        
+        Args:
+            questions: Questions to warm up
+            
+        Returns:
+            Number of questions warmed up
+        """
+        warmed = 0
+        for question in questions:
+            question = _normalize_question(question)
+            if not question or question in self._hot_questions:
+                continue
+            try:
+                vector = await embeddings_service.embed_query(question)
+                self._hot_questions[question] = _HotQuestion(vector)
+                self._retrieve(question, vector, None)
+                warmed += 1
+            except Exception as e:
+                logger.warning("⚠️  Warmup failed for %.100s: %s", question, e)
+        
+        logger.info("🔥 Warmed up %d hot questions", warmed)
+        return warmed
+    
+    def _retrieve(self, question: str, query_vector: np.ndarray, top_k: Optional[int]) -> List[Dict[str, Any]]:
+        """retrieve_documents(), answered from the hot-question store for warmed-up questions."""
+        hot = self._hot_questions.get(_normalize_question(question))
+        if hot is None:
+            return self.retrieve_documents(query_vector, top_k)
+        
+        top_k = top_k or self.top_k
+        corpus_version = vectorstore_service.corpus_version
+        entry = hot.retrievals.get(top_k)
+        if entry is None or entry[0] != corpus_version:
+            entry = hot.retrievals[top_k] = (corpus_version, self.retrieve_documents(query_vector, top_k))
+        return entry[1]
+    
+    def _lookup_similar(
+        self,
+        query_vector: np.ndarray,
+        top_k: Optional[int],
+        force_documents: bool
+    ) -> Optional[Dict[str, Any]]:
+        """Return a live RAG result for a near-identical question with the same options."""
+        if self._similar_answers is None:
+            return None
+        
+        key = (vectorstore_service.corpus_version, top_k, force_documents)
+        now = time.monotonic()
+        entry = self._similar_answers.lookup(
+            query_vector,
+            match=lambda cached: cached[:3] == key and cached[3] >= now
+        )
+        return entry[4] if entry is not None else None
+    
+    def _remember_similar(
+        self,
+        query_vector: np.ndarray,
+        top_k: Optional[int],
+        force_documents: bool,
+        result: Dict[str, Any]
+    ):
+        """Make a RAG result reusable by similar questions."""
+        if self._similar_answers is not None:
+            expires_at = time.monotonic() + settings.answer_cache_ttl
+            self._similar_answers.add(
+                query_vector,
+                (vectorstore_service.corpus_version, top_k, force_documents, expires_at, result)
+            )
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Report the state of the caches on the query path.
+        
+        Returns:
+            Dict with embedding cache counters and the size of each answer and retrieval cache
+        """
+        return {
+            "embeddings": embeddings_service.cache.stats(),
+            "answers": len(self._answer_cache) if self._answer_cache is not None else 0,
+            "similar_answers": len(self._similar_answers) if self._similar_answers is not None else 0,
+            "retrievals": len(vectorstore_service.query_cache) if vectorstore_service.query_cache is not None else 0,
+            "hot_questions": len(self._hot_questions),
+            "llm_answers": len(llm_service.answer_cache) if llm_service.answer_cache is not None else 0,
+            "llm_semantic_answers": len(llm_service.semantic_cache) if llm_service.semantic_cache is not None else 0
+        }
+    
     def retrieve_documents(
         self,
-        query_vector: List[float],
+        query_vector: np.ndarray,
         top_k: int = None,
         filename_filter: Optional[str] = None,
         min_score: Optional[float] = None
@@ -65,20 +224,15 @@ class QueryPipeline:
             top_k = self.top_k
         
         if min_score is None:
-            min_score = settings.min_relevance_score
+            min_score = MIN_SCORE
         
-        logger.info(f"🔍 Querying Pinecone for top {top_k} results (min_score: {min_score})...")
-        
-        # Initialize index if needed
-        if not vectorstore_service.index:
-            dimension = len(query_vector)
-            vectorstore_service.init_index(dimension=dimension)
+        logger.debug("🔍 Querying Pinecone for top %d results (min_score: %.2f)...", top_k, min_score)
         
         # Build filter if filename specified
         filter_dict = None
         if filename_filter:
             filter_dict = {"filename": {"$eq": filename_filter}}
-            logger.info(f"📄 Filtering by filename: {filename_filter}")
+            logger.debug("📄 Filtering by filename: %s", filename_filter)
         
         results = vectorstore_service.query_vector(
             query_vector=query_vector,
@@ -87,33 +241,94 @@ class QueryPipeline:
             filter=filter_dict
         )
         
-        # Format and filter results
+        documents = self._to_documents(results, top_k, min_score)
+        logger.debug("✅ Retrieved %d high-relevance documents (>%.2f)", len(documents), min_score)
+        return documents
+    
+    async def _stream_retrieve(
+        self,
+        question: str,
+        query_vector: np.ndarray,
+        top_k: Optional[int]
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], bool]]:
+        """
+        _retrieve() for streaming, as (documents, is_final) pairs.
+        
+        Before the final documents, the sources cached for a similar earlier
+        question may be yielded while Pinecone is still answering.
+        """
+        if _normalize_question(question) in self._hot_questions:
+            yield self._retrieve(question, query_vector, top_k), True
+            return
+        
+        top_k = top_k or self.top_k
+        async for results, is_final in vectorstore_service.query_vector_stream(
+            query_vector=query_vector,
+            top_k=top_k * 2,  # Retrieve more to filter by score, as retrieve_documents does
+            include_metadata=True
+        ):
+            yield self._to_documents(results, top_k, MIN_SCORE), is_final
+    
+    @staticmethod
+    def _to_documents(results: List[Dict[str, Any]], top_k: int, min_score: float) -> List[Dict[str, Any]]:
+        """
+        Turn vector store matches into retrieved documents.
+        
+        Args:
+            results: Matches with id, score and metadata
+            top_k: Maximum number of documents to keep
+            min_score: Minimum relevance score threshold
+            
+        Returns:
+            List of documents with metadata, scores, prompt fragment and source entry
+        """
+        # Matches arrive sorted by descending score, so the first one below
+        # the threshold ends the scan.
         documents = []
         for result in results:
             score = result["score"]
-            
-            # Apply relevance threshold
             if score < min_score:
-                logger.debug(f"⚠️  Skipping low-relevance result (score: {score:.3f})")
-                continue
+                logger.debug("⚠️  Skipping low-relevance results (best remaining score: %.3f)", score)
+                break
             
-            doc = {
+            metadata = result["metadata"]
+            text = metadata.get("text", "")
+            filename = metadata.get("filename", "unknown")
+            chunk_id = _chunk_id(metadata)
+            documents.append({
                 "id": result["id"],
                 "score": score,
-                "text": result["metadata"].get("text", ""),
-                "filename": result["metadata"].get("filename", "unknown"),
-                "chunk_id": result["metadata"].get("chunk_id", ""),
-                "metadata": result["metadata"]
-            }
-            documents.append(doc)
+                "text": text,
+                "filename": filename,
+                "chunk_id": chunk_id,
+                "metadata": metadata,
+                # Rendered once here so build_rag_prompt and _format_sources only join and copy
+                "prompt_fragment": format_context(filename, text),
+                "source": _make_source(filename, chunk_id, score, text)
+            })
             
             # Stop when we have enough high-quality results
             if len(documents) >= top_k:
                 break
         
-        logger.info(f"✅ Retrieved {len(documents)} high-relevance documents (>{min_score})")
         return documents
     
+    @staticmethod
+    def _format_sources(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Build the client-facing source list for retrieved documents.
+        
+        Args:
+            documents: Retrieved documents with metadata
+            
+        Returns:
+            List of source dicts with filename, chunk_id, score and text preview
+        """
+        return [
+            doc.get("source") or _make_source(doc["filename"], doc["chunk_id"], doc["score"], doc["text"])
+            for doc in documents
+        ]
+    
     def build_prompt(
         self,
         question: str,
@@ -135,22 +350,29 @@ class QueryPipeline:
         )
         return prompt
     
-    def generate_answer(self, prompt: str) -> str:
+    async def generate_answer(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> str:
         """
         Generate answer using LLM.
         
         Args:
             prompt: RAG prompt with context
+            query_vector: Question embedding, enables the LLM semantic cache
+            source_files: Filenames of the retrieved documents
             
         Returns:
             Generated answer
         """
-        logger.info("🤖 Generating answer with LLM...")
-        answer = llm_service.generate(prompt)
-        logger.info(f"✅ Generated answer ({len(answer)} chars)")
+        logger.debug("🤖 Generating answer with LLM...")
+        answer = await llm_service.agenerate(prompt, query_vector, source_files)
+        logger.debug("✅ Generated answer (%d chars)", len(answer))
         return answer
     
-    def stream_answer(self, prompt: str) -> Iterator[str]:
+    async def stream_answer(self, prompt: str) -> AsyncIterator[str]:
         """
         Stream answer tokens using LLM.
         
@@ -160,8 +382,9 @@ class QueryPipeline:
         Yields:
             Token strings
         """
-        logger.info("🤖 Streaming answer with LLM...")
-        yield from llm_service.stream_tokens(prompt)
+        logger.debug("🤖 Streaming answer with LLM...")
+        async for token in llm_service.astream_tokens(prompt):
+            yield token
     
     async def query(
         self,
@@ -180,6 +403,37 @@ class QueryPipeline:
         Returns:
             Dict with answer, sources, and metadata
         """
+        key = (question.strip(), top_k, force_documents, vectorstore_service.corpus_version)
+        if self._answer_cache is not None:
+            cached = self._answer_cache.get(key)
+            if cached is not None:
+                logger.debug("⚡ Answer cache hit")
+                return cached
+        
+        # Identical questions already in flight share one pipeline run
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(
+                self._run_query(question, top_k, force_documents)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller disconnecting doesn't cancel the run for the others
+        result = await asyncio.shield(task)
+        
+        # A fallback means retrieval found nothing relevant; don't pin that answer
+        if self._answer_cache is not None and result["metadata"]["mode"] != "general_fallback":
+            self._answer_cache.set(key, result)
+        return result
+    
+    async def _run_query(
+        self,
+        question: str,
+        top_k: int = None,
+        force_documents: bool = False
+    ) -> Dict[str, Any]:
+        """Run the query pipeline once; see query()."""
         try:
             # Check if question is document-related
             is_doc_question = llm_service.is_document_related_question(question)
@@ -188,17 +442,17 @@ class QueryPipeline:
             stats = vectorstore_service.get_stats()
             has_documents = stats.total_vector_count > 0
             
-            logger.info(f"📝 Question type: {'document-related' if is_doc_question else 'general'}")
-            logger.info(f"📚 Documents available: {has_documents} ({stats.total_vector_count} vectors)")
+            logger.debug("📝 Question type: %s", "document-related" if is_doc_question else "general")
+            logger.debug("📚 Documents available: %s (%d vectors)", has_documents, stats.total_vector_count)
             
             # Decide whether to use documents or general knowledge
             use_documents = (is_doc_question or force_documents) and has_documents
             
             if not use_documents:
                 # Use general AI knowledge
-                logger.info("🤖 Using general AI knowledge (no document retrieval)")
+                logger.debug("🤖 Using general AI knowledge (no document retrieval)")
                 prompt = llm_service.build_general_prompt(question)
-                answer = self.generate_answer(prompt)
+                answer = await self.generate_answer(prompt)
                 
                 return {
                     "answer": answer,
@@ -212,18 +466,23 @@ class QueryPipeline:
                 }
             
             # Use RAG pipeline with documents
-            logger.info("📄 Using RAG pipeline with documents")
+            logger.debug("📄 Using RAG pipeline with documents")
             
             # Step 1: Embed question
             query_vector = await self.embed_question(question)
             
+            similar = self._lookup_similar(query_vector, top_k, force_documents)
+            if similar is not None:
+                logger.debug("⚡ Similar-question answer cache hit")
+                return {**similar, "metadata": {**similar["metadata"], "question": question}}
+            
             # Step 2: Retrieve documents
-            documents = self.retrieve_documents(query_vector, top_k)
+            documents = self._retrieve(question, query_vector, top_k)
             
             if not documents:
                 logger.warning("⚠️  No relevant documents found, falling back to general knowledge")
                 prompt = llm_service.build_general_prompt(question)
-                answer = self.generate_answer(prompt)
+                answer = await self.generate_answer(prompt)
                 
                 return {
                     "answer": answer,
@@ -240,18 +499,11 @@ class QueryPipeline:
             prompt = self.build_prompt(question, documents)
             
             # Step 4: Generate answer
-            answer = self.generate_answer(prompt)
+            source_files = frozenset(doc["filename"] for doc in documents)
+            answer = await self.generate_answer(prompt, query_vector, source_files)
             
             # Step 5: Format sources (clean, without scores in the answer)
-            sources = [
-                {
-                    "filename": doc["filename"],
-                    "chunk_id": doc["chunk_id"],
-                    "score": doc["score"],
-                    "preview": doc["text"][:200] + "..." if len(doc["text"]) > 200 else doc["text"]
-                }
-                for doc in documents
-            ]
+            sources = self._format_sources(documents)
             
             # Add clean source list at the end of answer if not already mentioned
             if sources and "source:" not in answer.lower():
@@ -261,7 +513,7 @@ class QueryPipeline:
                 else:
                     answer += f"\n\nSources: {', '.join(source_names)}"
             
-            return {
+            result = {
                 "answer": answer,
                 "sources": sources,
                 "metadata": {
@@ -271,9 +523,11 @@ class QueryPipeline:
                     "top_k": top_k or self.top_k
                 }
             }
+            self._remember_similar(query_vector, top_k, force_documents, result)
+            return result
             
         except Exception as e:
-            logger.error(f"❌ Query pipeline failed: {e}")
+            logger.error("❌ Query pipeline failed: %s", e)
             raise
     
     async def stream_query(
@@ -281,7 +535,7 @@ class QueryPipeline:
         question: str,
         top_k: int = None,
         force_documents: bool = False
-    ) -> Iterator[str]:
+    ) -> AsyncIterator[bytes]:
         """
         Complete query pipeline with streaming and smart detection.
         
@@ -291,7 +545,7 @@ class QueryPipeline:
             force_documents: Force document usage
             
         Yields:
-            SSE-formatted event strings
+            UTF-8 encoded SSE frames
         """
         try:
             # Check if question is document-related
@@ -301,15 +555,15 @@ class QueryPipeline:
             stats = vectorstore_service.get_stats()
             has_documents = stats.total_vector_count > 0
             
-            logger.info(f"📝 Streaming - Question type: {'document-related' if is_doc_question else 'general'}")
-            logger.info(f"📚 Documents available: {has_documents}")
+            logger.debug("📝 Streaming - Question type: %s", "document-related" if is_doc_question else "general")
+            logger.debug("📚 Documents available: %s", has_documents)
             
             # Decide whether to use documents
             use_documents = (is_doc_question or force_documents) and has_documents
             
             if not use_documents:
                 # Use general AI knowledge
-                logger.info("🤖 Streaming with general AI knowledge")
+                logger.debug("🤖 Streaming with general AI knowledge")
                 
                 metadata = {
                     "mode": "general",
@@ -320,33 +574,31 @@ class QueryPipeline:
                 
                 prompt = llm_service.build_general_prompt(question)
                 
-                yield llm_service.format_sse_event("metadata", metadata)
-                
-                # Stream the answer
-                for event in llm_service.stream_sse_tokens(prompt, metadata=metadata):
+                # Stream the answer (stream_sse_tokens sends the metadata frame first)
+                async for event in llm_service.stream_sse_tokens(prompt, metadata=metadata):
                     yield event
                 
                 return
             
             # Use RAG pipeline with documents
-            logger.info("📄 Streaming with RAG pipeline")
+            logger.debug("📄 Streaming with RAG pipeline")
             
             # Step 1: Embed question
             query_vector = await self.embed_question(question)
             
-            # Step 2: Retrieve documents
-            documents = self.retrieve_documents(query_vector, top_k)
-            
-            # Send sources metadata (clean, without exposing scores in answer)
-            sources = [
-                {
-                    "filename": doc["filename"],
-                    "chunk_id": doc["chunk_id"],
-                    "score": doc["score"],
-                    "preview": doc["text"][:200] + "..." if len(doc["text"]) > 200 else doc["text"]
-                }
-                for doc in documents
-            ]
+            # Step 2: Retrieve documents, previewing a similar question's
+            # sources while Pinecone answers
+            documents = []
+            async for documents, is_final in self._stream_retrieve(question, query_vector, top_k):
+                if not is_final and documents:
+                    yield llm_service.format_sse_event(
+                        "partial_sources",
+                        {"sources": self._format_sources(documents)}
+                    )
+            
+            # Send sources metadata (clean, without exposing scores in answer);
+            # this list supersedes any partial_sources sent above
+            sources = self._format_sources(documents)
             
             metadata = {
                 "mode": "rag" if documents else "general_fallback",
@@ -360,9 +612,7 @@ class QueryPipeline:
                 logger.warning("⚠️  No relevant documents, streaming with general knowledge")
                 prompt = llm_service.build_general_prompt(question)
                 
-                yield llm_service.format_sse_event("metadata", metadata)
-                
-                for event in llm_service.stream_sse_tokens(prompt, metadata=metadata):
+                async for event in llm_service.stream_sse_tokens(prompt, metadata=metadata):
                     yield event
                 
                 return
@@ -371,11 +621,17 @@ class QueryPipeline:
             prompt = self.build_prompt(question, documents)
             
             # Step 4: Stream answer with metadata
-            for event in llm_service.stream_sse_tokens(prompt, metadata=metadata):
+            source_files = frozenset(doc["filename"] for doc in documents)
+            async for event in llm_service.stream_sse_tokens(
+                prompt,
+                metadata=metadata,
+                query_vector=query_vector,
+                source_files=source_files
+            ):
                 yield event
             
         except Exception as e:
-            logger.error(f"❌ Stream query pipeline failed: {e}")
+            logger.error("❌ Stream query pipeline failed: %s", e)
             yield llm_service.format_sse_event("error", {"error": str(e)})
 
 
@@ -0,0 +1,123 @@
+"""
+KnowledgeExplorer Text Splitter
+Recursive separator-based chunking without LangChain's per-character overhead
+"""
+
+from typing import List, Sequence, Tuple
+
+# Separators tried in order: paragraphs, lines, words; anything still too
+# long after the last one is hard-cut at chunk_size
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ")
+
+
+class FastRecursiveSplitter:
+    """
+    Drop-in replacement for RecursiveCharacterTextSplitter.split_text.
+    
+    Text is split once per separator level with str.split (C speed), and
+    only pieces that are still longer than chunk_size descend to the next
+    level. The resulting pieces are then greedily packed into chunks of at
+    most chunk_size characters, carrying up to chunk_overlap characters of
+    trailing pieces into the next chunk.
+    
+    Debug tips:
+    - Chunks never exceed chunk_size characters (after whitespace stripping)
+    - Overlap is piece-aligned, so it can be shorter than chunk_overlap
+    """
+    
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: Sequence[str] = DEFAULT_SEPARATORS
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})"
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+    
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split text into overlapping chunks.
+        
+        Args:
+            text: Text to split
+        
+        Returns:
+            List of non-empty chunk strings
+        """
+        pieces: List[Tuple[str, str]] = []
+        self._atomize(text, "", 0, pieces)
+        return self._merge(pieces)
+    
+    def _atomize(self, text: str, joiner: str, level: int, out: List[Tuple[str, str]]):
+        """
+        Break text into (joiner, piece) pairs no longer than chunk_size.
+        
+        joiner is the separator that preceded the piece in the original
+        text, so joining pairs back together reproduces it exactly.
+        """
+        if len(text) <= self.chunk_size:
+            out.append((joiner, text))
+            return
+        
+        if level >= len(self.separators):
+            # No separator left; hard-cut into chunk_size slices
+            size = self.chunk_size
+            out.append((joiner, text[:size]))
+            out.extend(("", text[i:i + size]) for i in range(size, len(text), size))
+            return
+        
+        separator = self.separators[level]
+        parts = text.split(separator)
+        if len(parts) == 1:
+            self._atomize(text, joiner, level + 1, out)
+            return
+        
+        self._atomize(parts[0], joiner, level + 1, out)
+        for part in parts[1:]:
+            self._atomize(part, separator, level + 1, out)
+    
+    def _merge(self, pieces: List[Tuple[str, str]]) -> List[str]:
+        """Greedily pack pieces into chunks, keeping a piece-aligned overlap."""
+        chunks: List[str] = []
+        window: List[Tuple[str, str]] = []
+        # Length of the window when joined, excluding the first piece's joiner
+        window_len = 0
+        
+        for joiner, piece in pieces:
+            added = len(piece) + (len(joiner) if window else 0)
+            if window and window_len + added > self.chunk_size:
+                self._emit(window, chunks)
+                # Drop pieces from the front until what's left fits as overlap
+                # and leaves room for the new piece
+                while window and (
+                    window_len > self.chunk_overlap
+                    or window_len + len(joiner) + len(piece) > self.chunk_size
+                ):
+                    _, dropped = window.pop(0)
+                    window_len -= len(dropped)
+                    if window:
+                        window_len -= len(window[0][0])
+                added = len(piece) + (len(joiner) if window else 0)
+            
+            window.append((joiner, piece))
+            window_len += added
+        
+        if window:
+            self._emit(window, chunks)
+        return chunks
+    
+    @staticmethod
+    def _emit(window: List[Tuple[str, str]], chunks: List[str]):
+        """Append the joined, whitespace-stripped window as a chunk if non-empty."""
+        parts = [window[0][1]]
+        for joiner, piece in window[1:]:
+            parts.append(joiner)
+            parts.append(piece)
+        chunk = "".join(parts).strip()
+        if chunk:
+            chunks.append(chunk)
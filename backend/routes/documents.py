@@ -8,6 +8,8 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 
+from services.llm import llm_service
+from services.prewarm import prewarm_service
 from services.vectorstore import vectorstore_service
 
 logger = logging.getLogger(__name__)
@@ -69,6 +71,8 @@ async def delete_document_by_filename(filename: str):
     try:
         logger.info(f"🗑️  Deleting all chunks for: {filename}")
         result = vectorstore_service.delete_by_filename(filename)
+        llm_service.invalidate(filename)
+        prewarm_service.discard(filename)
         
         return DeleteResponse(
             status="success",
@@ -91,6 +95,8 @@ async def clear_all_documents():
     try:
         logger.warning("⚠️  CLEARING ALL DOCUMENTS - This action cannot be undone!")
         result = vectorstore_service.clear_all_documents()
+        llm_service.invalidate()
+        prewarm_service.discard()
         
         return DeleteResponse(
             status="success",
@@ -10,6 +10,8 @@ from pydantic import BaseModel, Field
 from typing import List, Optional
 
 from pipeline.query import query_pipeline
+from routes.responses import ORJSONResponse
+from services.llm import llm_service
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +48,10 @@ async def query(request: QueryRequest):
     Accepts a question, retrieves relevant documents, and generates
     an answer using the RAG pipeline.
     
+    The pipeline result is returned as a Response directly, so FastAPI
+    skips re-validating it against QueryResponse (which still documents
+    the schema in OpenAPI).
+    
     Args:
         request: QueryRequest with question and optional top_k
         
@@ -55,7 +61,7 @@ async def query(request: QueryRequest):
     Raises:
         HTTPException: If query processing fails
     """
-    logger.info(f"🔍 Processing query: {request.question[:100]}...")
+    logger.info("🔍 Processing query: %.100s...", request.question)
     
     try:
         result = await query_pipeline.query(
@@ -64,20 +70,11 @@ async def query(request: QueryRequest):
             force_documents=request.force_documents
         )
         
-        # Convert to response model
-        sources = [
-            SourceItem(**source)
-            for source in result["sources"]
-        ]
-        
-        return QueryResponse(
-            answer=result["answer"],
-            sources=sources,
-            metadata=result["metadata"]
-        )
+        # Pipeline output is built internally and already matches QueryResponse
+        return ORJSONResponse(result)
         
     except Exception as e:
-        logger.error(f"❌ Query failed: {e}")
+        logger.error("❌ Query failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
 
 
@@ -91,9 +88,11 @@ async def stream_query(
     Query the knowledge base with streaming response (SSE).
     
     Returns Server-Sent Events stream with:
-    - metadata event: sources and retrieved documents info
-    - message events: individual tokens as they are generated
-    - done event: final answer and token count
+    - partial_sources event (optional): provisional sources of a similar
+      earlier question, sent while retrieval is still running
+    - metadata event: sources and retrieved documents info (final sources)
+    - message events: answer text as it is generated (a few tokens per event)
+    - done event: token and character counts of the answer
     - error event: if an error occurs
     
     Args:
@@ -114,20 +113,20 @@ async def stream_query(
         data: " answer"
         
         event: done
-        data: {"answer": "The answer is...", "token_count": 50}
+        data: {"token_count": 50, "char_count": 212}
     
     Frontend usage:
         const eventSource = new EventSource('/api/stream-query?question=...');
+        let answer = '';
         eventSource.addEventListener('message', (e) => {
-            console.log('Token:', e.data);
+            answer += e.data;
         });
         eventSource.addEventListener('done', (e) => {
-            const result = JSON.parse(e.data);
-            console.log('Complete answer:', result.answer);
+            console.log('Complete answer:', answer, JSON.parse(e.data).token_count);
             eventSource.close();
         });
     """
-    logger.info(f"🔍 Processing streaming query: {question[:100]}...")
+    logger.info("🔍 Processing streaming query: %.100s...", question)
     
     async def event_generator():
         """Generate SSE events from query pipeline."""
@@ -135,9 +134,9 @@ async def stream_query(
             async for event in query_pipeline.stream_query(question, top_k, force_documents):
                 yield event
         except Exception as e:
-            logger.error(f"❌ Streaming query failed: {e}")
-            # Send error event
-            yield f"event: error\ndata: {{\"error\": \"{str(e)}\"}}\n\n"
+            logger.error("❌ Streaming query failed: %s", e)
+            # Send error event; the message is JSON-encoded, never interpolated
+            yield llm_service.format_sse_event("error", {"error": str(e)})
     
     return StreamingResponse(
         event_generator(),
@@ -150,6 +149,17 @@ async def stream_query(
     )
 
 
+@router.get("/query/cache-stats")
+async def query_cache_stats():
+    """
+    Report hit/miss counters and sizes of the query-path caches.
+    
+    Returns:
+        Dict with embedding cache counters and answer cache sizes
+    """
+    return query_pipeline.cache_stats()
+
+
 @router.get("/query/test")
 async def test_query():
     """
@@ -163,6 +173,7 @@ async def test_query():
         "message": "Query route is working",
         "endpoints": {
             "POST /api/query": "Standard query endpoint",
-            "GET /api/stream-query": "Streaming query endpoint (SSE)"
+            "GET /api/stream-query": "Streaming query endpoint (SSE)",
+            "GET /api/query/cache-stats": "Query cache statistics"
         }
     }
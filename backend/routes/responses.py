@@ -0,0 +1,24 @@
+"""
+KnowledgeExplorer Response Classes
+orjson-backed JSON response used as the app-wide default
+"""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson.
+    
+    orjson encodes several times faster than the stdlib json module and
+    serializes numpy arrays and scalars natively.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
@@ -3,8 +3,10 @@ KnowledgeExplorer Upload Routes
 File upload endpoint with document ingestion
 """
 
+import asyncio
 import logging
 import os
+import shutil
 from pathlib import Path
 from typing import List
 from fastapi import APIRouter, UploadFile, File, HTTPException
@@ -12,11 +14,15 @@ from pydantic import BaseModel
 
 from backend_config import settings
 from pipeline.ingest import ingestion_pipeline
+from routes.responses import ORJSONResponse
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Bytes copied per read when saving an upload to the upload directory
+UPLOAD_COPY_CHUNK = 1 << 20
+
 
 class UploadResponse(BaseModel):
     """Response model for upload endpoint."""
@@ -25,6 +31,19 @@ class UploadResponse(BaseModel):
     files: List[dict]
 
 
+def _save_upload(file: UploadFile, file_path: str):
+    """
+    Copy an upload to disk in UPLOAD_COPY_CHUNK pieces.
+    
+    Starlette has already spooled the request body to a temporary file,
+    so this streams between files instead of reading the whole upload
+    into memory. Blocking; run it in a worker thread.
+    """
+    file.file.seek(0)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, UPLOAD_COPY_CHUNK)
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_files(files: List[UploadFile] = File(...)):
     """
@@ -33,6 +52,9 @@ async def upload_files(files: List[UploadFile] = File(...)):
     Accepts multiple files, saves them to ./uploads, and triggers
     the ingestion pipeline for each file.
     
+    Like /query, the result is returned as a Response directly so the
+    per-file result dicts are not re-validated against UploadResponse.
+    
     Args:
         files: List of uploaded files
         
@@ -45,7 +67,7 @@ async def upload_files(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    logger.info(f"📤 Received {len(files)} file(s) for upload")
+    logger.info("📤 Received %d file(s) for upload", len(files))
     
     # Validate file types
     allowed_extensions = {".pdf", ".txt"}
@@ -57,7 +79,7 @@ async def upload_files(files: List[UploadFile] = File(...)):
         extension = Path(file.filename).suffix.lower()
         
         if extension not in allowed_extensions:
-            logger.warning(f"⚠️  Rejected file {file.filename}: unsupported type {extension}")
+            logger.warning("⚠️  Rejected file %s: unsupported type %s", file.filename, extension)
             results.append({
                 "filename": file.filename,
                 "status": "error",
@@ -66,13 +88,14 @@ async def upload_files(files: List[UploadFile] = File(...)):
             })
             continue
         
-        # Check file size
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
+        # Check file size (known from multipart parsing; seeking the spooled file is the fallback)
+        file_size = file.size
+        if file_size is None:
+            file.file.seek(0, 2)  # Seek to end
+            file_size = file.file.tell()
         
         if file_size > settings.max_upload_size:
-            logger.warning(f"⚠️  Rejected file {file.filename}: too large ({file_size} bytes)")
+            logger.warning("⚠️  Rejected file %s: too large (%d bytes)", file.filename, file_size)
             results.append({
                 "filename": file.filename,
                 "status": "error",
@@ -85,15 +108,13 @@ async def upload_files(files: List[UploadFile] = File(...)):
         try:
             file_path = os.path.join(settings.upload_dir, file.filename)
             
-            with open(file_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
+            await asyncio.to_thread(_save_upload, file, file_path)
             
-            logger.info(f"💾 Saved file: {file.filename} ({file_size} bytes)")
+            logger.info("💾 Saved file: %s (%d bytes)", file.filename, file_size)
             file_paths.append((file_path, file.filename))
             
         except Exception as e:
-            logger.error(f"❌ Failed to save file {file.filename}: {e}")
+            logger.error("❌ Failed to save file %s: %s", file.filename, e)
             results.append({
                 "filename": file.filename,
                 "status": "error",
@@ -103,7 +124,7 @@ async def upload_files(files: List[UploadFile] = File(...)):
     
     # Ingest files
     if file_paths:
-        logger.info(f"🚀 Starting ingestion for {len(file_paths)} file(s)...")
+        logger.info("🚀 Starting ingestion for %d file(s)...", len(file_paths))
         ingestion_results = await ingestion_pipeline.ingest_files(file_paths)
         results.extend(ingestion_results)
     
@@ -123,13 +144,14 @@ async def upload_files(files: List[UploadFile] = File(...)):
         status = "partial"
         message = "Some files processed successfully"
     
-    logger.info(f"✅ Upload complete: {success_count} success, {error_count} errors")
+    logger.info("✅ Upload complete: %d success, %d errors", success_count, error_count)
     
-    return UploadResponse(
-        status=status,
-        message=message,
-        files=results
-    )
+    # Results are built internally and already match UploadResponse
+    return ORJSONResponse({
+        "status": status,
+        "message": message,
+        "files": results
+    })
 
 
 @router.get("/upload/status")
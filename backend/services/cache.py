@@ -0,0 +1,428 @@
+"""
+KnowledgeExplorer Cache Utilities
+In-memory LRU cache and a SQLite-backed persistent tier for embeddings
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sentinel for lookups where None is a valid cached value
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used mapping built on OrderedDict.
+    
+    Hits move the entry to the end; inserts beyond maxsize evict
+    the oldest entry from the front.
+    """
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key (marking it recently used) or default."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            return default
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entry if full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value, or default if absent."""
+        return self._data.pop(key, default)
+    
+    def remove_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Remove every entry whose value matches predicate; returns how many were removed."""
+        stale = [key for key, value in self._data.items() if predicate(value)]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+    
+    def clear(self) -> None:
+        """Drop all entries."""
+        self._data.clear()
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire ttl seconds after being set.
+    
+    Expired entries are dropped lazily on lookup.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key if present and not expired, else default."""
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        return value
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key for ttl seconds."""
+        super().set(key, (time.monotonic() + self.ttl, value))
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache over unit-normalized query embeddings.
+    
+    Each entry stores a value plus the set of source files it was derived
+    from. A lookup hits the most similar entry that reaches the threshold
+    and matches the caller's source set, so a paraphrased question answered
+    from different documents never reuses the answer. Vectors live in a
+    preallocated ring buffer; at this size a brute-force matrix product
+    beats any ANN index. Safe to share between the event loop and
+    worker threads.
+    """
+    
+    def __init__(self, maxsize: int = 512, threshold: float = 0.95):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        # (maxsize, dim) rows, allocated on the first add; slot i holds _entries[i]
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Tuple[Any, FrozenSet[str]]]] = [None] * maxsize
+        # Slot of the oldest entry and number of live entries
+        self._start = 0
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(
+        self,
+        vector: np.ndarray,
+        source_files: FrozenSet[str] = frozenset(),
+        threshold: Optional[float] = None,
+        match: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Find the cached value for the most similar matching stored vector.
+        
+        Args:
+            vector: Query embedding
+            source_files: Source files the caller's answer would be grounded in
+            threshold: Minimum cosine similarity for this lookup (default: self.threshold)
+            match: Optional predicate a cached value must satisfy to be returned
+            
+        Returns:
+            Cached value, or None if nothing is similar enough
+        """
+        if threshold is None:
+            threshold = self.threshold
+        query = self._normalize(vector)
+        
+        with self._lock:
+            if not self._count:
+                return None
+            scores = self._vectors @ query
+            # Best-first over rows above the threshold, skipping non-matching entries
+            candidates = np.flatnonzero(scores >= threshold)
+            for slot in candidates[np.argsort(-scores[candidates], kind="stable")]:
+                entry = self._entries[slot]
+                if entry is None:
+                    continue
+                value, files = entry
+                if files == source_files and (match is None or match(value)):
+                    return value
+        return None
+    
+    def add(self, vector: np.ndarray, value: Any, source_files: FrozenSet[str] = frozenset()):
+        """Store value under vector, overwriting the oldest entry if full."""
+        if self.maxsize <= 0:
+            return
+        row = self._normalize(vector)
+        entry = (value, frozenset(source_files))
+        
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, row.shape[0]), dtype=np.float32)
+            slot = (self._start + self._count) % self.maxsize
+            if self._count == self.maxsize:
+                self._start = (self._start + 1) % self.maxsize
+            else:
+                self._count += 1
+            self._vectors[slot] = row
+            self._entries[slot] = entry
+    
+    def invalidate(self, filename: Optional[str] = None) -> int:
+        """
+        Drop entries derived from a source file.
+        
+        Args:
+            filename: Source file that changed; None drops every document-derived entry
+            
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            # Oldest first, so compacting keeps eviction order
+            slots = [(self._start + i) % self.maxsize for i in range(self._count)]
+            keep = [
+                slot for slot in slots
+                if not (self._entries[slot][1] and (filename is None or filename in self._entries[slot][1]))
+            ]
+            removed = self._count - len(keep)
+            if removed:
+                entries = [self._entries[slot] for slot in keep]
+                self._vectors[:len(keep)] = self._vectors[keep]
+                self._vectors[len(keep):] = 0.0
+                self._entries = entries + [None] * (self.maxsize - len(keep))
+                self._start = 0
+                self._count = len(keep)
+        return removed
+    
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._vectors = None
+            self._entries = [None] * self.maxsize
+            self._start = 0
+            self._count = 0
+    
+    def __len__(self) -> int:
+        return self._count
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU fronting a SQLite file.
+    
+    Keys are sha256(model_name|text), so vectors produced by different
+    embedding models can never alias each other.
+    
+    The memory tier is always consulted in place; aget_many/aset_many run
+    the SQLite tier in a worker thread so disk reads and commits never
+    stall the event loop.
+    
+    Debug tips:
+    - Delete the cache directory to force re-embedding
+    - Set EMBEDDING_CACHE_PERSIST=false to keep the cache in memory only
+    """
+    
+    # SQLite's default limit on bound parameters is 999
+    _QUERY_BATCH = 500
+    
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        path: Optional[str] = None,
+        max_disk_entries: int = 100000
+    ):
+        self.memory = LRUCache(maxsize)
+        self.max_disk_entries = max_disk_entries
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+        self._lock = threading.Lock()
+        # Lookup counters, reported by stats()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        # Opened on first disk access (from a worker thread), not at construction,
+        # so importing the embeddings service touches no files
+        self._path: Optional[Path] = Path(path) / "embeddings.sqlite3" if path else None
+    
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """Open (or create) the SQLite store on first use. Caller holds the lock."""
+        if self._db is not None or self._path is None:
+            return self._db
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self._path), check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            db.commit()
+            self._disk_entries = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._db = db
+            logger.info("💽 Embedding cache opened: %s (%d entries)", self._path, self._disk_entries)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("⚠️  Persistent embedding cache disabled: %s", e)
+            self._path = None
+        return self._db
+    
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        """Build the cache key for a text embedded with a given model."""
+        return hashlib.sha256(f"{model_name}|{text}".encode("utf-8")).digest()
+    
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings for texts.
+        
+        Args:
+            model_name: Embedding model the vectors must come from
+            texts: Texts to look up
+        
+        Returns:
+            List of float32 vectors aligned with texts; None marks a cache miss
+        """
+        keys, results, missing = self._get_memory(model_name, texts)
+        if missing and self._path is not None:
+            self._fill_from_disk(keys, results, missing, self._load([keys[i] for i in missing]))
+        self.misses += sum(1 for i in missing if results[i] is None)
+        return results
+    
+    async def aget_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Async get_many(); the SQLite read runs in a worker thread, off the event loop."""
+        keys, results, missing = self._get_memory(model_name, texts)
+        if missing and self._path is not None:
+            stored = await asyncio.to_thread(self._load, [keys[i] for i in missing])
+            self._fill_from_disk(keys, results, missing, stored)
+        self.misses += sum(1 for i in missing if results[i] is None)
+        return results
+    
+    def _get_memory(
+        self,
+        model_name: str,
+        texts: List[str]
+    ) -> Tuple[List[bytes], List[Optional[np.ndarray]], List[int]]:
+        """Look texts up in the memory tier; returns keys, results and the positions that missed."""
+        keys = [self.make_key(model_name, text) for text in texts]
+        results = [self.memory.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        self.memory_hits += len(keys) - len(missing)
+        return keys, results, missing
+    
+    def _fill_from_disk(
+        self,
+        keys: List[bytes],
+        results: List[Optional[np.ndarray]],
+        missing: List[int],
+        stored: Dict[bytes, np.ndarray]
+    ):
+        """Fill memory misses from loaded disk rows, promoting them to the memory tier."""
+        for i in missing:
+            vector = stored.get(keys[i])
+            if vector is not None:
+                self.memory.set(keys[i], vector)
+                results[i] = vector
+                self.disk_hits += 1
+    
+    def stats(self) -> Dict[str, int]:
+        """Entry counts and lookup counters for both tiers."""
+        return {
+            "memory_entries": len(self.memory),
+            "disk_entries": self._disk_entries if self._db is not None else 0,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses
+        }
+    
+    def set_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        """
+        Store embeddings for texts in both tiers.
+        
+        Args:
+            model_name: Embedding model that produced the vectors
+            texts: Texts that were embedded
+            vectors: Embedding vectors aligned with texts
+        """
+        rows = self._set_memory(model_name, texts, vectors)
+        if self._path is not None and rows:
+            self._store(rows)
+    
+    async def aset_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        """Async set_many(); the SQLite write and commit run in a worker thread."""
+        rows = self._set_memory(model_name, texts, vectors)
+        if self._path is not None and rows:
+            await asyncio.to_thread(self._store, rows)
+    
+    def _set_memory(self, model_name: str, texts: List[str], vectors: np.ndarray) -> List[Tuple[bytes, bytes]]:
+        """Store vectors in the memory tier and return the (key, blob) rows for SQLite."""
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = self.make_key(model_name, text)
+            # Copy so a cached row doesn't keep the caller's whole batch array alive
+            vector = np.array(vector, dtype=np.float32)
+            self.memory.set(key, vector)
+            rows.append((key, vector.tobytes()))
+        return rows
+    
+    def _store(self, rows: List[Tuple[bytes, bytes]]):
+        """Write rows to SQLite, pruning once the table outgrows max_disk_entries."""
+        try:
+            with self._lock:
+                if self._connect() is None:
+                    return
+                # A key always maps to the same vector, so existing rows are kept
+                # and rowcount counts only the rows actually added
+                cursor = self._db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?)", rows)
+                self._db.commit()
+                self._disk_entries += max(cursor.rowcount, 0)
+                if self._disk_entries > self.max_disk_entries:
+                    self._prune()
+        except sqlite3.Error as e:
+            logger.warning("⚠️  Failed to persist embeddings: %s", e)
+    
+    def _load(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Fetch stored vectors for keys from SQLite."""
+        found: Dict[bytes, np.ndarray] = {}
+        try:
+            with self._lock:
+                if self._connect() is None:
+                    return found
+                for i in range(0, len(keys), self._QUERY_BATCH):
+                    batch = keys[i:i + self._QUERY_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        batch
+                    )
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+        except sqlite3.Error as e:
+            logger.warning("⚠️  Failed to read embedding cache: %s", e)
+        return found
+    
+    def _prune(self):
+        """Keep only the most recently written max_disk_entries rows. Caller holds the lock."""
+        self._db.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+        self._db.commit()
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.debug("Pruned embedding cache to %d entries", self._disk_entries)
@@ -6,15 +6,25 @@ Note: This uses Jina AI's REST API via httpx, not the Jina Python SDK.
 No 'jina' package installation required - only JINA_API_KEY in .env.
 """
 
+import asyncio
+import base64
+import contextlib
+import functools
 import logging
-from typing import List
+import threading
+from typing import List, Optional, Tuple
 import httpx
+import numpy as np
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from backend_config import settings
+from services.cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+JINA_MODEL = "jina-embeddings-v2-base-en"  # or jina-embeddings-v2-small-en
+LOCAL_MODEL = "all-mpnet-base-v2"
+
 
 class EmbeddingsService:
     """
@@ -24,34 +34,87 @@ class EmbeddingsService:
     To swap to local model only:
     1. Set use_jina=False in __init__
     2. Or remove JINA_API_KEY from .env
+    
+    Concurrent embed_query calls are coalesced: queries arriving within
+    BATCH_WINDOW seconds are sent as one request of up to MAX_BATCH texts.
+    A full batch is sent immediately instead of waiting out the window.
     """
     
+    MAX_BATCH = 64
+    BATCH_WINDOW = 0.01  # seconds
+    
     def __init__(self):
         self.jina_api_key = settings.jina_api_key
         self.use_jina = bool(self.jina_api_key)
         self.local_model = None
+        self._model_lock = threading.Lock()
         self.dimension = 768  # Default embedding dimension
+        self.cache = EmbeddingCache(
+            maxsize=settings.embedding_cache_size,
+            path=settings.get_embedding_cache_dir(),
+            max_disk_entries=settings.embedding_cache_disk_entries
+        )
+        # Shared client keeps the TLS connection to api.jina.ai alive across calls
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_full = asyncio.Event()
+        # Shared by every embed_documents call, so concurrent ingestion windows
+        # together stay within EMBED_MAX_CONCURRENT requests to Jina
+        self._embed_slots = asyncio.Semaphore(settings.embed_max_concurrent)
         
         if self.use_jina:
             logger.info("🌐 Using Jina AI Hub cloud for embeddings")
         else:
-            logger.info("🏠 Jina API key not found, loading local sentence-transformers model")
-            self._load_local_model()
+            # The model is loaded on first use so importing the backend stays fast
+            logger.info("🏠 Jina API key not found, using local sentence-transformers model")
+    
+    @property
+    def model_name(self) -> str:
+        """Name of the embedding model currently serving requests."""
+        return JINA_MODEL if self.use_jina else LOCAL_MODEL
     
     def _load_local_model(self):
-        """Load sentence-transformers model as fallback."""
-        try:
-            from sentence_transformers import SentenceTransformer
-            logger.info("Loading sentence-transformers model: all-mpnet-base-v2")
-            self.local_model = SentenceTransformer('all-mpnet-base-v2')
-            self.dimension = 768
-            logger.info("✅ Local model loaded successfully")
-        except Exception as e:
-            logger.error(f"❌ Failed to load local model: {e}")
-            raise RuntimeError("Could not initialize embeddings service") from e
+        """
+        Load sentence-transformers model as fallback.
+        
+        Blocking (imports torch and loads weights); call it from a worker
+        thread. Safe to call concurrently - the model is loaded once.
+        """
+        with self._model_lock:
+            if self.local_model is not None:
+                return
+            try:
+                from sentence_transformers import SentenceTransformer
+                backend = settings.local_embedding_backend
+                logger.info(f"Loading sentence-transformers model: {LOCAL_MODEL} (backend: {backend})")
+                
+                if backend == "torch":
+                    model = SentenceTransformer(LOCAL_MODEL)
+                    # FP16 only pays off on GPU; on CPU it is slower or unsupported
+                    if model.device.type == "cuda":
+                        model = model.half()
+                else:
+                    # ONNX Runtime / OpenVINO, optionally a quantized export such as
+                    # onnx/model_qint8_avx512_vnni.onnx
+                    model_kwargs = {}
+                    if settings.local_embedding_model_file:
+                        model_kwargs["file_name"] = settings.local_embedding_model_file
+                    model = SentenceTransformer(LOCAL_MODEL, backend=backend, model_kwargs=model_kwargs)
+                
+                self.local_model = model
+                self.dimension = 768
+                logger.info("✅ Local model loaded successfully")
+            except Exception as e:
+                logger.error(f"❌ Failed to load local model: {e}")
+                raise RuntimeError("Could not initialize embeddings service") from e
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    async def _embed_with_jina(self, texts: List[str]) -> List[List[float]]:
+    async def _embed_with_jina(self, texts: List[str]) -> np.ndarray:
         """
         Embed texts using Jina AI Hub cloud API.
         
@@ -64,78 +127,215 @@ class EmbeddingsService:
         }
         payload = {
             "input": texts,
-            "model": "jina-embeddings-v2-base-en"  # or jina-embeddings-v2-small-en
+            "model": JINA_MODEL,
+            # Raw little-endian float32 bytes instead of a JSON list of numbers,
+            # so no Python float is ever created per dimension
+            "embedding_type": "base64"
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Extract embeddings from response
-            embeddings = [item["embedding"] for item in data["data"]]
-            return embeddings
+        response = await self._client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        
+        # Extract embeddings from response as one contiguous float32 matrix
+        items = data["data"]
+        if items and isinstance(items[0]["embedding"], str):
+            raw = bytearray().join(base64.b64decode(item["embedding"]) for item in items)
+            # bytearray keeps the array writable, like the other embedding paths
+            return np.frombuffer(raw, dtype="<f4").reshape(len(items), -1)
+        return np.asarray([item["embedding"] for item in items], dtype=np.float32)
     
-    def _embed_with_local(self, texts: List[str]) -> List[List[float]]:
-        """Embed texts using local sentence-transformers model."""
+    async def _embed_with_local(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts using local sentence-transformers model.
+        
+        Loading and the CPU-bound forward pass run in the default executor
+        so they don't stall the event loop for concurrent requests.
+        """
+        loop = asyncio.get_running_loop()
         if self.local_model is None:
-            self._load_local_model()
+            await loop.run_in_executor(None, self._load_local_model)
         
-        embeddings = self.local_model.encode(texts, convert_to_numpy=True)
-        return embeddings.tolist()
+        embeddings = await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.local_model.encode,
+                texts,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+        )
+        return np.asarray(embeddings, dtype=np.float32)
     
-    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+    async def embed_texts(self, texts: List[str]) -> np.ndarray:
         """
         Embed a list of texts and return embeddings.
         
+        Texts already embedded by the current model are served from the
+        embedding cache; only the misses are sent to Jina or the local model.
+        
         Args:
             texts: List of text strings to embed
             
         Returns:
-            List of embedding vectors (each is a list of floats)
+            float32 array of shape (len(texts), dimension)
         
         Raises:
             Exception: If both Jina and local fallback fail
         """
         if not texts:
-            return []
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        embeddings = await self.cache.aget_many(self.model_name, texts)
+        misses = [i for i, vector in enumerate(embeddings) if vector is None]
+        
+        if not misses:
+            logger.debug("Embedding cache hit for all %d texts", len(texts))
+            return np.stack(embeddings)
+        
+        miss_texts = [texts[i] for i in misses]
+        model_name, computed = await self._embed_uncached(miss_texts)
+        
+        # Cache under the model that actually produced the vectors (Jina may have fallen back)
+        await self.cache.aset_many(model_name, miss_texts, computed)
+        if len(misses) == len(texts):
+            return computed
+        
+        for i, vector in zip(misses, computed):
+            embeddings[i] = vector
+        return np.stack(embeddings)
+    
+    async def embed_documents(
+        self,
+        texts: List[str],
+        batch_size: Optional[int] = None,
+        max_concurrent: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Embed many texts in fixed-size batches with bounded concurrency.
+        
+        Texts are grouped by length before batching, so each batch holds
+        similarly sized texts and the local model wastes less work on
+        padding. Batches run concurrently to overlap their network latency,
+        but all calls share EMBED_MAX_CONCURRENT request slots.
         
+        Args:
+            texts: Texts to embed (e.g. document chunks)
+            batch_size: Texts per request (default: settings.embed_batch_size)
+            max_concurrent: Optional tighter cap for this call's requests in flight
+        
+        Returns:
+            float32 array of shape (len(texts), dimension), aligned with texts
+        """
+        batch_size = batch_size or settings.embed_batch_size
+        call_slots = asyncio.Semaphore(max_concurrent) if max_concurrent else contextlib.nullcontext()
+        
+        async def _embed(batch: List[str]) -> np.ndarray:
+            async with call_slots, self._embed_slots:
+                return await self.embed_texts(batch)
+        
+        if len(texts) <= batch_size:
+            return await _embed(texts)
+        
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        order = np.argsort(lengths, kind="stable")
+        sorted_texts = [texts[i] for i in order.tolist()]
+        
+        results = await asyncio.gather(*(
+            _embed(sorted_texts[i:i + batch_size]) for i in range(0, len(sorted_texts), batch_size)
+        ))
+        
+        # Scatter rows back to the caller's order
+        embeddings = np.concatenate(results)
+        aligned = np.empty_like(embeddings)
+        aligned[order] = embeddings
+        return aligned
+    
+    async def _embed_uncached(self, texts: List[str]) -> Tuple[str, np.ndarray]:
+        """
+        Embed texts with Jina, falling back to the local model.
+        
+        Returns:
+            Tuple of (model name used, embedding vectors)
+        """
         try:
             if self.use_jina:
                 try:
-                    logger.debug(f"Embedding {len(texts)} texts with Jina")
+                    logger.debug("Embedding %d texts with Jina", len(texts))
                     embeddings = await self._embed_with_jina(texts)
-                    return embeddings
+                    return JINA_MODEL, embeddings
                 except Exception as e:
                     logger.warning(f"⚠️  Jina embedding failed: {e}. Falling back to local model.")
-                    # Fallback to local model
-                    if self.local_model is None:
-                        self._load_local_model()
-                    return self._embed_with_local(texts)
+                    # Fallback to local model (loaded on demand)
+                    return LOCAL_MODEL, await self._embed_with_local(texts)
             else:
-                logger.debug(f"Embedding {len(texts)} texts with local model")
-                return self._embed_with_local(texts)
+                logger.debug("Embedding %d texts with local model", len(texts))
+                return LOCAL_MODEL, await self._embed_with_local(texts)
                 
         except Exception as e:
             logger.error(f"❌ Embedding failed: {e}")
             raise
     
-    async def embed_query(self, query: str) -> List[float]:
+    async def embed_query(self, query: str) -> np.ndarray:
         """
         Embed a single query string.
         
+        Cache misses are queued and embedded together with any other
+        queries that arrive during the batching window.
+        
         Args:
             query: Query string to embed
             
         Returns:
-            Embedding vector as list of floats
+            Embedding vector as a 1-D float32 array
         """
-        embeddings = await self.embed_texts([query])
-        return embeddings[0] if embeddings else []
+        cached = (await self.cache.aget_many(self.model_name, [query]))[0]
+        if cached is not None:
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= self.MAX_BATCH:
+            self._batch_full.set()
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_pending())
+        
+        return await future
+    
+    async def _flush_pending(self):
+        """Drain queued queries in batches and resolve their futures."""
+        try:
+            await asyncio.wait_for(self._batch_full.wait(), self.BATCH_WINDOW)
+        except asyncio.TimeoutError:
+            pass
+        self._batch_full.clear()
+        
+        while self._pending:
+            batch = self._pending[:self.MAX_BATCH]
+            del self._pending[:self.MAX_BATCH]
+            
+            logger.debug("Flushing %d coalesced query embedding(s)", len(batch))
+            try:
+                embeddings = await self.embed_texts([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
     
     def get_dimension(self) -> int:
         """Get the dimension of embeddings produced by this service."""
         return self.dimension
+    
+    async def aclose(self):
+        """Close the shared HTTP client. Called on application shutdown."""
+        await self._client.aclose()
 
 
 # Global embeddings service instance
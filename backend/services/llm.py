@@ -3,18 +3,381 @@ KnowledgeExplorer LLM Service
 Groq wrapper with LangChain compatibility and streaming support
 """
 
+import asyncio
+import functools
+import hashlib
 import logging
-from typing import Any, List, Optional, Iterator, Dict
-import json
-from groq import Groq
-from tenacity import retry, stop_after_attempt, wait_exponential
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager, contextmanager, suppress
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Iterator, Dict, FrozenSet
+import httpx
+import numpy as np
+import orjson
+from groq import AsyncGroq, Groq, APIConnectionError, APIStatusError, RateLimitError
 from langchain.llms.base import LLM
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 
+try:
+    import ahocorasick  # optional: pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
 from backend_config import settings
+from services.cache import LRUCache, SemanticCache
 
 logger = logging.getLogger(__name__)
 
+# Document-specific keywords used by is_document_related_question
+DOCUMENT_KEYWORDS = (
+    'document', 'file', 'pdf', 'upload', 'this', 'resume', 'report',
+    'summarize', 'summary', 'what does', 'according to',
+    'in the', 'from the', 'based on', 'mentioned', 'describe',
+    'explain this', 'tell me about this', 'what is in',
+    'information about', 'details about', 'content', 'paper'
+)
+
+
+def _build_keyword_matcher():
+    """
+    Build a predicate reporting whether lowercased text contains any document keyword.
+    
+    Uses a pyahocorasick automaton (one linear pass over the text) when
+    installed, otherwise a single compiled regex alternation.
+    """
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for keyword in DOCUMENT_KEYWORDS:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    
+    pattern = re.compile("|".join(map(re.escape, DOCUMENT_KEYWORDS)))
+    return lambda text: pattern.search(text) is not None
+
+
+_contains_document_keyword = _build_keyword_matcher()
+
+# Prompt templates, split into the constant pieces joined around each request
+DEFAULT_RAG_INSTRUCTION = (
+    "You are a precise AI assistant that answers questions based on the provided context documents. "
+    "Follow these rules:\n"
+    "1. Use ONLY information from the context documents provided below\n"
+    "2. Provide clear, natural, and well-structured answers\n"
+    "3. Do NOT mention relevance scores or technical metadata in your answer\n"
+    "4. Write in a professional and conversational tone\n"
+    "5. If you cite sources, mention them naturally at the end like: 'Source: [filename]'\n"
+    "6. If the context doesn't contain the answer, say so politely\n"
+    "7. Do NOT include phrases like 'According to the document with relevance score...'"
+)
+_RAG_CONTEXT_HEADER = "\n\n=== CONTEXT DOCUMENTS ===\n"
+_RAG_CONTEXT_SEPARATOR = "\n\n---\n\n"
+_RAG_DOCUMENT_PREFIX = "[Document: "
+_RAG_QUESTION_HEADER = "\n\n=== END OF CONTEXT ===\n\nQuestion: "
+_RAG_ANSWER_FOOTER = (
+    "\n\nProvide a clear, natural answer using only the information above. "
+    "Do not mention relevance scores or technical details.\n\nAnswer:"
+)
+
+GENERAL_INSTRUCTION = (
+    "You are a helpful AI assistant. Answer the question clearly and accurately. "
+    "Provide informative, well-structured responses."
+)
+_GENERAL_PROMPT_PREFIX = GENERAL_INSTRUCTION + "\n\nQuestion: "
+_GENERAL_ANSWER_FOOTER = "\n\nAnswer:"
+
+# Precomputed SSE framing; events are yielded as bytes so Starlette
+# doesn't re-encode every chunk
+_SSE_DATA_SEP = b"\ndata: "
+_SSE_END = b"\n\n"
+_SSE_MESSAGE_PREFIX = b"event: message\ndata: "
+_SSE_NEWLINE = b"\n"
+
+
+def _sse_message(text: str) -> bytes:
+    """Frame text as an SSE message event, continuing embedded newlines as data lines."""
+    return _SSE_MESSAGE_PREFIX + text.encode("utf-8").replace(_SSE_NEWLINE, _SSE_DATA_SEP) + _SSE_END
+
+
+def format_context(filename: str, text: str) -> str:
+    """Render one retrieved chunk as it appears in the RAG prompt (no relevance score)."""
+    return "".join((_RAG_DOCUMENT_PREFIX, filename, "]\n", text))
+
+
+# Groq's completion stream is OpenAI-style SSE: one "data: {chunk}" line per delta
+_GROQ_DATA_PREFIX = b"data:"
+_GROQ_STREAM_DONE = b"[DONE]"
+
+
+def _parse_completion_line(line: bytes) -> Optional[str]:
+    """
+    Extract the token from one raw line of a streamed Groq completion.
+    
+    Args:
+        line: One SSE line, without its trailing newline
+    
+    Returns:
+        Delta content, or None for blank, non-data, final and empty lines
+    
+    Raises:
+        RuntimeError: If Groq reports an error inside the stream
+    """
+    if not line.startswith(_GROQ_DATA_PREFIX):
+        return None
+    payload = line[len(_GROQ_DATA_PREFIX):].strip()
+    if not payload or payload == _GROQ_STREAM_DONE:
+        return None
+    
+    chunk = orjson.loads(payload)
+    if "error" in chunk:
+        raise RuntimeError(f"Groq stream error: {chunk['error']}")
+    choices = chunk.get("choices")
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content") or None
+
+
+async def _iter_completion_tokens(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Yield tokens from the raw byte chunks of a streamed Groq completion.
+    
+    Lines are split and JSON-decoded straight from bytes with orjson, so no
+    per-chunk SDK model is built and nothing is decoded twice.
+    """
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            token = _parse_completion_line(line)
+            if token is not None:
+                yield token
+    
+    token = _parse_completion_line(pending)
+    if token is not None:
+        yield token
+
+
+def _context_sort_key(ctx: Dict[str, Any]) -> tuple:
+    """Stable ordering for RAG contexts: by file, then by chunk position."""
+    uid = ctx.get("metadata", {}).get("chunk_uid")
+    # Packed uids sort numerically in reading order; older vectors only have chunk_id
+    return (ctx.get("filename", ""), -1 if uid is None else uid, ctx.get("chunk_id", ""))
+
+
+# Questions longer than this are classified without caching to bound memory
+CLASSIFIER_CACHE_MAX_LEN = 512
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_question(normalized_question: str) -> bool:
+    """Return True if the normalized (lowercased) question contains a document keyword."""
+    return _contains_document_keyword(normalized_question)
+
+
+class _SlotWaiter:
+    """A caller queued in ConcurrencyController; woken when a slot is handed over."""
+    
+    __slots__ = ("event", "loop", "future", "granted")
+    
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+    
+    def wake(self) -> bool:
+        """Hand the slot to this waiter; False if it can no longer take it."""
+        if self.event is not None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # Event loop already closed
+            return False
+        return True
+    
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyController:
+    """
+    Client-side limiter for Groq requests.
+    
+    A slot count caps requests in flight, and an optional token bucket
+    (capacity and refill both derived from requests_per_minute) keeps the
+    request rate under the plan's RPM quota instead of discovering it via
+    429s. Waiting callers queue in one FIFO and a freed slot is handed
+    straight to the oldest one, so they are released in arrival order;
+    each reserves its rate token once it holds a slot.
+    
+    Sync callers block in slot(); coroutines use aslot(), which shares the
+    same queue and bucket but waits on a future instead of blocking the
+    event loop.
+    """
+    
+    def __init__(self, max_concurrent: int = 8, requests_per_minute: int = 0):
+        self._free_slots = max(1, max_concurrent)
+        self._waiters: Deque[_SlotWaiter] = deque()
+        self._rate = requests_per_minute / 60.0
+        self._capacity = float(requests_per_minute)
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _try_acquire(self, waiter: _SlotWaiter) -> bool:
+        """Take a free slot, or queue the waiter behind earlier ones."""
+        with self._lock:
+            if self._free_slots > 0 and not self._waiters:
+                self._free_slots -= 1
+                return True
+            self._waiters.append(waiter)
+            return False
+    
+    def _release_locked(self):
+        """Pass the slot to the oldest waiter, or return it to the pool. Hold _lock."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.wake():
+                waiter.granted = True
+                return
+        self._free_slots += 1
+    
+    def _release(self):
+        with self._lock:
+            self._release_locked()
+    
+    def _reserve_token(self) -> float:
+        """Take a token from the bucket and return how long to wait before using it."""
+        if self._rate <= 0:
+            return 0.0
+        
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            self._tokens -= 1
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        
+        if delay > 0:
+            logger.debug("⏳ Groq rate limit: waiting %.2fs", delay)
+        return delay
+    
+    @contextmanager
+    def slot(self):
+        """Hold a concurrency slot (and a rate token) for the duration of a request."""
+        waiter = _SlotWaiter()
+        if not self._try_acquire(waiter):
+            waiter.event.wait()
+        try:
+            delay = self._reserve_token()
+            if delay > 0:
+                time.sleep(delay)
+            yield
+        finally:
+            self._release()
+    
+    @asynccontextmanager
+    async def aslot(self):
+        """Async version of slot(); cancellation while waiting never leaks a slot."""
+        waiter = _SlotWaiter(asyncio.get_running_loop())
+        if not self._try_acquire(waiter):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter.granted:
+                        # Handed a slot just as we were cancelled; pass it on
+                        self._release_locked()
+                    else:
+                        self._waiters.remove(waiter)
+                raise
+        try:
+            delay = self._reserve_token()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            self._release()
+
+
+# Shared by all GroqLLM instances; Groq quotas are per API key, not per client
+groq_controller = ConcurrencyController(settings.groq_max_concurrent, settings.groq_requests_per_minute)
+
+# Retries per Groq call, and the first backoff in seconds (doubled per attempt).
+# Streams only retry opening the request: tokens already handed to the
+# caller can't be taken back
+GROQ_RETRY_ATTEMPTS = 3
+GROQ_RETRY_BASE = 0.5
+
+
+def _is_transient(error: Exception) -> bool:
+    """429s, 5xx responses and connection errors/timeouts (which never reached the model)."""
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and 500 <= error.status_code < 600
+
+
+def _retry_delay(attempt: int, base: float) -> float:
+    """Jittered exponential backoff before retry number attempt + 1."""
+    return base * 2 ** attempt + random.random() * 0.1
+
+
+async def _with_retry(
+    coro_fn: Callable[[], Awaitable[Any]],
+    *,
+    attempts: Optional[int] = None,
+    base: Optional[float] = None
+) -> Any:
+    """
+    Await coro_fn(), retrying transient Groq failures with jittered backoff.
+    
+    Args:
+        coro_fn: Zero-argument callable returning a fresh awaitable per attempt
+        attempts: Total attempts (default: GROQ_RETRY_ATTEMPTS)
+        base: First backoff in seconds (default: GROQ_RETRY_BASE)
+    
+    Raises:
+        The last error once attempts run out, or any non-transient error at once
+    """
+    attempts = attempts or GROQ_RETRY_ATTEMPTS
+    base = GROQ_RETRY_BASE if base is None else base
+    for attempt in range(attempts):
+        try:
+            return await coro_fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_transient(e):
+                raise
+            delay = _retry_delay(attempt, base)
+            logger.warning("🔁 Groq request failed (%s), retrying in %.2fs", e, delay)
+            await asyncio.sleep(delay)
+
+
+def _with_retry_sync(
+    fn: Callable[[], Any],
+    *,
+    attempts: Optional[int] = None,
+    base: Optional[float] = None
+) -> Any:
+    """Blocking _with_retry() for the synchronous Groq client."""
+    attempts = attempts or GROQ_RETRY_ATTEMPTS
+    base = GROQ_RETRY_BASE if base is None else base
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_transient(e):
+                raise
+            delay = _retry_delay(attempt, base)
+            logger.warning("🔁 Groq request failed (%s), retrying in %.2fs", e, delay)
+            time.sleep(delay)
+
 
 class GroqLLM(LLM):
     """
@@ -31,6 +394,7 @@ class GroqLLM(LLM):
     """
     
     client: Any = None
+    async_client: Any = None
     model: str = settings.groq_model
     temperature: float = settings.groq_temperature
     max_tokens: int = settings.groq_max_tokens
@@ -40,7 +404,15 @@ class GroqLLM(LLM):
         api_key = settings.groq_api_key
         if not api_key:
             raise ValueError("GROQ_API_KEY not found in environment")
-        self.client = Groq(api_key=api_key)
+        # One pooled HTTP/2 client so retries and later requests reuse the
+        # TLS connection; _with_retry owns retries, so the SDK's are disabled
+        limits = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        http_client = httpx.Client(http2=True, timeout=60.0, limits=limits)
+        self.client = Groq(api_key=api_key, http_client=http_client, max_retries=0)
+        # Streaming from request handlers goes through the async client so a
+        # long generation doesn't hold the event loop or a threadpool worker
+        async_http_client = httpx.AsyncClient(http2=True, timeout=60.0, limits=limits)
+        self.async_client = AsyncGroq(api_key=api_key, http_client=async_http_client, max_retries=0)
         logger.info(f"✅ GroqLLM initialized with model: {self.model}")
     
     @property
@@ -48,7 +420,6 @@ class GroqLLM(LLM):
         """Return identifier for LLM type."""
         return "groq"
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def _call(
         self,
         prompt: str,
@@ -68,18 +439,53 @@ class GroqLLM(LLM):
         Returns:
             Generated text response
         """
+        def attempt():
+            # A fresh slot per attempt, so backoff sleeps don't hold one
+            with groq_controller.slot():
+                return self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stop=stop,
+                )
+        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                stop=stop,
-            )
+            response = _with_retry_sync(attempt)
+            return response.choices[0].message.content
             
-            content = response.choices[0].message.content
-            logger.debug(f"Generated response: {len(content)} chars")
-            return content
+        except Exception as e:
+            logger.error(f"❌ Groq API call failed: {e}")
+            raise
+    
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        """
+        Async version of _call() on the shared AsyncGroq client.
+        
+        Args:
+            prompt: The prompt to send to the model
+            stop: Optional list of stop sequences
+            
+        Returns:
+            Generated text response
+        """
+        async def attempt():
+            async with groq_controller.aslot():
+                return await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stop=stop,
+                )
+        
+        try:
+            response = await _with_retry(attempt)
+            return response.choices[0].message.content
             
         except Exception as e:
             logger.error(f"❌ Groq API call failed: {e}")
@@ -101,22 +507,61 @@ class GroqLLM(LLM):
             Token strings as they are generated
         """
         try:
-            stream = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                stop=stop,
-                stream=True,
-            )
-            
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            # The slot is held until the stream finishes or the consumer stops iterating
+            with groq_controller.slot():
+                stream = _with_retry_sync(lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stop=stop,
+                    stream=True,
+                ))
+                
+                for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
                     
         except Exception as e:
             logger.error(f"❌ Groq streaming failed: {e}")
             raise
+    
+    async def astream_completion(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream completion tokens from Groq API without blocking the event loop.
+        
+        Args:
+            prompt: The prompt to send to the model
+            stop: Optional list of stop sequences
+            
+        Yields:
+            Token strings as they are generated
+        """
+        try:
+            # Read the raw response rather than the SDK's parsed chunk stream;
+            # the exit stack closes it once the stream ends or is abandoned
+            async with groq_controller.aslot(), AsyncExitStack() as stack:
+                response = await _with_retry(lambda: stack.enter_async_context(
+                    self.async_client.chat.completions.with_streaming_response.create(
+                        model=self.model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=self.temperature,
+                        max_tokens=self.max_tokens,
+                        stop=stop,
+                        stream=True,
+                    )
+                ))
+                
+                async for token in _iter_completion_tokens(response.iter_bytes()):
+                    yield token
+                
+        except Exception as e:
+            logger.error(f"❌ Groq streaming failed: {e}")
+            raise
 
 
 class LLMService:
@@ -127,8 +572,24 @@ class LLMService:
     - Standard completion
     - Token streaming with SSE formatting
     - RAG-optimized prompt templates
+    - Response caching (exact prompt match, then similar question match)
+    
+    Debug tips:
+    - Set LLM_CACHE_SIZE=0 and LLM_SEMANTIC_CACHE_SIZE=0 to always call Groq
+    - Cached answers are dropped when a source file is re-uploaded or deleted
+    - Set SSE_MAX_BATCH = 1 to get one message event per token
     """
     
+    # SSE token coalescing: the first frame carries one token (no TTFT cost),
+    # then frames grow geometrically up to SSE_MAX_BATCH tokens. A pending
+    # batch is flushed early once SSE_FLUSH_INTERVAL seconds have passed or
+    # it holds SSE_MAX_FRAME_CHARS characters (one proxy/TCP-sized chunk).
+    SSE_MIN_BATCH = 1
+    SSE_MAX_BATCH = 16
+    SSE_GROWTH_FACTOR = 2
+    SSE_FLUSH_INTERVAL = 0.04
+    SSE_MAX_FRAME_CHARS = 4096
+    
     def __init__(self):
         try:
             self.llm = GroqLLM()
@@ -137,6 +598,13 @@ class LLMService:
             logger.warning(f"⚠️  LLM service unavailable: {e}")
             self.available = False
             self.llm = None
+        
+        # prompt hash -> (answer, source files)
+        self.answer_cache = LRUCache(settings.llm_cache_size) if settings.llm_cache_size > 0 else None
+        self.semantic_cache = (
+            SemanticCache(settings.llm_semantic_cache_size, settings.llm_semantic_cache_threshold)
+            if settings.llm_semantic_cache_size > 0 else None
+        )
     
     def build_rag_prompt(
         self,
@@ -156,38 +624,27 @@ class LLMService:
             Formatted prompt string
         """
         if system_instruction is None:
-            system_instruction = (
-                "You are a precise AI assistant that answers questions based on the provided context documents. "
-                "Follow these rules:\n"
-                "1. Use ONLY information from the context documents provided below\n"
-                "2. Provide clear, natural, and well-structured answers\n"
-                "3. Do NOT mention relevance scores or technical metadata in your answer\n"
-                "4. Write in a professional and conversational tone\n"
-                "5. If you cite sources, mention them naturally at the end like: 'Source: [filename]'\n"
-                "6. If the context doesn't contain the answer, say so politely\n"
-                "7. Do NOT include phrases like 'According to the document with relevance score...'"
-            )
+            system_instruction = DEFAULT_RAG_INSTRUCTION
         
-        # Format contexts WITHOUT relevance scores (internal use only)
-        context_str = "\n\n---\n\n".join([
-            f"[Document: {ctx.get('filename', 'unknown')}]\n{ctx.get('text', '')}"
-            for i, ctx in enumerate(contexts)
+        # Order contexts by source position rather than retrieval score, so
+        # queries hitting the same chunks produce byte-identical prompt
+        # prefixes and provider-side prefix (KV) caches can reuse them
+        contexts = sorted(contexts, key=_context_sort_key)
+        
+        # Contexts from QueryPipeline.retrieve_documents arrive pre-rendered
+        fragments = _RAG_CONTEXT_SEPARATOR.join([
+            ctx.get("prompt_fragment") or format_context(ctx.get("filename", "unknown"), ctx.get("text", ""))
+            for ctx in contexts
         ])
+        parts = [system_instruction, _RAG_CONTEXT_HEADER, fragments]
         
-        prompt = f"""{system_instruction}
-
-=== CONTEXT DOCUMENTS ===
-{context_str}
-
-=== END OF CONTEXT ===
-
-Question: {question}
-
-Provide a clear, natural answer using only the information above. Do not mention relevance scores or technical details.
-
-Answer:"""
+        if logger.isEnabledFor(logging.DEBUG):
+            prefix_hash = hashlib.sha256("".join(parts).encode("utf-8")).hexdigest()[:12]
+            logger.debug(f"🧩 RAG prompt prefix {prefix_hash} ({len(contexts)} contexts)")
+        
+        parts += (_RAG_QUESTION_HEADER, question, _RAG_ANSWER_FOOTER)
         
-        return prompt
+        return "".join(parts)
     
     def build_general_prompt(self, question: str) -> str:
         """
@@ -199,18 +656,7 @@ Answer:"""
         Returns:
             Formatted prompt string
         """
-        system_instruction = (
-            "You are a helpful AI assistant. Answer the question clearly and accurately. "
-            "Provide informative, well-structured responses."
-        )
-        
-        prompt = f"""{system_instruction}
-
-Question: {question}
-
-Answer:"""
-        
-        return prompt
+        return "".join((_GENERAL_PROMPT_PREFIX, question, _GENERAL_ANSWER_FOOTER))
     
     def is_document_related_question(self, question: str) -> bool:
         """
@@ -222,26 +668,89 @@ Answer:"""
         Returns:
             True if question seems document-related, False otherwise
         """
-        question_lower = question.lower()
+        question_lower = question.strip().lower()
         
-        # Document-specific keywords
-        document_keywords = [
-            'document', 'file', 'pdf', 'upload', 'this', 'resume', 'report',
-            'summarize', 'summary', 'what does', 'according to',
-            'in the', 'from the', 'based on', 'mentioned', 'describe',
-            'explain this', 'tell me about this', 'what is in',
-            'information about', 'details about', 'content', 'paper'
-        ]
+        # Classification depends only on the text, so repeats are cached
+        if len(question_lower) > CLASSIFIER_CACHE_MAX_LEN:
+            return _classify_question.__wrapped__(question_lower)
+        return _classify_question(question_lower)
+    
+    def _cache_key(self, prompt: str) -> bytes:
+        """Build the exact-match cache key; model and temperature change the answer."""
+        return hashlib.sha256(
+            f"{self.llm.model}|{self.llm.temperature}|{prompt}".encode("utf-8")
+        ).digest()
+    
+    def _lookup_cached(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray],
+        source_files: FrozenSet[str]
+    ) -> Optional[str]:
+        """Return a cached answer for the prompt or a semantically equivalent question."""
+        if self.answer_cache is not None:
+            entry = self.answer_cache.get(self._cache_key(prompt))
+            if entry is not None:
+                logger.debug("⚡ LLM exact cache hit")
+                return entry[0]
+        
+        if self.semantic_cache is not None and query_vector is not None:
+            answer = self.semantic_cache.lookup(query_vector, source_files)
+            if answer is not None:
+                logger.debug("⚡ LLM semantic cache hit")
+                return answer
+        
+        return None
+    
+    def _store_cached(
+        self,
+        prompt: str,
+        answer: str,
+        query_vector: Optional[np.ndarray],
+        source_files: FrozenSet[str]
+    ):
+        """Remember an answer in both cache tiers."""
+        if self.answer_cache is not None:
+            self.answer_cache.set(self._cache_key(prompt), (answer, source_files))
+        if self.semantic_cache is not None and query_vector is not None:
+            self.semantic_cache.add(query_vector, answer, source_files)
+    
+    def invalidate(self, filename: Optional[str] = None) -> int:
+        """
+        Drop cached answers grounded in a source file.
+        
+        Args:
+            filename: File that was re-ingested or deleted; None drops all
+                document-grounded answers (e.g. after clearing the index)
+            
+        Returns:
+            Number of cache entries removed
+        """
+        removed = 0
+        if self.answer_cache is not None:
+            removed += self.answer_cache.remove_where(
+                lambda entry: bool(entry[1]) and (filename is None or filename in entry[1])
+            )
+        if self.semantic_cache is not None:
+            removed += self.semantic_cache.invalidate(filename)
         
-        # Check if question contains document-related keywords
-        return any(keyword in question_lower for keyword in document_keywords)
+        if removed:
+            logger.info(f"🧹 Invalidated {removed} cached answers for {filename or 'all documents'}")
+        return removed
     
-    def generate(self, prompt: str) -> str:
+    def generate(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> str:
         """
         Generate a completion for the given prompt.
         
         Args:
             prompt: Input prompt
+            query_vector: Optional question embedding for semantic cache lookups
+            source_files: Files the prompt's context came from (for invalidation)
             
         Returns:
             Generated text
@@ -249,14 +758,58 @@ Answer:"""
         if not self.available:
             raise RuntimeError("LLM service is not available")
         
-        return self.llm._call(prompt)
+        cached = self._lookup_cached(prompt, query_vector, source_files)
+        if cached is not None:
+            return cached
+        
+        answer = self.llm._call(prompt)
+        self._store_cached(prompt, answer, query_vector, source_files)
+        return answer
     
-    def stream_tokens(self, prompt: str) -> Iterator[str]:
+    async def agenerate(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> str:
+        """
+        Async version of generate(), awaiting the AsyncGroq client.
+        
+        Args:
+            prompt: Input prompt
+            query_vector: Optional question embedding for semantic cache lookups
+            source_files: Files the prompt's context came from (for invalidation)
+            
+        Returns:
+            Generated text
+        """
+        if not self.available:
+            raise RuntimeError("LLM service is not available")
+        
+        cached = self._lookup_cached(prompt, query_vector, source_files)
+        if cached is not None:
+            return cached
+        
+        answer = await self.llm._acall(prompt)
+        self._store_cached(prompt, answer, query_vector, source_files)
+        return answer
+    
+    def stream_tokens(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> Iterator[str]:
         """
         Stream tokens for the given prompt.
         
+        A cached answer is yielded as a single token. Answers are only
+        cached once the stream completes.
+        
         Args:
             prompt: Input prompt
+            query_vector: Optional question embedding for semantic cache lookups
+            source_files: Files the prompt's context came from (for invalidation)
             
         Yields:
             Token strings
@@ -264,9 +817,52 @@ Answer:"""
         if not self.available:
             raise RuntimeError("LLM service is not available")
         
-        yield from self.llm.stream_completion(prompt)
+        cached = self._lookup_cached(prompt, query_vector, source_files)
+        if cached is not None:
+            yield cached
+            return
+        
+        tokens = []
+        for token in self.llm.stream_completion(prompt):
+            tokens.append(token)
+            yield token
+        self._store_cached(prompt, "".join(tokens), query_vector, source_files)
     
-    def format_sse_event(self, event_type: str, data: Any) -> str:
+    async def astream_tokens(
+        self,
+        prompt: str,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> AsyncIterator[str]:
+        """
+        Async version of stream_tokens(), backed by the AsyncGroq client.
+        
+        Args:
+            prompt: Input prompt
+            query_vector: Optional question embedding for semantic cache lookups
+            source_files: Files the prompt's context came from (for invalidation)
+            
+        Yields:
+            Token strings
+        """
+        if not self.available:
+            raise RuntimeError("LLM service is not available")
+        
+        cached = self._lookup_cached(prompt, query_vector, source_files)
+        if cached is not None:
+            yield cached
+            return
+        
+        tokens = []
+        # Close the Groq stream (and its slot) as soon as this generator is
+        # closed, not when the inner generator is garbage-collected
+        async with aclosing(self.llm.astream_completion(prompt)) as stream:
+            async for token in stream:
+                tokens.append(token)
+                yield token
+        self._store_cached(prompt, "".join(tokens), query_vector, source_files)
+    
+    def format_sse_event(self, event_type: str, data: Any) -> bytes:
         """
         Format data as Server-Sent Event.
         
@@ -275,50 +871,114 @@ Answer:"""
             data: Data to send (will be JSON-encoded if dict)
             
         Returns:
-            Formatted SSE string
+            UTF-8 encoded SSE frame
         """
+        # Token frames are the hot path: plain text, no JSON encoding
+        if event_type == "message" and isinstance(data, str):
+            return _sse_message(data)
+        
         if isinstance(data, dict):
-            data_str = json.dumps(data)
+            payload = orjson.dumps(data)
         else:
-            data_str = str(data)
+            payload = str(data).encode("utf-8")
         
-        return f"event: {event_type}\ndata: {data_str}\n\n"
+        return b"event: " + event_type.encode("utf-8") + _SSE_DATA_SEP + payload + _SSE_END
     
-    def stream_sse_tokens(
+    async def stream_sse_tokens(
         self,
         prompt: str,
-        metadata: Optional[Dict[str, Any]] = None
-    ) -> Iterator[str]:
+        metadata: Optional[Dict[str, Any]] = None,
+        query_vector: Optional[np.ndarray] = None,
+        source_files: FrozenSet[str] = frozenset()
+    ) -> AsyncIterator[bytes]:
         """
         Stream tokens as SSE events.
         
         Args:
             prompt: Input prompt
             metadata: Optional metadata to send before streaming
+            query_vector: Optional question embedding for semantic cache lookups
+            source_files: Files the prompt's context came from (for invalidation)
             
         Yields:
-            SSE-formatted event strings
+            UTF-8 encoded SSE frames
         """
+        # Open the Groq stream now so the request is in flight while the
+        # metadata frame is serialized and sent; None marks the end
+        tokens = self.astream_tokens(prompt, query_vector, source_files)
+        next_token = asyncio.ensure_future(anext(tokens, None))
+        
         try:
             # Send metadata if provided
             if metadata:
                 yield self.format_sse_event("metadata", metadata)
             
-            # Stream tokens
-            full_response = []
-            for token in self.stream_tokens(prompt):
-                full_response.append(token)
-                yield self.format_sse_event("message", token)
+            # Stream tokens, coalescing them into progressively larger frames.
+            # Only counts are kept: clients assemble the answer from message
+            # events, and astream_tokens already collects it for the cache
+            token_count = 0
+            char_count = 0
+            buffer: List[str] = []
+            buffered_chars = 0
+            batch_size = self.SSE_MIN_BATCH
+            last_flush = time.monotonic()
+            
+            token = await next_token
+            while token is not None:
+                token_count += 1
+                buffer.append(token)
+                buffered_chars += len(token)
+                next_token = asyncio.ensure_future(anext(tokens, None))
+                
+                waited = time.monotonic() - last_flush
+                flush = (
+                    len(buffer) >= batch_size
+                    or buffered_chars >= self.SSE_MAX_FRAME_CHARS
+                    or waited >= self.SSE_FLUSH_INTERVAL
+                )
+                if not flush:
+                    # A pause in the Groq stream must not hold buffered
+                    # tokens past the interval
+                    done, _ = await asyncio.wait({next_token}, timeout=self.SSE_FLUSH_INTERVAL - waited)
+                    flush = not done
+                
+                if flush:
+                    yield _sse_message("".join(buffer))
+                    buffer.clear()
+                    char_count += buffered_chars
+                    buffered_chars = 0
+                    last_flush = time.monotonic()
+                    batch_size = min(self.SSE_MAX_BATCH, batch_size * self.SSE_GROWTH_FACTOR)
+                
+                token = await next_token
             
-            # Send done event with full response
+            if buffer:
+                yield _sse_message("".join(buffer))
+                char_count += buffered_chars
+            
+            # Send done event with the answer's size
             yield self.format_sse_event("done", {
-                "answer": "".join(full_response),
-                "token_count": len(full_response)
+                "token_count": token_count,
+                "char_count": char_count
             })
             
         except Exception as e:
             logger.error(f"❌ SSE streaming error: {e}")
             yield self.format_sse_event("error", {"error": str(e)})
+        
+        finally:
+            # Client disconnected: stop the pending read, then close the token
+            # stream now so the Groq slot and HTTP response are released even
+            # if it was parked at a yield
+            next_token.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration):
+                await asyncio.wait({next_token})
+                await tokens.aclose()
+    
+    async def aclose(self):
+        """Close the async Groq client. Called on application shutdown."""
+        if self.llm is not None:
+            await self.llm.async_client.close()
 
 
 # Global LLM service instance
@@ -0,0 +1,291 @@
+"""
+KnowledgeExplorer Local Vector Index
+In-process exact cosine search that can answer queries without a Pinecone round trip
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _filename_from_filter(filter: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Extract the filename from a single-filename metadata filter.
+    
+    Returns:
+        The filename, "" for no filter, or None if the filter is not of that form
+    """
+    if not filter:
+        return ""
+    if len(filter) != 1 or "filename" not in filter:
+        return None
+    condition = filter["filename"]
+    if isinstance(condition, str):
+        return condition
+    if isinstance(condition, dict) and len(condition) == 1 and isinstance(condition.get("$eq"), str):
+        return condition["$eq"]
+    return None
+
+
+class LocalVectorIndex:
+    """
+    Shadow copy of a small Pinecone index, searched with one matrix product.
+    
+    Rows are L2-normalized float32 vectors, so a dot product is the cosine
+    score Pinecone would report. The copy is only trusted once it holds the
+    whole corpus: it is loaded from Pinecone when the service connects and
+    then follows every upsert and delete made through VectorStoreService.
+    Anything it cannot mirror (a corpus over capacity, a delete by an
+    arbitrary filter) disables it and queries go back to Pinecone.
+    
+    With quantize=True rows are stored as int8 with a per-row scale (4x
+    less memory); they are converted back to float32 a block at a time
+    for scoring, which keeps the BLAS matrix-vector product and costs
+    about 1e-3 in score accuracy.
+    
+    Debug tips:
+    - Only safe with a single writer process; other writers make it stale
+    - Loading costs one list and one fetch request per 100 vectors at startup
+    - Filters other than a single filename equality are sent to Pinecone
+    """
+    
+    # Vectors per list/fetch request while loading (Pinecone's page limit)
+    LOAD_PAGE_SIZE = 100
+    # Quantized rows dequantized per scoring step (bounds the float32 scratch)
+    SCORE_BLOCK_ROWS = 4096
+    
+    def __init__(self, capacity: int, quantize: bool = False):
+        self.capacity = capacity
+        self.quantize = quantize
+        self.ready = False
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None  # per-row int8 scale when quantized
+        self._size = 0
+        self._ids: List[str] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def load(self, index: Any, total_vectors: int) -> bool:
+        """
+        Copy every vector of a Pinecone index, if the corpus fits.
+        
+        Args:
+            index: Pinecone data-plane index client
+            total_vectors: Vector count reported by describe_index_stats
+        
+        Returns:
+            True if the local index is now ready to answer queries
+        """
+        if total_vectors > self.capacity:
+            logger.info("📦 Local index disabled: %d vectors exceed capacity %d", total_vectors, self.capacity)
+            self.disable()
+            return False
+        
+        try:
+            for page in index.list(limit=self.LOAD_PAGE_SIZE):
+                ids = [item.id for item in page.vectors]
+                fetched = index.fetch(ids=ids).vectors
+                vectors = [fetched[vid] for vid in ids if vid in fetched]
+                if not self.add(
+                    [v.id for v in vectors],
+                    np.asarray([v.values for v in vectors], dtype=np.float32),
+                    [v.metadata for v in vectors]
+                ):
+                    return False
+        except Exception as e:
+            logger.warning("⚠️  Local index disabled, failed to load vectors: %s", e)
+            self.disable()
+            return False
+        
+        self.ready = True
+        logger.info("📦 Local index loaded with %d vectors", self._size)
+        return True
+    
+    def add(
+        self,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Sequence[Optional[Dict[str, Any]]]
+    ) -> bool:
+        """
+        Insert or overwrite vectors by id.
+        
+        Returns:
+            False if the index went over capacity and was disabled
+        """
+        if not len(ids):
+            return True
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        scales = np.ones(len(vectors), dtype=np.float32)
+        if self.quantize:
+            peaks = np.abs(vectors).max(axis=1) / 127
+            scales = np.where(peaks > 0, peaks, 1.0).astype(np.float32)
+            vectors = np.rint(vectors / scales[:, np.newaxis]).astype(np.int8)
+        
+        with self._lock:
+            if self._matrix is None:
+                rows = max(len(ids), 1024)
+                self._matrix = np.empty((rows, vectors.shape[1]), dtype=vectors.dtype)
+                self._scales = np.empty(rows, dtype=np.float32)
+            
+            for vid, row, scale, meta in zip(ids, vectors, scales, metadata):
+                position = self._rows.get(vid)
+                if position is None:
+                    if self._size >= self.capacity:
+                        break
+                    position = self._append_row()
+                    self._ids.append(vid)
+                    self._metadata.append(meta)
+                    self._rows[vid] = position
+                else:
+                    self._metadata[position] = meta
+                self._matrix[position] = row
+                self._scales[position] = scale
+            else:
+                return True
+        
+        logger.info("📦 Local index disabled: corpus grew past capacity %d", self.capacity)
+        self.disable()
+        return False
+    
+    def _append_row(self) -> int:
+        """Reserve the next row, doubling the matrix when it is full. Call with the lock held."""
+        if self._size == len(self._matrix):
+            grown = np.empty((2 * len(self._matrix), self._matrix.shape[1]), dtype=self._matrix.dtype)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            grown_scales = np.empty(len(grown), dtype=np.float32)
+            grown_scales[:self._size] = self._scales[:self._size]
+            self._scales = grown_scales
+        self._size += 1
+        return self._size - 1
+    
+    def delete_filename(self, filename: str) -> int:
+        """
+        Drop every vector whose metadata names the given file.
+        
+        Returns:
+            Number of vectors removed
+        """
+        with self._lock:
+            keep = [i for i, meta in enumerate(self._metadata) if (meta or {}).get("filename") != filename]
+            removed = self._size - len(keep)
+            if removed:
+                self._compact(keep)
+            return removed
+    
+    def delete_ids(self, ids: Sequence[str]) -> int:
+        """
+        Drop the vectors with the given ids.
+        
+        Returns:
+            Number of vectors removed
+        """
+        with self._lock:
+            doomed = {self._rows[vid] for vid in ids if vid in self._rows}
+            if doomed:
+                self._compact([i for i in range(self._size) if i not in doomed])
+            return len(doomed)
+    
+    def _compact(self, keep: List[int]):
+        """Keep only the given rows, in order. Call with the lock held."""
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._scales[:len(keep)] = self._scales[keep]
+        self._ids = [self._ids[i] for i in keep]
+        self._metadata = [self._metadata[i] for i in keep]
+        self._rows = {vid: position for position, vid in enumerate(self._ids)}
+        self._size = len(keep)
+    
+    def clear(self):
+        """Drop all vectors; the (now empty) copy is still complete."""
+        with self._lock:
+            self._matrix = None
+            self._scales = None
+            self._size = 0
+            self._ids = []
+            self._metadata = []
+            self._rows = {}
+    
+    def disable(self):
+        """Stop answering queries and free the copy."""
+        self.ready = False
+        self.clear()
+    
+    def query(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        include_metadata: bool = True
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Find the top_k most similar vectors, formatted like VectorStoreService.query_vector.
+        
+        Args:
+            query_vector: Query embedding
+            top_k: Number of results to return
+            filter: Optional metadata filter (only a single filename equality is supported)
+            include_metadata: Whether to include metadata in results
+        
+        Returns:
+            Matches sorted by descending score, or None if Pinecone must answer instead
+        """
+        if not self.ready:
+            return None
+        filename = _filename_from_filter(filter)
+        if filename is None:
+            return None
+        
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        
+        with self._lock:
+            if self._size == 0:
+                return []
+            scores = self._scores(query)
+            if filename:
+                mask = np.fromiter(
+                    ((meta or {}).get("filename") == filename for meta in self._metadata),
+                    dtype=bool,
+                    count=self._size
+                )
+                scores = np.where(mask, scores, -np.inf)
+            
+            k = min(top_k, self._size)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [
+                self._result(int(i), float(scores[i]), include_metadata)
+                for i in best if scores[i] != -np.inf
+            ]
+    
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine scores of every row against a normalized query. Call with the lock held."""
+        if not self.quantize:
+            return self._matrix[:self._size] @ query
+        
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, self.SCORE_BLOCK_ROWS):
+            end = min(start + self.SCORE_BLOCK_ROWS, self._size)
+            scores[start:end] = self._matrix[start:end].astype(np.float32) @ query
+        return scores * self._scales[:self._size]
+    
+    def _result(self, position: int, score: float, include_metadata: bool) -> Dict[str, Any]:
+        """Format one row as a query match. Call with the lock held."""
+        result = {"id": self._ids[position], "score": score}
+        if include_metadata:
+            result["metadata"] = self._metadata[position]
+        return result
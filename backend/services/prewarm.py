@@ -0,0 +1,245 @@
+"""
+KnowledgeExplorer Batch Prewarm Service
+Offline chunk summaries via Groq's batch API, used to warm the semantic answer cache
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
+
+from backend_config import settings
+from services.llm import llm_service
+
+logger = logging.getLogger(__name__)
+
+PREWARM_INSTRUCTION = (
+    "Summarize the following document excerpt in a few sentences. "
+    "Only use information from the excerpt.\n\nExcerpt:\n"
+)
+
+# Batch states after which Groq will not produce (more) output
+_FAILED_STATES = {"failed", "expired", "cancelled"}
+
+
+@dataclass
+class _PendingBatch:
+    """A submitted batch and what is needed to turn its results into cache entries."""
+    
+    filename: str
+    submitted_at: float
+    prompts: Dict[str, str] = field(default_factory=dict)  # custom_id -> prompt
+    vectors: Dict[str, np.ndarray] = field(default_factory=dict)  # custom_id -> chunk embedding
+
+
+class BatchPrewarmService:
+    """
+    Pre-generates chunk summaries at ingest time through Groq's batch API.
+    
+    Batch jobs cost about half as much as online completions and run
+    asynchronously, so they never compete with interactive queries. When a
+    batch completes, each summary is added to the LLM semantic cache under
+    its chunk's embedding (a question that embeds almost exactly like a
+    chunk gets its summary without a Groq call). Batches still running
+    after BATCH_PREWARM_TIMEOUT seconds are cancelled and their prompts are
+    answered with the standard online API instead.
+    
+    Debug tips:
+    - Disabled unless ENABLE_BATCH_PREWARM=true and the LLM service is available
+    - Pending batches live in memory only and are lost on restart
+    - Warmed entries share LLM_SEMANTIC_CACHE_SIZE with online answers
+    """
+    
+    # Tokens allowed per pre-generated summary
+    SUMMARY_MAX_TOKENS = 256
+    
+    def __init__(self):
+        self.enabled = settings.enable_batch_prewarm and llm_service.available
+        self._pending: Dict[str, _PendingBatch] = {}
+    
+    @property
+    def pending(self) -> int:
+        """Number of batches submitted and not yet collected."""
+        return len(self._pending)
+    
+    def submit(
+        self,
+        filename: str,
+        chunk_ids: List[str],
+        texts: List[str],
+        embeddings: np.ndarray
+    ) -> Optional[str]:
+        """
+        Submit a batch of summary prompts for the given chunks.
+        
+        Args:
+            filename: File the chunks belong to
+            chunk_ids: Identifiers of the chunks, unique within the file
+            texts: Chunk texts, aligned with chunk_ids
+            embeddings: Chunk embeddings, aligned with chunk_ids
+        
+        Returns:
+            Groq batch id, or None if prewarming is disabled or there was nothing to submit
+        """
+        if not self.enabled or not texts:
+            return None
+        
+        llm = llm_service.llm
+        pending = _PendingBatch(filename=filename, submitted_at=time.monotonic())
+        lines = []
+        for chunk_id, text, vector in zip(chunk_ids, texts, embeddings):
+            custom_id = f"{filename}:{chunk_id}"
+            prompt = PREWARM_INSTRUCTION + text
+            pending.prompts[custom_id] = prompt
+            pending.vectors[custom_id] = vector
+            lines.append(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": llm.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": llm.temperature,
+                    "max_tokens": self.SUMMARY_MAX_TOKENS
+                }
+            }))
+        
+        input_file = llm.client.files.create(
+            file=(f"{filename}.prewarm.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = llm.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"filename": filename}
+        )
+        
+        self._pending[batch.id] = pending
+        logger.info("📦 Submitted prewarm batch %s for %s (%d chunks)", batch.id, filename, len(lines))
+        return batch.id
+    
+    def discard(self, filename: Optional[str] = None) -> int:
+        """
+        Forget pending batches for a file so stale summaries are never cached.
+        
+        Args:
+            filename: File that was deleted or re-ingested; None discards all
+        
+        Returns:
+            Number of batches discarded
+        """
+        batch_ids = [
+            batch_id for batch_id, pending in self._pending.items()
+            if filename is None or pending.filename == filename
+        ]
+        for batch_id in batch_ids:
+            del self._pending[batch_id]
+        return len(batch_ids)
+    
+    def poll(self) -> int:
+        """
+        Check pending batches once and cache the results of finished ones.
+        
+        Returns:
+            Number of summaries added to the semantic cache
+        """
+        return self._store_finished(self._fetch_finished())
+    
+    def _fetch_finished(self) -> List[Tuple[str, _PendingBatch, Dict[str, str]]]:
+        """
+        Collect the answers of finished batches without touching the cache.
+        
+        Makes blocking Groq calls, so run() calls this from a worker thread.
+        
+        Returns:
+            (batch_id, pending, answers) per finished batch; answers is empty for failed ones
+        """
+        finished = []
+        client = llm_service.llm.client
+        
+        for batch_id, pending in list(self._pending.items()):
+            answers: Dict[str, str] = {}
+            try:
+                batch = client.batches.retrieve(batch_id)
+                
+                if batch.status == "completed":
+                    output = client.files.content(batch.output_file_id).read() if batch.output_file_id else b""
+                    answers = self._parse_results(output)
+                elif batch.status in _FAILED_STATES:
+                    logger.warning("⚠️  Prewarm batch %s ended as %s", batch_id, batch.status)
+                elif time.monotonic() - pending.submitted_at > settings.batch_prewarm_timeout:
+                    logger.warning("⏳ Prewarm batch %s timed out, falling back to online calls", batch_id)
+                    client.batches.cancel(batch_id)
+                    answers = self._generate_online(pending)
+                else:
+                    continue
+            
+            except Exception as e:
+                logger.error("❌ Prewarm batch %s failed: %s", batch_id, e)
+            
+            finished.append((batch_id, pending, answers))
+        
+        return finished
+    
+    def _store_finished(self, finished: List[Tuple[str, _PendingBatch, Dict[str, str]]]) -> int:
+        """Cache the answers of finished batches and stop tracking them."""
+        warmed = 0
+        for batch_id, pending, answers in finished:
+            if answers:
+                warmed += self._store(pending, answers)
+            # Finished one way or another; a discard during the calls above wins
+            self._pending.pop(batch_id, None)
+        return warmed
+    
+    @staticmethod
+    def _parse_results(output: bytes) -> Dict[str, str]:
+        """Extract the successful responses of a batch output file."""
+        answers = {}
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = orjson.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            answers[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return answers
+    
+    @staticmethod
+    def _generate_online(pending: _PendingBatch) -> Dict[str, str]:
+        """Answer a timed-out batch's prompts with the standard completion API."""
+        return {
+            custom_id: llm_service.llm._call(prompt)
+            for custom_id, prompt in pending.prompts.items()
+        }
+    
+    def _store(self, pending: _PendingBatch, answers: Dict[str, str]) -> int:
+        """Put answers into the semantic cache unless the file was discarded meanwhile."""
+        cache = llm_service.semantic_cache
+        if cache is None or not any(p is pending for p in self._pending.values()):
+            return 0
+        
+        source_files = frozenset({pending.filename})
+        for custom_id, answer in answers.items():
+            cache.add(pending.vectors[custom_id], answer, source_files)
+        
+        logger.info("🔥 Prewarmed %d answers for %s", len(answers), pending.filename)
+        return len(answers)
+    
+    async def run(self):
+        """Poll pending batches forever; started from the app lifespan when enabled."""
+        while True:
+            await asyncio.sleep(settings.batch_prewarm_poll_interval)
+            if self._pending:
+                # Groq calls run in a worker; the cache is only written here on the
+                # loop, where LLMService reads it and discard() runs
+                finished = await asyncio.to_thread(self._fetch_finished)
+                self._store_finished(finished)
+
+
+# Global batch prewarm service instance
+prewarm_service = BatchPrewarmService()
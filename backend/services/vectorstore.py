@@ -3,15 +3,217 @@ KnowledgeExplorer Vector Store Service
 Pinecone wrapper for vector storage and retrieval
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, AsyncIterator, Optional, Set, Tuple, Union
+import numpy as np
+import orjson
 from pinecone import Pinecone, ServerlessSpec
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import Retrying, retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 
 from backend_config import settings
+from services.cache import SemanticCache
+from services.local_index import LocalVectorIndex, _filename_from_filter
 
 logger = logging.getLogger(__name__)
 
+# Caller errors (bad arguments, index not initialized) fail the same way on
+# every attempt, so they are raised immediately instead of retried
+NON_RETRYABLE_ERRORS = (ValueError, RuntimeError)
+
+# Retry policy for Pinecone requests. Batched upserts apply it per attempt
+# and resend only the batches that failed
+PINECONE_RETRY_POLICY = dict(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_not_exception_type(NON_RETRYABLE_ERRORS),
+    reraise=True
+)
+
+
+# (millisecond timestamp, next sequence number) of the last generated id,
+# so ids keep increasing across _generate_ids calls in the same millisecond
+_id_clock = [0, 0]
+_id_lock = threading.Lock()
+_ID_SEQUENCE_LIMIT = 1 << 32
+
+
+def _generate_ids(n: int) -> List[str]:
+    """
+    Generate n time-ordered UUIDv7 strings, increasing in generation order.
+    
+    A 32-bit sequence number (the 12 rand_a bits plus the top 20 rand_b
+    bits) orders ids within one millisecond and carries on across calls;
+    if the clock stalls, goes backwards or the sequence runs out, the last
+    timestamp is reused or advanced by one. The remaining 42 bits are
+    random, read from a single os.urandom() call.
+    """
+    with _id_lock:
+        now_ms = time.time_ns() // 1_000_000
+        last_ms, seq = _id_clock
+        if now_ms > last_ms:
+            last_ms, seq = now_ms, 0
+        elif seq + n > _ID_SEQUENCE_LIMIT:
+            last_ms, seq = last_ms + 1, 0
+        _id_clock[:] = [last_ms, seq + n]
+    
+    prefix = last_ms << 80 | 0x7 << 76 | 0b10 << 62
+    randomness = os.urandom(6 * n)
+    ids = []
+    for i in range(seq, seq + n):
+        tail = int.from_bytes(randomness[6 * (i - seq):6 * (i - seq) + 6], "big") & 0x3FFFFFFFFFF
+        digits = f"{prefix | (i >> 20) << 64 | (i & 0xFFFFF) << 42 | tail:032x}"
+        ids.append(f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}")
+    return ids
+
+
+# Operators Pinecone's metadata index evaluates, per field and across clauses
+FILTER_OPERATORS = frozenset({"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$exists"})
+LOGICAL_OPERATORS = frozenset({"$and", "$or"})
+
+# Index names this process has connected to; re-initializing (e.g. after
+# close()) skips the list_indexes() round trip for them
+_KNOWN_INDEXES: Set[str] = set()
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row of a float32 matrix (or a single vector); zero rows stay zero."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _validate_filter(filter: Dict[str, Any]):
+    """
+    Check that a metadata filter only uses operators Pinecone supports.
+    
+    A bare value is shorthand for $eq. Raising here as ValueError means a
+    malformed filter fails once, instead of being rejected by Pinecone on
+    every retry.
+    
+    Raises:
+        ValueError: If the filter uses an unknown operator or a malformed condition
+    """
+    if not isinstance(filter, dict) or not filter:
+        raise ValueError(f"Filter must be a non-empty dict, got {filter!r}")
+    
+    for field_name, condition in filter.items():
+        if field_name in LOGICAL_OPERATORS:
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{field_name} takes a non-empty list of filters")
+            for clause in condition:
+                _validate_filter(clause)
+        elif field_name.startswith("$"):
+            raise ValueError(f"Unsupported filter operator: {field_name}")
+        elif isinstance(condition, dict):
+            if not condition:
+                raise ValueError(f"Empty condition for filter field {field_name!r}")
+            for operator, value in condition.items():
+                if operator not in FILTER_OPERATORS:
+                    raise ValueError(f"Unsupported filter operator for {field_name!r}: {operator}")
+                if operator in ("$in", "$nin") and not isinstance(value, list):
+                    raise ValueError(f"{operator} on {field_name!r} takes a list")
+        elif not isinstance(condition, (str, int, float, bool)):
+            raise ValueError(f"Unsupported filter value for {field_name!r}: {condition!r}")
+
+
+def _query_options(top_k: int, filter: Optional[Dict[str, Any]], include_metadata: bool) -> tuple:
+    """Hashable form of a query's options, part of every query cache entry."""
+    return (top_k, orjson.dumps(filter, option=orjson.OPT_SORT_KEYS) if filter else None, include_metadata)
+
+
+class UpsertBatchTuner:
+    """
+    Adapts the Pinecone upsert batch size to observed latency.
+    
+    Each upsert call's wall time is converted to seconds per wave (the
+    batches the client sends together, up to its concurrency) and folded
+    into an EWMA. Fast waves double the batch size; slow waves or batches
+    that failed retryably (429s, timeouts, 5xx) halve it, always within
+    [MIN_BATCH_SIZE, MAX_BATCH_SIZE]. Every new size is written to a small
+    JSON file so a restart resumes from the last tuned value.
+    """
+    
+    MIN_BATCH_SIZE = 16
+    MAX_BATCH_SIZE = 1000  # Pinecone's limit on vectors per upsert request
+    # Seconds per wave below which batches grow, and above which they shrink
+    FAST_WAVE_SECONDS = 0.5
+    SLOW_WAVE_SECONDS = 2.0
+    # Weight of the newest observation in the latency EWMA
+    EWMA_ALPHA = 0.3
+    
+    def __init__(self, initial: int, state_path: str = ""):
+        self.state_path = state_path
+        self.latency_ewma: Optional[float] = None
+        self._lock = threading.Lock()
+        self.batch_size = self._clamp(self._load() or initial)
+    
+    def _clamp(self, batch_size: int) -> int:
+        return max(self.MIN_BATCH_SIZE, min(self.MAX_BATCH_SIZE, int(batch_size)))
+    
+    def _load(self) -> Optional[int]:
+        """Read the saved batch size, if there is a readable one."""
+        if not self.state_path:
+            return None
+        try:
+            return int(orjson.loads(Path(self.state_path).read_bytes())["batch_size"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    def _save(self, batch_size: int):
+        if not self.state_path:
+            return
+        try:
+            path = Path(self.state_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(orjson.dumps({"batch_size": batch_size}))
+        except OSError as e:
+            logger.warning("⚠️  Failed to save upsert batch size: %s", e)
+    
+    def record(self, items: int, batch_size: int, concurrency: int, elapsed: float, throttled: bool = False):
+        """
+        Fold one upsert call into the latency estimate and adjust the batch size.
+        
+        Args:
+            items: Vectors sent by the call
+            batch_size: Batch size the call used
+            concurrency: Batches the client kept in flight
+            elapsed: Wall time of the call in seconds
+            throttled: Whether any batch failed retryably (or the call raised)
+        """
+        with self._lock:
+            # Measured at a size that has since been changed by another call
+            if batch_size != self.batch_size:
+                return
+            
+            batches = -(-items // batch_size)
+            waves = max(1, -(-batches // max(1, concurrency)))
+            per_wave = elapsed / waves
+            self.latency_ewma = per_wave if self.latency_ewma is None else (
+                self.EWMA_ALPHA * per_wave + (1 - self.EWMA_ALPHA) * self.latency_ewma
+            )
+            
+            if throttled or self.latency_ewma > self.SLOW_WAVE_SECONDS:
+                new_size = self._clamp(batch_size // 2)
+            elif items >= batch_size and self.latency_ewma < self.FAST_WAVE_SECONDS:
+                # Only a full batch says anything about larger ones
+                new_size = self._clamp(batch_size * 2)
+            else:
+                return
+            if new_size == batch_size:
+                return
+            
+            self.batch_size = new_size
+            self.latency_ewma = None
+        
+        logger.info("📦 Upsert batch size %d -> %d (%.2fs per wave)", batch_size, new_size, per_wave)
+        self._save(new_size)
+
 
 class VectorStoreService:
     """
@@ -21,32 +223,95 @@ class VectorStoreService:
     - Check Pinecone dashboard to verify index exists
     - Ensure dimension matches your embedding model (768 for mpnet, 1024 for jina-v2)
     - Verify PINECONE_ENV matches your Pinecone project region
+    - The client is created on first use, not at import; it and the index
+      connection pools are reused by every request until close() runs
+    - Set QUERY_CACHE_SIZE=0 to send every query to Pinecone
+    - LOCAL_INDEX_MAX_VECTORS>0 answers queries for small corpora in-process
+    - Upserts skip vectors already stored for the same file by this process
     """
     
+    # Recently upserted (filename, vector digest) pairs remembered for dedup
+    UPSERT_DEDUP_SIZE = 200_000
+    # Pinecone accepts at most 1000 ids per delete request
+    DELETE_BATCH_SIZE = 1000
+    
     def __init__(self):
         self.api_key = settings.pinecone_api_key
         self.environment = settings.pinecone_env
         self.index_name = settings.pinecone_index
-        self.pc = None
+        self.pool_size = settings.pinecone_pool_size
+        self.use_grpc = settings.pinecone_use_grpc
+        self.upsert_batch_size = settings.pinecone_upsert_batch_size
+        self.upsert_concurrency = settings.pinecone_upsert_concurrency
+        # Picks batch sizes for upserts that don't pass one explicitly
+        self.batch_tuner = (
+            UpsertBatchTuner(self.upsert_batch_size, settings.get_upsert_tuning_path())
+            if settings.pinecone_upsert_autotune else None
+        )
+        self._pc = None
+        self._client_failed = False
+        self._client_lock = threading.Lock()
         self.index = None
+        self.dimension: Optional[int] = None
+        # Bumped on every write so callers can key caches on corpus contents
+        self.corpus_version = 0
+        self.stats_ttl = settings.stats_cache_ttl
+        self._stats_cache = None
+        self._stats_cached_at = 0.0
+        self._init_lock = threading.Lock()
+        # (filename, digest of the float16-rounded vector) -> None, oldest first
+        self._seen_vectors: "OrderedDict[tuple, None]" = OrderedDict()
+        self._seen_lock = threading.Lock()
+        # Matches for recent query vectors; entries from an older corpus_version are ignored
+        self.query_cache = (
+            SemanticCache(settings.query_cache_size, settings.query_cache_threshold)
+            if settings.query_cache_size > 0 else None
+        )
+        # In-process copy of the whole corpus, used once loaded by init_index
+        self.local_index = (
+            LocalVectorIndex(settings.local_index_max_vectors, quantize=settings.local_index_quantize)
+            if settings.local_index_max_vectors > 0 else None
+        )
         
         if not self.api_key:
             logger.warning("⚠️  Pinecone API key not found. Vector store disabled.")
-            return
+    
+    @property
+    def pc(self) -> Optional[Pinecone]:
+        """
+        Pinecone control-plane client, created on first use.
         
-        try:
-            self.pc = Pinecone(api_key=self.api_key)
-            logger.info(f"✅ Pinecone client initialized for environment: {self.environment}")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Pinecone client: {e}")
+        Building the client sets up its HTTP pools and takes a noticeable
+        fraction of a second, so it is deferred from import time to the
+        first call that needs Pinecone.
+        """
+        if self._pc is None and self.api_key and not self._client_failed:
+            with self._client_lock:
+                if self._pc is None and not self._client_failed:
+                    try:
+                        self._pc = Pinecone(api_key=self.api_key, connection_pool_maxsize=self.pool_size)
+                        logger.info("✅ Pinecone client initialized for environment: %s", self.environment)
+                    except Exception as e:
+                        self._client_failed = True
+                        logger.error("❌ Failed to initialize Pinecone client: %s", e)
+        return self._pc
     
-    def init_index(self, dimension: int = 768, metric: str = "cosine") -> bool:
+    @pc.setter
+    def pc(self, client: Optional[Pinecone]):
+        self._pc = client
+    
+    def init_index(self, dimension: int = 768, metric: str = "dotproduct") -> bool:
         """
         Initialize or connect to Pinecone index.
         
+        Vectors are unit-normalized on the way in and queries before they
+        are sent, so a dotproduct index scores exactly like a cosine one
+        without normalizing server-side. Existing cosine indexes keep
+        working unchanged.
+        
         Args:
             dimension: Embedding dimension (default 768 for all-mpnet-base-v2)
-            metric: Distance metric (cosine, euclidean, or dotproduct)
+            metric: Distance metric for a new index (cosine, euclidean, or dotproduct)
             
         Returns:
             True if successful, False otherwise
@@ -56,12 +321,14 @@ class VectorStoreService:
             return False
         
         try:
-            # Check if index exists
-            existing_indexes = self.pc.list_indexes()
-            index_names = [idx.name for idx in existing_indexes]
+            # Check if index exists, unless this process already connected to it
+            if self.index_name in _KNOWN_INDEXES:
+                index_names = [self.index_name]
+            else:
+                index_names = [idx.name for idx in self.pc.list_indexes()]
             
             if self.index_name not in index_names:
-                logger.info(f"Creating new Pinecone index: {self.index_name}")
+                logger.info("Creating new Pinecone index: %s", self.index_name)
                 self.pc.create_index(
                     name=self.index_name,
                     dimension=dimension,
@@ -71,40 +338,82 @@ class VectorStoreService:
                         region=self.environment
                     )
                 )
-                logger.info(f"✅ Index '{self.index_name}' created successfully")
+                logger.info("✅ Index '%s' created successfully", self.index_name)
+            else:
+                logger.info("📌 Connecting to existing index: %s", self.index_name)
+            
+            # Connect to index; the data-plane client keeps its connections
+            # alive, so this is the only place one is constructed
+            if self.use_grpc:
+                self.index = self.pc.index(name=self.index_name, grpc=True)
             else:
-                logger.info(f"📌 Connecting to existing index: {self.index_name}")
+                self.index = self.pc.Index(self.index_name, pool_threads=self.pool_size)
             
-            # Connect to index
-            self.index = self.pc.Index(self.index_name)
+            # Get index stats (for the dimension), and keep them so the first
+            # query's get_stats() doesn't make the same round trip again
+            stats = self._fetch_stats()
+            logger.info("📊 Index stats: %s", stats)
+            self.dimension = getattr(stats, "dimension", None) or dimension
             
-            # Get index stats
-            stats = self.index.describe_index_stats()
-            logger.info(f"📊 Index stats: {stats}")
+            if self.local_index is not None:
+                self.local_index.load(self.index, getattr(stats, "total_vector_count", 0) or 0)
             
+            _KNOWN_INDEXES.add(self.index_name)
             return True
             
         except Exception as e:
-            logger.error(f"❌ Failed to initialize index: {e}")
+            # The index may have been deleted; check again next time
+            _KNOWN_INDEXES.discard(self.index_name)
+            logger.error("❌ Failed to initialize index: %s", e)
             return False
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def ensure_index(self, dimension: int = 768) -> bool:
+        """
+        Connect to the index once, however many callers race to do it.
+        
+        Blocking (Pinecone control-plane calls); async callers should run
+        it in a worker thread, and only when self.index is still None.
+        
+        Args:
+            dimension: Embedding dimension, used if the index must be created
+            
+        Returns:
+            True if the index is connected
+        """
+        with self._init_lock:
+            if self.index is None:
+                self.init_index(dimension=dimension)
+        return self.index is not None
+    
     def upsert_vectors(
         self,
-        vectors: List[List[float]],
+        vectors: Union[np.ndarray, List[List[float]]],
         metadata: List[Dict[str, Any]],
-        ids: Optional[List[str]] = None
+        ids: Optional[List[str]] = None,
+        batch_size: Optional[int] = None
     ) -> Dict[str, int]:
         """
         Upsert vectors with metadata to Pinecone.
         
+        The vectors are split into requests of batch_size, and up to
+        upsert_concurrency of them are in flight at once, so the call takes
+        about as long as the slowest few requests rather than all of them.
+        Retries resend only the items of batches that failed.
+        
+        Vectors identical (after float16 rounding) to one already upserted
+        for the same filename, such as repeated headers and footers, are
+        skipped. Deletes and clears forget the affected files, so a file
+        uploaded again after a delete is stored in full.
+        
         Args:
-            vectors: List of embedding vectors
+            vectors: Embedding matrix (n, dim) or list of vectors; stored unit-normalized
             metadata: List of metadata dicts (must match vectors length)
             ids: Optional list of IDs (will auto-generate if not provided)
+            batch_size: Vectors per request (default: tuned by batch_tuner when
+                PINECONE_UPSERT_AUTOTUNE is on, else PINECONE_UPSERT_BATCH_SIZE)
             
         Returns:
-            Dict with upserted count
+            Dict with upserted and skipped (duplicate) counts
         """
         if not self.index:
             raise RuntimeError("Index not initialized. Call init_index() first.")
@@ -114,36 +423,122 @@ class VectorStoreService:
         
         # Generate IDs if not provided
         if ids is None:
-            import uuid
-            ids = [str(uuid.uuid4()) for _ in range(len(vectors))]
-        
-        # Prepare vectors for upsert
-        vectors_to_upsert = [
-            {
-                "id": vid,
-                "values": vector,
-                "metadata": meta
-            }
-            for vid, vector, meta in zip(ids, vectors, metadata)
-        ]
-        
-        # Upsert in batches of 100
-        batch_size = 100
-        total_upserted = 0
-        
-        for i in range(0, len(vectors_to_upsert), batch_size):
-            batch = vectors_to_upsert[i:i + batch_size]
-            response = self.index.upsert(vectors=batch)
-            total_upserted += response.upserted_count
-            logger.debug(f"Upserted batch {i//batch_size + 1}: {response.upserted_count} vectors")
-        
-        logger.info(f"✅ Upserted {total_upserted} vectors to Pinecone")
-        return {"upserted_count": total_upserted}
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+            ids = _generate_ids(len(vectors))
+        
+        # Keep vectors as one float32 matrix. Its rows go to the client as is:
+        # both the REST and gRPC clients build their request lists with a
+        # C-level tolist() per row, so converting here first would only add
+        # a second copy that stays alive across retries. (id, values, metadata)
+        # tuples skip the client's dict key validation, and zip hands them
+        # over without an intermediate list
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        
+        keys, keep = self._unseen_vectors(vectors, metadata)
+        skipped = len(ids) - len(keep)
+        if skipped:
+            ids = [ids[i] for i in keep]
+            vectors = vectors[keep]
+            metadata = [metadata[i] for i in keep]
+            logger.info("♻️  Skipping %d duplicate vectors", skipped)
+            if not ids:
+                return {"upserted_count": 0, "skipped_count": skipped}
+        
+        failed_items = None  # items of the batches that failed in the last attempt
+        upserted_count = 0
+        tuner = self.batch_tuner if batch_size is None else None
+        for attempt in Retrying(**PINECONE_RETRY_POLICY):
+            with attempt:
+                # Read per attempt, so a retry after throttling uses smaller batches
+                size = batch_size or (tuner.batch_size if tuner else self.upsert_batch_size)
+                sent = len(failed_items) if failed_items is not None else len(ids)
+                started = time.monotonic()
+                try:
+                    response = self.index.upsert(
+                        vectors=failed_items if failed_items is not None else zip(ids, vectors, metadata),
+                        batch_size=size,
+                        max_concurrency=self.upsert_concurrency,
+                        show_progress=False
+                    )
+                except NON_RETRYABLE_ERRORS:
+                    raise
+                except Exception:
+                    if tuner:
+                        tuner.record(sent, size, self.upsert_concurrency, time.monotonic() - started, throttled=True)
+                    raise
+                
+                if tuner:
+                    throttled = bool(response.failed_item_count) and any(error.retryable for error in response.errors)
+                    tuner.record(sent, size, self.upsert_concurrency, time.monotonic() - started, throttled)
+                upserted_count += response.upserted_count
+                if response.failed_item_count:
+                    message = (
+                        f"{response.failed_item_count} of {len(ids)} vectors failed to upsert: "
+                        f"{response.errors[0].error_message if response.errors else 'unknown error'}"
+                    )
+                    # Rejections such as a dimension mismatch fail the same way again
+                    if any(not error.retryable for error in response.errors):
+                        raise ValueError(message)
+                    # Batches that landed are kept; the next attempt sends the rest.
+                    # A call that raises outright is resent with the same items,
+                    # which is safe since upserts overwrite by id
+                    failed_items = response.failed_items
+                    raise IOError(message)
+        
+        if self.local_index is not None and self.local_index.ready:
+            self.local_index.add(ids, vectors, metadata)
+        
+        # Remembered only once stored, so a retried upsert resends everything
+        self._remember_vectors(keys)
+        self._mark_written()
+        logger.info("✅ Upserted %d vectors to Pinecone", upserted_count)
+        return {"upserted_count": upserted_count, "skipped_count": skipped}
+    
+    def _unseen_vectors(
+        self,
+        vectors: np.ndarray,
+        metadata: List[Dict[str, Any]]
+    ) -> Tuple[List[tuple], List[int]]:
+        """
+        Find the rows not yet upserted for their file, nor earlier in this call.
+        
+        Returns:
+            Dedup keys of the new rows, and their positions in vectors
+        """
+        rounded = vectors.astype(np.float16)
+        keys = []
+        keep = []
+        batch_keys = set()
+        with self._seen_lock:
+            for i, (row, meta) in enumerate(zip(rounded, metadata)):
+                key = ((meta or {}).get("filename"), hashlib.blake2b(row.tobytes(), digest_size=16).digest())
+                if key in self._seen_vectors or key in batch_keys:
+                    continue
+                batch_keys.add(key)
+                keys.append(key)
+                keep.append(i)
+        return keys, keep
+    
+    def _remember_vectors(self, keys: List[tuple]):
+        """Record upserted dedup keys, forgetting the oldest beyond UPSERT_DEDUP_SIZE."""
+        with self._seen_lock:
+            for key in keys:
+                self._seen_vectors[key] = None
+            while len(self._seen_vectors) > self.UPSERT_DEDUP_SIZE:
+                self._seen_vectors.popitem(last=False)
+    
+    def _forget_vectors(self, filename: Optional[str] = None):
+        """Drop the dedup keys of a deleted file; None drops all of them."""
+        with self._seen_lock:
+            if filename is None:
+                self._seen_vectors.clear()
+                return
+            for key in [key for key in self._seen_vectors if key[0] == filename]:
+                del self._seen_vectors[key]
+    
+    @retry(**PINECONE_RETRY_POLICY)
     def query_vector(
         self,
-        query_vector: List[float],
+        query_vector: Union[np.ndarray, List[float]],
         top_k: int = 5,
         filter: Optional[Dict[str, Any]] = None,
         include_metadata: bool = True
@@ -151,6 +546,10 @@ class VectorStoreService:
         """
         Query Pinecone index for similar vectors.
         
+        A query vector nearly identical to a recent one (cosine similarity
+        of at least QUERY_CACHE_THRESHOLD, same options, no write since)
+        is answered from the query cache without a Pinecone round trip.
+        
         Args:
             query_vector: Query embedding vector
             top_k: Number of results to return
@@ -159,31 +558,146 @@ class VectorStoreService:
             
         Returns:
             List of matches with id, score, and metadata
+        
+        Raises:
+            ValueError: If filter is not a valid Pinecone metadata filter, or
+                the query vector doesn't match the index dimension
         """
         if not self.index:
             raise RuntimeError("Index not initialized. Call init_index() first.")
+        if filter:
+            _validate_filter(filter)
+        
+        query_vector = self._as_query(query_vector)
+        options = _query_options(top_k, filter, include_metadata)
+        cached = self._lookup_query(query_vector, options)
+        if cached is not None:
+            logger.debug("🎯 Query cache hit (%d results)", len(cached))
+            return cached
+        
+        if self.local_index is not None:
+            results = self.local_index.query(query_vector, top_k, filter, include_metadata)
+            if results is not None:
+                self._remember_query(query_vector, options, results)
+                return results
         
         response = self.index.query(
-            vector=query_vector,
+            vector=query_vector.tolist(),
             top_k=top_k,
             filter=filter,
             include_metadata=include_metadata
         )
         
-        # Format results
-        results = []
-        for match in response.matches:
-            result = {
-                "id": match.id,
-                "score": match.score,
-            }
-            if include_metadata and hasattr(match, 'metadata'):
-                result["metadata"] = match.metadata
-            results.append(result)
-        
-        logger.info(f"🔍 Query returned {len(results)} results")
+        # Format results; matches always expose .metadata (None when not requested)
+        matches = response.matches
+        if include_metadata:
+            results = [{"id": m.id, "score": m.score, "metadata": m.metadata} for m in matches]
+        else:
+            results = [{"id": m.id, "score": m.score} for m in matches]
+        
+        logger.info("🔍 Query returned %d results", len(results))
+        self._remember_query(query_vector, options, results)
         return results
     
+    async def query_vector_stream(
+        self,
+        query_vector: Union[np.ndarray, List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+        include_metadata: bool = True
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], bool]]:
+        """
+        Async query_vector() that can preview matches before Pinecone answers.
+        
+        When neither the query cache nor the local index can answer, the
+        Pinecone query runs in a worker thread and, meanwhile, the cached
+        matches of the most similar earlier query (cosine similarity of at
+        least QUERY_PREVIEW_THRESHOLD, same options, expired entries
+        allowed) are yielded as a provisional result.
+        
+        Args:
+            query_vector: Query embedding vector
+            top_k: Number of results to return
+            filter: Optional metadata filter
+            include_metadata: Whether to include metadata in results
+            
+        Yields:
+            (results, is_final) pairs; only the last one is final
+        
+        Raises:
+            ValueError: If filter is not a valid Pinecone metadata filter, or
+                the query vector doesn't match the index dimension
+        """
+        if not self.index:
+            raise RuntimeError("Index not initialized. Call init_index() first.")
+        if filter:
+            _validate_filter(filter)
+        
+        query_vector = self._as_query(query_vector)
+        options = _query_options(top_k, filter, include_metadata)
+        cached = self._lookup_query(query_vector, options)
+        if cached is not None:
+            logger.debug("🎯 Query cache hit (%d results)", len(cached))
+            yield cached, True
+            return
+        
+        # The local index scan takes a lock ingestion threads also hold, so it
+        # runs in a worker thread like the Pinecone query
+        answered_locally = (
+            self.local_index is not None
+            and self.local_index.ready
+            and _filename_from_filter(filter) is not None
+        )
+        task = asyncio.ensure_future(
+            asyncio.to_thread(self.query_vector, query_vector, top_k, filter, include_metadata)
+        )
+        try:
+            if settings.query_preview_threshold and not answered_locally:
+                preview = self._lookup_query(
+                    query_vector, options, threshold=settings.query_preview_threshold, allow_expired=True
+                )
+                if preview is not None:
+                    yield preview, False
+            yield await task, True
+        finally:
+            # Consumer went away before Pinecone answered
+            task.cancel()
+    
+    def _as_query(self, query_vector: Union[np.ndarray, List[float]]) -> np.ndarray:
+        """Normalize a query vector after checking it against the index dimension."""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        # A mismatched embedding model would otherwise fail inside Pinecone
+        # or the local index, differently on each path
+        if self.dimension and query_vector.shape[-1] != self.dimension:
+            raise ValueError(f"Query dimension {query_vector.shape[-1]} != index dimension {self.dimension}")
+        return _normalize_rows(query_vector)
+    
+    def _lookup_query(
+        self,
+        query_vector: np.ndarray,
+        options: tuple,
+        threshold: Optional[float] = None,
+        allow_expired: bool = False
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Return cached matches for a near-identical query vector with the same options."""
+        if self.query_cache is None:
+            return None
+        
+        key = (self.corpus_version, options)
+        now = time.monotonic()
+        entry = self.query_cache.lookup(
+            query_vector,
+            threshold=threshold,
+            match=lambda cached: cached[:2] == key and (allow_expired or cached[2] >= now)
+        )
+        return entry[3] if entry is not None else None
+    
+    def _remember_query(self, query_vector: np.ndarray, options: tuple, results: List[Dict[str, Any]]):
+        """Make a query's matches reusable by near-identical query vectors."""
+        if self.query_cache is not None:
+            expires_at = time.monotonic() + settings.query_cache_ttl
+            self.query_cache.add(query_vector, (self.corpus_version, options, expires_at, results))
+    
     def delete_by_filter(self, filter: Dict[str, Any]) -> Dict[str, str]:
         """
         Delete vectors matching a metadata filter.
@@ -193,12 +707,25 @@ class VectorStoreService:
             
         Returns:
             Status dict
+        
+        Raises:
+            ValueError: If filter is not a valid Pinecone metadata filter
         """
         if not self.index:
             raise RuntimeError("Index not initialized. Call init_index() first.")
+        _validate_filter(filter)
         
         self.index.delete(filter=filter)
-        logger.info(f"🗑️  Deleted vectors matching filter: {filter}")
+        filename = _filename_from_filter(filter)
+        # Can't tell which vectors any other filter matched
+        self._forget_vectors(filename or None)
+        if self.local_index is not None and self.local_index.ready:
+            if filename:
+                self.local_index.delete_filename(filename)
+            else:
+                self.local_index.disable()
+        self._mark_written()
+        logger.info("🗑️  Deleted vectors matching filter: %s", filter)
         return {"status": "deleted"}
     
     def delete_by_filename(self, filename: str) -> Dict[str, str]:
@@ -213,6 +740,30 @@ class VectorStoreService:
         """
         return self.delete_by_filter({"filename": {"$eq": filename}})
     
+    def delete_by_ids(self, ids: List[str], filename: str) -> Dict[str, Any]:
+        """
+        Delete specific vectors of one file, e.g. those of a failed ingestion.
+        
+        Args:
+            ids: Vector ids to delete; ids that were never stored are ignored
+            filename: File the vectors belong to
+            
+        Returns:
+            Status dict with the number of ids sent
+        """
+        if not self.index:
+            raise RuntimeError("Index not initialized. Call init_index() first.")
+        
+        for start in range(0, len(ids), self.DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + self.DELETE_BATCH_SIZE])
+        # Dedup keys aren't tracked per id; re-sending the file's other vectors is harmless
+        self._forget_vectors(filename)
+        if self.local_index is not None and self.local_index.ready:
+            self.local_index.delete_ids(ids)
+        self._mark_written()
+        logger.info("🗑️  Deleted %d vectors of %s", len(ids), filename)
+        return {"status": "deleted", "count": len(ids)}
+    
     def clear_all_documents(self) -> Dict[str, str]:
         """
         Delete ALL vectors from the index.
@@ -225,15 +776,55 @@ class VectorStoreService:
             raise RuntimeError("Index not initialized. Call init_index() first.")
         
         self.index.delete(delete_all=True)
-        logger.warning(f"⚠️  Cleared ALL documents from index '{self.index_name}'")
+        self._forget_vectors()
+        if self.local_index is not None and self.local_index.ready:
+            self.local_index.clear()
+        self._mark_written()
+        logger.warning("⚠️  Cleared ALL documents from index '%s'", self.index_name)
         return {"status": "cleared", "message": "All documents deleted"}
     
     def get_stats(self) -> Dict[str, Any]:
-        """Get index statistics."""
+        """
+        Get index statistics.
+        
+        Results are cached for stats_ttl seconds since every query checks
+        the vector count; writes made through this service invalidate it.
+        """
         if not self.index:
             raise RuntimeError("Index not initialized. Call init_index() first.")
         
-        return self.index.describe_index_stats()
+        if self._stats_cache is not None and time.monotonic() - self._stats_cached_at < self.stats_ttl:
+            return self._stats_cache
+        return self._fetch_stats()
+    
+    def _fetch_stats(self) -> Any:
+        """Fetch index statistics from Pinecone and cache them for stats_ttl seconds."""
+        stats = self.index.describe_index_stats()
+        self._stats_cache = stats
+        self._stats_cached_at = time.monotonic()
+        return stats
+    
+    def close(self):
+        """Release the pooled index and control-plane connections; called at shutdown."""
+        for client in (self.index, self._pc):
+            if client is None:
+                continue
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("⚠️  Failed to close Pinecone client: %s", e)
+        self.index = None
+        self._pc = None
+        self.invalidate_stats()
+    
+    def invalidate_stats(self):
+        """Drop cached index statistics so the next get_stats() refetches."""
+        self._stats_cache = None
+    
+    def _mark_written(self):
+        """Record that the corpus changed through this service."""
+        self.corpus_version += 1
+        self.invalidate_stats()
 
 
 # Global vector store service instance
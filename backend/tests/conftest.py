@@ -2,8 +2,36 @@
 Test configuration for pytest
 """
 
+import os
 import sys
+import types
 from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
 
 # Add parent directory to path so tests can import modules
 sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Keep the embedding cache in memory so tests never write to ./uploads
+os.environ.setdefault("EMBEDDING_CACHE_PERSIST", "false")
+# Upsert batch sizes stay fixed, and no tuning state is written either
+os.environ.setdefault("PINECONE_UPSERT_AUTOTUNE", "false")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _fake_sentence_transformers():
+    """Stand in for sentence_transformers all session, so no test imports torch."""
+    module = types.ModuleType("sentence_transformers")
+    module.SentenceTransformer = MagicMock(name="SentenceTransformer")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "sentence_transformers", module)
+        yield module
+
+
+@pytest.fixture
+def mock_sentence_transformer(_fake_sentence_transformers):
+    """The fake SentenceTransformer class, reset for each test."""
+    mock_st = _fake_sentence_transformers.SentenceTransformer
+    mock_st.reset_mock(return_value=True, side_effect=True)
+    return mock_st
@@ -0,0 +1,191 @@
+"""
+Test suite for KnowledgeExplorer cache utilities
+"""
+
+import asyncio
+import threading
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from services.cache import LRUCache, TTLCache, SemanticCache, EmbeddingCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the oldest untouched entry is evicted first."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    
+    # Touch "a" so "b" becomes the eviction candidate
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_default_on_miss():
+    """Test that misses return the provided default."""
+    cache = LRUCache(maxsize=2)
+    
+    assert cache.get("missing") is None
+    assert cache.get("missing", "fallback") == "fallback"
+
+
+def test_embedding_cache_keys_include_model():
+    """Test that the same text embedded by different models does not alias."""
+    cache = EmbeddingCache(maxsize=10)
+    cache.set_many("model-a", ["hello"], np.array([[0.5, 0.25]], dtype=np.float32))
+    
+    assert cache.get_many("model-a", ["hello"])[0].tolist() == [0.5, 0.25]
+    assert cache.get_many("model-b", ["hello"]) == [None]
+
+
+def test_embedding_cache_persists_to_disk(tmp_path):
+    """Test that vectors survive a new cache instance on the same path."""
+    cache = EmbeddingCache(maxsize=10, path=str(tmp_path))
+    cache.set_many("model-a", ["hello", "world"], np.array([[0.5, 0.25], [1.0, 2.0]]))
+    
+    reopened = EmbeddingCache(maxsize=10, path=str(tmp_path))
+    world, missing = reopened.get_many("model-a", ["world", "missing"])
+    
+    assert world.dtype == np.float32
+    assert world.tolist() == [1.0, 2.0]
+    assert missing is None
+    assert reopened.stats() == {
+        "memory_entries": 1,
+        "disk_entries": 2,
+        "memory_hits": 0,
+        "disk_hits": 1,
+        "misses": 1
+    }
+    
+    # The disk hit was promoted to memory
+    reopened.get_many("model-a", ["world"])
+    assert reopened.stats()["memory_hits"] == 1
+
+
+def test_embedding_cache_opens_sqlite_on_first_use(tmp_path):
+    """Test that constructing the cache creates no files until the disk tier is used."""
+    cache = EmbeddingCache(maxsize=10, path=str(tmp_path / "cache"))
+    assert not (tmp_path / "cache").exists()
+    
+    cache.get_many("model-a", ["hello"])
+    assert (tmp_path / "cache" / "embeddings.sqlite3").exists()
+
+
+def test_embedding_cache_prunes_disk_entries(tmp_path):
+    """Test that the disk tier is bounded by max_disk_entries."""
+    cache = EmbeddingCache(maxsize=10, path=str(tmp_path), max_disk_entries=2)
+    cache.set_many("model-a", ["one", "two", "three"], np.array([[1.0], [2.0], [3.0]]))
+    
+    reopened = EmbeddingCache(maxsize=10, path=str(tmp_path))
+    found = reopened.get_many("model-a", ["one", "two", "three"])
+    
+    assert found[0] is None
+    assert [v.tolist() for v in found[1:]] == [[2.0], [3.0]]
+
+
+def test_ttl_cache_expires_entries():
+    """Test that entries disappear once their TTL has elapsed."""
+    cache = TTLCache(maxsize=2, ttl=10)
+    
+    with patch('services.cache.time.monotonic', return_value=100.0):
+        cache.set("a", 1)
+    
+    with patch('services.cache.time.monotonic', return_value=105.0):
+        assert cache.get("a") == 1
+        assert "a" in cache
+    
+    with patch('services.cache.time.monotonic', return_value=111.0):
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_async_tiers_run_sqlite_off_the_loop(tmp_path):
+    """Test that aset_many/aget_many hand SQLite work to a thread and count rewrites once."""
+    cache = EmbeddingCache(maxsize=1, path=str(tmp_path))
+    vectors = np.array([[1.0], [2.0]])
+    
+    with patch('services.cache.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+        await cache.aset_many("model-a", ["one", "two"], vectors)
+        await cache.aset_many("model-a", ["one", "two"], vectors)
+        found = await cache.aget_many("model-a", ["one", "two"])
+    
+    assert to_thread.call_count == 3
+    assert [v.tolist() for v in found] == [[1.0], [2.0]]
+    assert cache.stats()["disk_entries"] == 2
+
+
+def test_semantic_cache_matches_similar_vectors_with_same_sources():
+    """Test that near-duplicate queries hit only when grounded in the same files."""
+    cache = SemanticCache(maxsize=4, threshold=0.95)
+    cache.add(np.array([1.0, 0.0], dtype=np.float32), "answer", frozenset({"a.pdf"}))
+    
+    assert cache.lookup(np.array([0.99, 0.05]), frozenset({"a.pdf"})) == "answer"
+    assert cache.lookup(np.array([0.99, 0.05]), frozenset({"b.pdf"})) is None
+    assert cache.lookup(np.array([0.0, 1.0]), frozenset({"a.pdf"})) is None
+
+
+def test_semantic_cache_eviction_and_invalidation():
+    """Test FIFO eviction when full and per-file invalidation."""
+    cache = SemanticCache(maxsize=2, threshold=0.95)
+    cache.add(np.array([1.0, 0.0]), "first", frozenset({"a.pdf"}))
+    cache.add(np.array([0.0, 1.0]), "second", frozenset({"b.pdf"}))
+    cache.add(np.array([0.7, 0.7]), "third", frozenset({"a.pdf"}))
+    
+    assert len(cache) == 2
+    assert cache.lookup(np.array([1.0, 0.0]), frozenset({"a.pdf"})) is None
+    
+    assert cache.invalidate("a.pdf") == 1
+    assert cache.lookup(np.array([0.0, 1.0]), frozenset({"b.pdf"})) == "second"
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_semantic_cache_skips_closer_entries_that_do_not_match():
+    """Test that a non-matching best row doesn't hide a matching one above the threshold."""
+    cache = SemanticCache(maxsize=4, threshold=0.9)
+    cache.add(np.array([1.0, 0.0]), "other sources", frozenset({"b.pdf"}))
+    cache.add(np.array([0.95, 0.3]), "answer", frozenset({"a.pdf"}))
+    cache.add(np.array([1.0, 0.01]), ("stale", 1), frozenset({"a.pdf"}))
+    
+    query = np.array([1.0, 0.0])
+    assert cache.lookup(query, frozenset({"a.pdf"})) == ("stale", 1)
+    assert cache.lookup(
+        query, frozenset({"a.pdf"}), match=lambda value: not isinstance(value, tuple)
+    ) == "answer"
+
+
+def test_semantic_cache_concurrent_add_and_lookup():
+    """Test that lookups racing with evicting adds always pair vectors with their own entry."""
+    cache = SemanticCache(maxsize=8, threshold=0.99)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(64, 16)).astype(np.float32)
+    errors = []
+    
+    def writer():
+        for _ in range(20):
+            for i, vector in enumerate(vectors):
+                cache.add(vector, i)
+    
+    def reader():
+        try:
+            for _ in range(20):
+                for i, vector in enumerate(vectors):
+                    assert cache.lookup(vector) in (None, i)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert errors == []
@@ -2,6 +2,9 @@
 Test suite for KnowledgeExplorer embeddings service
 """
 
+import asyncio
+import base64
+import numpy as np
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
 from services.embeddings import EmbeddingsService
@@ -21,7 +24,7 @@ async def test_embed_texts_with_jina():
         }
         mock_response.raise_for_status = Mock()
         
-        mock_client.return_value.__aenter__.return_value.post = AsyncMock(return_value=mock_response)
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
         
         # Create service with Jina enabled
         service = EmbeddingsService()
@@ -32,69 +35,202 @@ async def test_embed_texts_with_jina():
         texts = ["test text 1", "test text 2"]
         embeddings = await service.embed_texts(texts)
         
-        assert len(embeddings) == 2
-        assert len(embeddings[0]) == 768
-        assert embeddings[0][0] == 0.1
+        assert embeddings.shape == (2, 768)
+        assert embeddings.dtype == np.float32
+        assert embeddings[0][0] == pytest.approx(0.1)
 
 
 @pytest.mark.asyncio
-async def test_embed_texts_with_local_fallback():
-    """Test embedding with local model fallback (mocked)."""
-    with patch('services.embeddings.SentenceTransformer') as mock_st:
-        # Mock local model
-        mock_model = Mock()
-        mock_model.encode.return_value = [[0.3] * 768, [0.4] * 768]
-        mock_st.return_value = mock_model
+async def test_embed_texts_with_jina_base64():
+    """Test that base64 float32 embeddings are decoded without a per-element list."""
+    vectors = np.array([[0.25] * 768, [0.5] * 768], dtype="<f4")
+    with patch('services.embeddings.httpx.AsyncClient') as mock_client:
+        mock_response = Mock()
+        mock_response.json.return_value = {
+            "data": [{"embedding": base64.b64encode(v.tobytes()).decode()} for v in vectors]
+        }
+        mock_response.raise_for_status = Mock()
+        mock_post = AsyncMock(return_value=mock_response)
+        mock_client.return_value.post = mock_post
         
-        # Create service without Jina
         service = EmbeddingsService()
-        service.use_jina = False
-        service._load_local_model()
+        service.use_jina = True
+        service.jina_api_key = "test_key"
         
-        # Test embedding
-        texts = ["test text 1", "test text 2"]
-        embeddings = service._embed_with_local(texts)
+        embeddings = await service.embed_texts(["base64 one", "base64 two"])
+    
+    assert mock_post.call_args.kwargs["json"]["embedding_type"] == "base64"
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (2, 768)
+    assert embeddings[1][0] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_embed_texts_uses_cache():
+    """Test that repeated texts are served from the cache without a Jina call."""
+    with patch('services.embeddings.httpx.AsyncClient') as mock_client:
+        mock_response = Mock()
+        mock_response.json.return_value = {
+            "data": [{"embedding": [0.7] * 768}]
+        }
+        mock_response.raise_for_status = Mock()
+        
+        mock_post = AsyncMock(return_value=mock_response)
+        mock_client.return_value.post = mock_post
         
-        assert len(embeddings) == 2
-        assert len(embeddings[0]) == 768
+        service = EmbeddingsService()
+        service.use_jina = True
+        service.jina_api_key = "test_key"
+        
+        first = await service.embed_texts(["cached text"])
+        second = await service.embed_texts(["cached text"])
+        
+        assert np.array_equal(first, second)
+        assert mock_post.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_embed_texts_with_local_fallback(mock_sentence_transformer):
+    """Test embedding with local model fallback (mocked)."""
+    # Mock local model
+    mock_model = Mock()
+    mock_model.encode.return_value = [[0.3] * 768, [0.4] * 768]
+    mock_sentence_transformer.return_value = mock_model
+    
+    # Create service without Jina
+    service = EmbeddingsService()
+    service.use_jina = False
+    service._load_local_model()
+    
+    # Test embedding
+    texts = ["test text 1", "test text 2"]
+    embeddings = await service._embed_with_local(texts)
+    
+    assert len(embeddings) == 2
+    assert len(embeddings[0]) == 768
 
 
 @pytest.mark.asyncio
-async def test_embed_query():
+async def test_embed_query(mock_sentence_transformer):
     """Test single query embedding."""
-    with patch('services.embeddings.SentenceTransformer') as mock_st:
-        # Mock local model
-        mock_model = Mock()
-        mock_model.encode.return_value = [[0.5] * 768]
-        mock_st.return_value = mock_model
+    # Mock local model
+    mock_model = Mock()
+    mock_model.encode.return_value = [[0.5] * 768]
+    mock_sentence_transformer.return_value = mock_model
+    
+    service = EmbeddingsService()
+    service.use_jina = False
+    service._load_local_model()
+    
+    # Test query embedding
+    embedding = await service.embed_query("test query")
+    
+    assert len(embedding) == 768
+    assert embedding[0] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_embed_query_coalesces_concurrent_calls():
+    """Test that concurrent queries are embedded in a single Jina request."""
+    with patch('services.embeddings.httpx.AsyncClient') as mock_client:
+        mock_response = Mock()
+        mock_response.json.return_value = {
+            "data": [{"embedding": [float(i)] * 768} for i in range(3)]
+        }
+        mock_response.raise_for_status = Mock()
+        
+        mock_post = AsyncMock(return_value=mock_response)
+        mock_client.return_value.post = mock_post
         
         service = EmbeddingsService()
-        service.use_jina = False
-        service._load_local_model()
+        service.use_jina = True
+        service.jina_api_key = "test_key"
         
-        # Test query embedding
-        embedding = await service.embed_query("test query")
+        results = await asyncio.gather(
+            service.embed_query("query a"),
+            service.embed_query("query b"),
+            service.embed_query("query c")
+        )
         
-        assert len(embedding) == 768
-        assert embedding[0] == 0.5
+        assert mock_post.await_count == 1
+        assert [r[0] for r in results] == [0.0, 1.0, 2.0]
 
 
-def test_get_dimension():
+@pytest.mark.asyncio
+async def test_embed_query_flushes_full_batch_without_waiting():
+    """Test that MAX_BATCH queued queries are embedded before the window elapses."""
+    service = EmbeddingsService()
+    service.MAX_BATCH = 2
+    service.BATCH_WINDOW = 10.0
+    
+    async def fake_embed(texts):
+        return np.array([[float(len(t))] for t in texts], dtype=np.float32)
+    
+    with patch.object(service, 'embed_texts', side_effect=fake_embed) as mock_embed:
+        results = await asyncio.wait_for(
+            asyncio.gather(service.embed_query("a"), service.embed_query("bb")),
+            timeout=1.0
+        )
+    
+    mock_embed.assert_called_once_with(["a", "bb"])
+    assert [r[0] for r in results] == [1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_embed_documents_batches_by_length_and_preserves_order():
+    """Test that batches group similar lengths while rows stay aligned with the input."""
+    service = EmbeddingsService()
+    batches = []
+    
+    async def fake_embed(texts):
+        batches.append(texts)
+        await asyncio.sleep(0.001 * (len(texts) % 3))
+        return np.array([[float(len(t))] for t in texts], dtype=np.float32)
+    
+    texts = ["x" * n for n in (5, 1, 9, 3, 7, 2, 8)]
+    with patch.object(service, 'embed_texts', side_effect=fake_embed):
+        embeddings = await service.embed_documents(texts, batch_size=3, max_concurrent=2)
+    
+    assert batches == [["x", "xx", "xxx"], ["x" * 5, "x" * 7, "x" * 8], ["x" * 9]]
+    assert embeddings[:, 0].tolist() == [5.0, 1.0, 9.0, 3.0, 7.0, 2.0, 8.0]
+
+
+@pytest.mark.asyncio
+async def test_embed_documents_shares_request_slots_across_calls():
+    """Test that concurrent embed_documents calls together stay within EMBED_MAX_CONCURRENT."""
+    service = EmbeddingsService()
+    service._embed_slots = asyncio.Semaphore(2)
+    active = 0
+    peak = 0
+    
+    async def fake_embed(texts):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.005)
+        active -= 1
+        return np.zeros((len(texts), 1), dtype=np.float32)
+    
+    with patch.object(service, 'embed_texts', side_effect=fake_embed):
+        await asyncio.gather(*(service.embed_documents(["a", "b", "c", "d"], batch_size=1) for _ in range(4)))
+    
+    assert peak == 2
+
+
+def test_get_dimension(mock_sentence_transformer):
     """Test getting embedding dimension."""
-    with patch('services.embeddings.SentenceTransformer'):
-        service = EmbeddingsService()
-        service.use_jina = False
-        
-        dimension = service.get_dimension()
-        assert dimension == 768
+    service = EmbeddingsService()
+    service.use_jina = False
+    
+    dimension = service.get_dimension()
+    assert dimension == 768
 
 
 @pytest.mark.asyncio
-async def test_embed_empty_list():
+async def test_embed_empty_list(mock_sentence_transformer):
     """Test embedding empty list."""
-    with patch('services.embeddings.SentenceTransformer'):
-        service = EmbeddingsService()
-        service.use_jina = False
-        
-        embeddings = await service.embed_texts([])
-        assert embeddings == []
+    service = EmbeddingsService()
+    service.use_jina = False
+    
+    embeddings = await service.embed_texts([])
+    assert len(embeddings) == 0
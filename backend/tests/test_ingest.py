@@ -0,0 +1,188 @@
+"""
+Test suite for KnowledgeExplorer ingestion pipeline
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from unittest.mock import patch
+from langchain_core.documents import Document
+from pipeline.ingest import Chunks, IngestionPipeline
+
+
+@pytest.mark.asyncio
+async def test_ingest_files_pipelines_stages_and_keeps_order():
+    """Test bounded embedding concurrency, input ordering, and per-file error isolation."""
+    pipeline = IngestionPipeline()
+    active = 0
+    peak = 0
+    
+    def fake_windows(file_path):
+        if file_path.endswith("empty.txt"):
+            return iter(())
+        return iter([Chunks(texts=[file_path])])
+    
+    async def fake_embed(texts):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        if texts == ["/tmp/bad.txt"]:
+            raise RuntimeError("boom")
+        return np.zeros((len(texts), 2), dtype=np.float32)
+    
+    async def fake_store(filename, chunks, embeddings, run_id):
+        return len(chunks)
+    
+    names = ["a.txt", "bad.txt", "c.txt", "empty.txt", "e.txt"]
+    files = [(f"/tmp/{name}", name) for name in names]
+    with patch.object(pipeline, '_iter_file_windows', side_effect=fake_windows), \
+         patch.object(pipeline, 'embed_in_batches', side_effect=fake_embed), \
+         patch.object(pipeline, '_store_chunks', side_effect=fake_store):
+        results = await pipeline.ingest_files(files, max_concurrent=2)
+    
+    assert peak == 2
+    assert [r["filename"] for r in results] == names
+    assert [r["status"] for r in results] == ["success", "error", "success", "warning", "success"]
+    assert results[1]["message"] == "boom"
+
+
+@pytest.mark.asyncio
+async def test_ingest_files_overlaps_upserts_of_consecutive_windows():
+    """Test that the next window's upsert starts while the previous one is still in flight."""
+    pipeline = IngestionPipeline()
+    active = 0
+    peak = 0
+    
+    async def fake_embed(texts):
+        return np.zeros((len(texts), 2), dtype=np.float32)
+    
+    async def fake_store(filename, chunks, embeddings, run_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return len(chunks)
+    
+    files = [(f"/tmp/{name}", name) for name in ("a.txt", "b.txt", "c.txt")]
+    with patch.object(pipeline, '_iter_file_windows', side_effect=lambda path: iter([Chunks(texts=[path])])), \
+         patch.object(pipeline, 'embed_in_batches', side_effect=fake_embed), \
+         patch.object(pipeline, '_store_chunks', side_effect=fake_store):
+        results = await pipeline.ingest_files(files, max_concurrent=2)
+    
+    assert peak == IngestionPipeline.STORE_WORKERS
+    assert [r["upserted"] for r in results] == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_ingest_file_streams_windows_with_file_wide_ids():
+    """Test that a large file is embedded and upserted window by window under one run id."""
+    pipeline = IngestionPipeline()
+    pages = (Document(page_content=f"p{i} a b", metadata={"page": i}) for i in range(5))
+    stored = []
+    
+    async def fake_embed(texts):
+        return np.zeros((len(texts), 2), dtype=np.float32)
+    
+    async def fake_store(filename, chunks, embeddings, run_id):
+        stored.append((chunks.chunk_uids.tolist(), run_id))
+        return len(chunks)
+    
+    with patch.object(pipeline, 'load_document', return_value=pages), \
+         patch.object(pipeline.text_splitter, 'split_text', side_effect=lambda text: text.split()), \
+         patch.object(pipeline, 'embed_in_batches', side_effect=fake_embed), \
+         patch.object(pipeline, '_store_chunks', side_effect=fake_store), \
+         patch('pipeline.ingest.settings') as mock_settings, \
+         patch('pipeline.ingest.llm_service'):
+        mock_settings.embed_batch_size = 2
+        mock_settings.embed_max_concurrent = 2
+        mock_settings.ingest_max_concurrent = 2
+        result = await pipeline.ingest_file("/tmp/big.pdf", "big.pdf")
+    
+    assert result == {"filename": "big.pdf", "status": "success", "chunks": 15, "upserted": 15}
+    # 3 chunks per page, windows of at least 4 chunks: pages 0-1, 2-3, then 4
+    assert sorted(len(ids) for ids, _ in stored) == [3, 6, 6]
+    assert sorted(i for ids, _ in stored for i in ids)[:4] == [0, 1, 2, 1 << 32]
+    assert (4 << 32 | 2) in {i for ids, _ in stored for i in ids}
+    assert len({run_id for _, run_id in stored}) == 1
+
+
+@pytest.mark.asyncio
+async def test_ingest_file_removes_stored_windows_when_a_later_page_fails():
+    """Test that a parse error after earlier windows were upserted deletes that run's vectors."""
+    pipeline = IngestionPipeline()
+    stored = []
+    
+    def pages():
+        for i in range(2):
+            yield Document(page_content=f"p{i} a b c", metadata={"page": i})
+        raise ValueError("bad page")
+    
+    async def fake_embed(texts):
+        return np.zeros((len(texts), 2), dtype=np.float32)
+    
+    async def fake_store(filename, chunks, embeddings, run_id):
+        stored.extend(pipeline._chunk_ids(filename, chunks, run_id))
+        return len(chunks)
+    
+    with patch.object(pipeline, 'load_document', return_value=pages()), \
+         patch.object(pipeline.text_splitter, 'split_text', side_effect=lambda text: text.split()), \
+         patch.object(pipeline, 'embed_in_batches', side_effect=fake_embed), \
+         patch.object(pipeline, '_store_chunks', side_effect=fake_store), \
+         patch('pipeline.ingest.vectorstore_service') as mock_store, \
+         patch('pipeline.ingest.settings') as mock_settings:
+        mock_settings.embed_batch_size = 2
+        mock_settings.embed_max_concurrent = 2
+        mock_settings.ingest_max_concurrent = 2
+        result = await pipeline.ingest_file("/tmp/big.pdf", "big.pdf")
+    
+    assert result == {"filename": "big.pdf", "status": "error", "message": "bad page", "chunks": 0}
+    assert len(stored) == 8
+    mock_store.delete_by_ids.assert_called_once_with(stored, "big.pdf")
+
+
+def test_chunk_documents_builds_struct_of_arrays():
+    """Test chunk indices, per-document counts and Pinecone metadata."""
+    pipeline = IngestionPipeline()
+    documents = [
+        Document(page_content="page one", metadata={"page": 0}),
+        Document(page_content="", metadata={"page": 1}),
+        Document(page_content="page three", metadata={"page": 2}),
+    ]
+    
+    with patch.object(pipeline.text_splitter, 'split_text', side_effect=lambda text: text.split()):
+        chunks = pipeline.chunk_documents(documents)
+    
+    assert chunks.texts == ["page", "one", "page", "three"]
+    assert chunks.chunk_uids.dtype == np.uint64
+    assert chunks.chunk_uids.tolist() == [0, 1, 2 << 32, 2 << 32 | 1]
+    
+    metadata = chunks.metadata("doc.pdf")
+    assert metadata[3] == {
+        "chunk_uid": 2 << 32 | 1,
+        "doc_index": 2,
+        "chunk_index": 1,
+        "total_chunks": 2,
+        "page": 2,
+        "filename": "doc.pdf",
+        "text": "three"
+    }
+    assert all(type(meta["doc_index"]) is int for meta in metadata)
+
+
+@pytest.mark.asyncio
+async def test_embed_in_batches_embeds_duplicates_once():
+    """Test that identical chunks share one embedding and rows stay aligned."""
+    pipeline = IngestionPipeline()
+    
+    async def fake_embed(texts):
+        return np.array([[float(len(t))] for t in texts], dtype=np.float32)
+    
+    with patch('pipeline.ingest.embeddings_service') as mock_embeddings:
+        mock_embeddings.embed_documents.side_effect = fake_embed
+        embeddings = await pipeline.embed_in_batches(["footer", "body text", "footer"])
+    
+    mock_embeddings.embed_documents.assert_called_once_with(["footer", "body text"])
+    assert embeddings[:, 0].tolist() == [6.0, 9.0, 6.0]
@@ -5,6 +5,7 @@ Only runs if API keys are present in environment
 
 import pytest
 import os
+import numpy as np
 from backend_config import settings
 
 
@@ -24,8 +25,8 @@ async def test_embeddings_service_integration():
     embeddings = await embeddings_service.embed_texts(texts)
     
     assert len(embeddings) == 2
-    assert len(embeddings[0]) > 0
-    assert all(isinstance(x, float) for x in embeddings[0])
+    assert embeddings.shape[1] > 0
+    assert embeddings.dtype == np.float32
 
 
 @pytest.mark.asyncio
@@ -97,5 +98,5 @@ async def test_streaming_query_integration():
     
     assert len(tokens) > 0
     # Check for different event types
-    event_types = [t.split('\n')[0] for t in tokens if t.startswith('event:')]
-    assert 'event: metadata' in event_types[0] if event_types else True
+    event_types = [t.split(b'\n')[0] for t in tokens if t.startswith(b'event:')]
+    assert b'event: metadata' in event_types[0] if event_types else True
@@ -0,0 +1,435 @@
+"""
+Test suite for KnowledgeExplorer LLM service
+"""
+
+import asyncio
+import httpx
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from groq import APIConnectionError, BadRequestError, InternalServerError, RateLimitError
+from services.llm import ConcurrencyController, GroqLLM, LLMService, _iter_completion_tokens, _with_retry
+
+
+def _make_service():
+    """Create an LLMService backed by a mocked Groq model."""
+    service = LLMService()
+    service.available = True
+    service.llm = Mock(model="test-model", temperature=0.7)
+    service.llm._call.return_value = "cached answer"
+    service.llm._acall = AsyncMock(return_value="cached answer")
+    service.llm.stream_completion.return_value = iter(["streamed", " answer"])
+    service.llm.astream_completion.side_effect = lambda prompt: _astream(["streamed", " answer"])
+    return service
+
+
+async def _astream(tokens):
+    """Async generator standing in for GroqLLM.astream_completion."""
+    for token in tokens:
+        yield token
+
+
+def test_generate_uses_exact_cache():
+    """Test that an identical prompt is answered without calling Groq again."""
+    service = _make_service()
+    
+    assert service.generate("prompt") == "cached answer"
+    assert service.generate("prompt") == "cached answer"
+    assert service.llm._call.call_count == 1
+
+
+def test_generate_uses_semantic_cache_for_similar_questions():
+    """Test that a different prompt with a near-identical question vector reuses the answer."""
+    service = _make_service()
+    files = frozenset({"report.pdf"})
+    
+    service.generate("prompt one", np.array([1.0, 0.0]), files)
+    answer = service.generate("prompt two", np.array([0.99, 0.01]), files)
+    
+    assert answer == "cached answer"
+    assert service.llm._call.call_count == 1
+
+
+def test_invalidate_drops_answers_for_file():
+    """Test that re-ingesting a file evicts answers grounded in it."""
+    service = _make_service()
+    service.generate("rag prompt", np.array([1.0, 0.0]), frozenset({"report.pdf"}))
+    service.generate("general prompt")
+    
+    assert service.invalidate("report.pdf") == 2
+    
+    service.generate("rag prompt", np.array([1.0, 0.0]), frozenset({"report.pdf"}))
+    service.generate("general prompt")
+    assert service.llm._call.call_count == 3
+
+
+def test_stream_tokens_caches_completed_stream():
+    """Test that a finished stream is replayed from cache as one token."""
+    service = _make_service()
+    
+    assert list(service.stream_tokens("prompt")) == ["streamed", " answer"]
+    assert list(service.stream_tokens("prompt")) == ["streamed answer"]
+    assert service.llm.stream_completion.call_count == 1
+
+
+def test_is_document_related_question():
+    """Test keyword-based detection of document questions."""
+    service = _make_service()
+    
+    assert service.is_document_related_question("Summarize THIS report")
+    assert service.is_document_related_question("What is in the uploaded file?")
+    assert not service.is_document_related_question("What is 2 + 2?")
+
+
+@pytest.mark.asyncio
+async def test_agenerate_and_astream_tokens_share_caches():
+    """Test the async paths use the same answer cache as the sync ones."""
+    service = _make_service()
+    
+    assert await service.agenerate("prompt") == "cached answer"
+    assert service.generate("prompt") == "cached answer"
+    assert [t async for t in service.astream_tokens("other")] == ["streamed", " answer"]
+    assert [t async for t in service.astream_tokens("other")] == ["streamed answer"]
+    assert service.llm._acall.await_count == 1
+    service.llm._call.assert_not_called()
+    assert service.llm.astream_completion.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_sse_tokens_coalesces_tokens():
+    """Test that tokens are batched into growing message frames."""
+    service = _make_service()
+    service.answer_cache = None
+    service.llm.astream_completion.side_effect = lambda prompt: _astream([str(i) for i in range(10)])
+    
+    with patch('services.llm.time.monotonic', return_value=0.0):
+        events = [e async for e in service.stream_sse_tokens("prompt")]
+    
+    messages = [e for e in events if e.startswith(b"event: message")]
+    # Batches of 1, 2, 4, then the remaining 3 tokens
+    assert messages == [
+        b"event: message\ndata: 0\n\n",
+        b"event: message\ndata: 12\n\n",
+        b"event: message\ndata: 3456\n\n",
+        b"event: message\ndata: 789\n\n",
+    ]
+    assert events[-1] == b'event: done\ndata: {"token_count":10,"char_count":10}\n\n'
+
+
+
+@pytest.mark.asyncio
+async def test_stream_sse_tokens_flushes_large_batches_early():
+    """Test that a batch is flushed once it reaches SSE_MAX_FRAME_CHARS."""
+    service = _make_service()
+    service.answer_cache = None
+    service.SSE_MIN_BATCH = service.SSE_MAX_BATCH = 16
+    service.SSE_MAX_FRAME_CHARS = 4
+    service.llm.astream_completion.side_effect = lambda prompt: _astream(["ab", "cd", "e"])
+    
+    with patch('services.llm.time.monotonic', return_value=0.0):
+        events = [e async for e in service.stream_sse_tokens("prompt")]
+    
+    assert [e for e in events if e.startswith(b"event: message")] == [
+        b"event: message\ndata: abcd\n\n",
+        b"event: message\ndata: e\n\n",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_sse_tokens_flushes_during_stream_pauses():
+    """Test that buffered tokens are sent after SSE_FLUSH_INTERVAL even if no new token arrives."""
+    service = _make_service()
+    service.answer_cache = None
+    service.SSE_MIN_BATCH = service.SSE_MAX_BATCH = 16
+    service.SSE_FLUSH_INTERVAL = 0.01
+    resume = asyncio.Event()
+    
+    async def _paused(prompt):
+        """Yield two tokens, then stall until the test resumes the stream."""
+        yield "a"
+        yield "b"
+        await resume.wait()
+        yield "c"
+    
+    service.llm.astream_completion.side_effect = _paused
+    events = service.stream_sse_tokens("prompt")
+    
+    assert await asyncio.wait_for(anext(events), timeout=1.0) == b"event: message\ndata: ab\n\n"
+    resume.set()
+    assert [e async for e in events][0] == b"event: message\ndata: c\n\n"
+
+
+@pytest.mark.asyncio
+async def test_stream_sse_tokens_closes_completion_stream_on_disconnect():
+    """Test that a consumer stopping early closes the Groq stream right away."""
+    service = _make_service()
+    service.answer_cache = None
+    service.SSE_MIN_BATCH = 1
+    closed = asyncio.Event()
+    
+    async def _endless(prompt):
+        """Yield tokens forever, recording when the stream is closed."""
+        try:
+            while True:
+                yield "a"
+        finally:
+            closed.set()
+    
+    service.llm.astream_completion.side_effect = _endless
+    events = service.stream_sse_tokens("prompt")
+    
+    assert await anext(events) == b"event: message\ndata: a\n\n"
+    # Let the prefetched read finish so the stream is parked at a yield
+    await asyncio.sleep(0)
+    await events.aclose()
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_stream_sse_tokens_opens_stream_before_metadata_is_sent():
+    """Test that the Groq stream starts while the metadata frame is in flight."""
+    service = _make_service()
+    service.answer_cache = None
+    opened = asyncio.Event()
+    
+    async def _tracked(prompt):
+        """Record when the completion stream is opened."""
+        opened.set()
+        yield "token"
+    
+    service.llm.astream_completion.side_effect = _tracked
+    events = service.stream_sse_tokens("prompt", metadata={"mode": "rag"})
+    
+    assert (await anext(events)).startswith(b"event: metadata")
+    await asyncio.sleep(0)
+    assert opened.is_set()
+    assert [e async for e in events][0] == b"event: message\ndata: token\n\n"
+
+
+def test_format_sse_event_message_fast_path():
+    """Test that text frames skip JSON and keep multi-line tokens within one event."""
+    service = _make_service()
+    
+    assert service.format_sse_event("message", "a\nb") == b"event: message\ndata: a\ndata: b\n\n"
+    assert service.format_sse_event("error", {"error": "x"}) == b'event: error\ndata: {"error":"x"}\n\n'
+
+
+def test_build_rag_prompt_layout():
+    """Test that contexts are separated without scores or a trailing separator."""
+    service = _make_service()
+    prompt = service.build_rag_prompt(
+        "What is it?",
+        [{"filename": "a.pdf", "text": "alpha", "score": 0.9}, {"filename": "b.pdf", "text": "beta"}]
+    )
+    
+    assert "[Document: a.pdf]\nalpha\n\n---\n\n[Document: b.pdf]\nbeta\n\n=== END OF CONTEXT ===" in prompt
+    assert "0.9" not in prompt
+    assert prompt.endswith("Question: What is it?\n\nProvide a clear, natural answer using only the information above. "
+                           "Do not mention relevance scores or technical details.\n\nAnswer:")
+
+
+def test_build_rag_prompt_orders_contexts_deterministically():
+    """Test that retrieval order doesn't change the prompt for the same chunks."""
+    service = _make_service()
+    contexts = [
+        {"filename": "b.pdf", "chunk_id": "0_1", "text": "beta"},
+        {"filename": "a.pdf", "chunk_id": "0_2", "text": "alpha two"},
+        {"filename": "a.pdf", "chunk_id": "0_1", "text": "alpha one"},
+    ]
+    
+    prompt = service.build_rag_prompt("Q?", contexts)
+    
+    assert prompt == service.build_rag_prompt("Q?", contexts[::-1])
+    assert prompt.index("alpha one") < prompt.index("alpha two") < prompt.index("beta")
+
+    # Packed uids order numerically, so chunk 10 follows chunk 9
+    by_uid = service.build_rag_prompt("Q?", [
+        {"filename": "a.pdf", "text": "ten", "metadata": {"chunk_uid": 10}},
+        {"filename": "a.pdf", "text": "nine", "metadata": {"chunk_uid": 9}},
+    ])
+    assert by_uid.index("nine") < by_uid.index("ten")
+
+
+def test_concurrency_controller_token_bucket():
+    """Test that requests beyond the bucket capacity wait for a refill."""
+    controller = ConcurrencyController(max_concurrent=2, requests_per_minute=2)
+    
+    with patch('services.llm.time.monotonic', return_value=0.0), \
+         patch('services.llm.time.sleep') as mock_sleep:
+        controller._updated_at = 0.0
+        for _ in range(3):
+            with controller.slot():
+                pass
+    
+    # Two tokens available up front; the third waits one refill interval (30s)
+    mock_sleep.assert_called_once()
+    assert mock_sleep.call_args[0][0] == pytest.approx(30.0)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_controller_aslot_limits_and_survives_cancel():
+    """Test that aslot caps concurrent coroutines and a cancelled waiter leaks nothing."""
+    controller = ConcurrencyController(max_concurrent=1)
+    active = 0
+    peak = 0
+    
+    async def request():
+        nonlocal active, peak
+        async with controller.aslot():
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.02)
+            active -= 1
+    
+    holder = asyncio.ensure_future(request())
+    await asyncio.sleep(0.005)
+    waiter = asyncio.ensure_future(request())
+    await asyncio.sleep(0.005)
+    waiter.cancel()
+    await asyncio.gather(holder, waiter, request(), return_exceptions=True)
+    
+    assert waiter.cancelled()
+    assert peak == 1
+    # The slot is free again, so a sync caller doesn't block
+    with controller.slot():
+        pass
+
+
+@pytest.mark.asyncio
+async def test_concurrency_controller_releases_waiters_in_arrival_order():
+    """Test that queued coroutines and threads get freed slots first come, first served."""
+    controller = ConcurrencyController(max_concurrent=1)
+    release = asyncio.Event()
+    order = []
+    
+    async def request(name):
+        async with controller.aslot():
+            order.append(name)
+            if name == "holder":
+                await release.wait()
+    
+    def sync_request():
+        with controller.slot():
+            order.append("thread")
+    
+    tasks = [asyncio.ensure_future(request("holder"))]
+    await asyncio.sleep(0)
+    for name in (0, 1, 2, "thread", 3, 4):
+        if name == "thread":
+            tasks.append(asyncio.ensure_future(asyncio.to_thread(sync_request)))
+        else:
+            tasks.append(asyncio.ensure_future(request(name)))
+        queued = len(controller._waiters) + 1
+        while len(controller._waiters) < queued:
+            await asyncio.sleep(0.001)
+    release.set()
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=5)
+    
+    assert order == ["holder", 0, 1, 2, "thread", 3, 4]
+
+
+class _FakeStreamingResponse:
+    """Stands in for the context manager returned by with_streaming_response.create."""
+    
+    def __init__(self, chunks=(), error=None):
+        self.chunks = chunks
+        self.error = error
+    
+    async def __aenter__(self):
+        if self.error is not None:
+            raise self.error
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+    
+    async def iter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_astream_completion_retries_opening_the_stream():
+    """Test that a transient failure opening a stream is retried like a plain completion."""
+    with patch('services.llm.settings') as mock_settings:
+        mock_settings.groq_api_key = "test_key"
+        llm = GroqLLM()
+    
+    error = APIConnectionError(request=httpx.Request("POST", "https://api.groq.com"))
+    create = Mock(side_effect=[
+        _FakeStreamingResponse(error=error),
+        _FakeStreamingResponse([b'data: {"choices":[{"delta":{"content":"token"}}]}\n\n']),
+    ])
+    llm.async_client = Mock()
+    llm.async_client.chat.completions.with_streaming_response.create = create
+    
+    with patch('services.llm.GROQ_RETRY_BASE', 0.0):
+        tokens = [t async for t in llm.astream_completion("prompt")]
+    
+    assert tokens == ["token"]
+    assert create.call_count == 2
+
+
+def _status_error(status_code):
+    """Build the groq APIStatusError subclass the SDK raises for an HTTP status."""
+    request = httpx.Request("POST", "https://api.groq.com")
+    response = httpx.Response(status_code, request=request)
+    error_cls = {400: BadRequestError, 429: RateLimitError, 503: InternalServerError}[status_code]
+    return error_cls("error", response=response, body=None)
+
+
+@pytest.mark.asyncio
+async def test_with_retry_retries_only_transient_errors():
+    """Test that 429/5xx are retried with backoff while other API errors fail at once."""
+    calls = []
+    
+    def flaky(errors):
+        async def attempt():
+            calls.append(1)
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+        return attempt
+    
+    with patch('services.llm.asyncio.sleep', new=AsyncMock()) as mock_sleep:
+        assert await _with_retry(flaky([_status_error(429), _status_error(503)]), base=0.5) == "ok"
+        assert len(calls) == 3
+        assert [c.args[0] for c in mock_sleep.await_args_list] == [
+            pytest.approx(0.55, abs=0.05), pytest.approx(1.05, abs=0.05)
+        ]
+        
+        calls.clear()
+        with pytest.raises(BadRequestError):
+            await _with_retry(flaky([_status_error(400)]))
+        assert len(calls) == 1
+        
+        calls.clear()
+        with pytest.raises(InternalServerError):
+            await _with_retry(flaky([_status_error(503)] * 3))
+        assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_iter_completion_tokens_parses_raw_sse_bytes():
+    """Test that tokens are extracted from raw Groq SSE bytes split at arbitrary points."""
+    raw = (
+        'data: {"choices":[{"delta":{"role":"assistant"}}]}\n\n'
+        'data: {"choices":[{"delta":{"content":"Hé"}}]}\n\n'
+        'data: {"choices":[{"delta":{"content":" there\\n"}}]}\n\n'
+        'data: {"choices":[],"x_groq":{"usage":{}}}\n\n'
+        'data: [DONE]'
+    ).encode("utf-8")
+    pieces = [raw[i:i + 7] for i in range(0, len(raw), 7)]
+    
+    tokens = [t async for t in _iter_completion_tokens(_astream(pieces))]
+    
+    assert tokens == ["Hé", " there\n"]
+
+
+@pytest.mark.asyncio
+async def test_iter_completion_tokens_raises_on_stream_error():
+    """Test that an error reported mid-stream surfaces instead of ending the answer silently."""
+    lines = [b'data: {"choices":[{"delta":{"content":"a"}}]}\n', b'data: {"error":{"message":"overloaded"}}\n']
+    
+    with pytest.raises(RuntimeError, match="overloaded"):
+        _ = [t async for t in _iter_completion_tokens(_astream(lines))]
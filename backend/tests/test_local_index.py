@@ -0,0 +1,81 @@
+"""
+Test suite for KnowledgeExplorer local vector index
+"""
+
+import numpy as np
+import pytest
+from services.local_index import LocalVectorIndex
+
+
+def _ready_index(capacity=8, quantize=False):
+    """Create a ready local index holding three 2-d vectors from two files."""
+    index = LocalVectorIndex(capacity, quantize=quantize)
+    index.ready = True
+    index.add(
+        ["a0", "a1", "b0"],
+        np.array([[1.0, 0.0], [0.6, 0.8], [0.0, 2.0]]),
+        [{"filename": "a.pdf"}, {"filename": "a.pdf"}, {"filename": "b.pdf"}]
+    )
+    return index
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_query_ranks_by_cosine_similarity(quantize):
+    """Test that results are the top_k rows by cosine score, best first."""
+    index = _ready_index(quantize=quantize)
+    
+    results = index.query(np.array([0.0, 1.0]), top_k=2)
+    
+    assert [r["id"] for r in results] == ["b0", "a1"]
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-2)
+    assert results[1]["score"] == pytest.approx(0.8, abs=1e-2)
+    assert results[0]["metadata"] == {"filename": "b.pdf"}
+
+
+def test_query_applies_filename_filter():
+    """Test that a filename equality filter is evaluated locally."""
+    index = _ready_index()
+    
+    results = index.query(np.array([0.0, 1.0]), top_k=5, filter={"filename": {"$eq": "a.pdf"}})
+    
+    assert [r["id"] for r in results] == ["a1", "a0"]
+    assert index.query(np.array([0.0, 1.0]), top_k=5, filter={"text": {"$eq": "x"}}) is None
+
+
+def test_add_overwrites_and_delete_compacts():
+    """Test that re-adding an id replaces its row and deletes keep the rest aligned."""
+    index = _ready_index()
+    index.add(["a0"], np.array([[0.0, 1.0]]), [{"filename": "b.pdf"}])
+    
+    assert len(index) == 3
+    assert index.delete_filename("a.pdf") == 1
+    assert [r["id"] for r in index.query(np.array([0.0, 1.0]), top_k=5)] == ["a0", "b0"]
+    assert index.delete_ids(["b0", "missing"]) == 1
+    assert [r["id"] for r in index.query(np.array([0.0, 1.0]), top_k=5)] == ["a0"]
+
+
+def test_growing_past_capacity_disables_the_index():
+    """Test that a corpus larger than the capacity falls back to Pinecone."""
+    index = _ready_index(capacity=3)
+    
+    assert not index.add(["c0"], np.array([[1.0, 1.0]]), [{"filename": "c.pdf"}])
+    assert not index.ready
+    assert index.query(np.array([1.0, 0.0]), top_k=1) is None
+
+
+def test_quantized_rows_score_like_float_rows():
+    """Test that int8 storage across several scoring blocks stays close to float32 scores."""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 64)).astype(np.float32)
+    query = rng.standard_normal(64).astype(np.float32)
+    exact, quantized = LocalVectorIndex(100), LocalVectorIndex(100, quantize=True)
+    quantized.SCORE_BLOCK_ROWS = 16
+    for index in (exact, quantized):
+        index.ready = True
+        index.add([str(i) for i in range(50)], vectors, [{}] * 50)
+    
+    expected = {r["id"]: r["score"] for r in exact.query(query, top_k=50)}
+    actual = {r["id"]: r["score"] for r in quantized.query(query, top_k=50)}
+    
+    assert quantized._matrix.dtype == np.int8
+    assert max(abs(expected[i] - actual[i]) for i in expected) < 1e-2
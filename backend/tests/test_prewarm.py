@@ -0,0 +1,116 @@
+"""
+Test suite for KnowledgeExplorer batch prewarm service
+"""
+
+import numpy as np
+import orjson
+import pytest
+from unittest.mock import Mock, patch
+from services.cache import SemanticCache
+from services.prewarm import BatchPrewarmService
+
+
+@pytest.fixture
+def mock_llm_service():
+    """Patch the LLM service with a mocked Groq client and a real semantic cache."""
+    with patch('services.prewarm.llm_service') as mock_service:
+        mock_service.llm = Mock(model="test-model", temperature=0.7)
+        mock_service.llm.client.files.create.return_value.id = "file_in"
+        mock_service.llm.client.batches.create.return_value.id = "batch_1"
+        mock_service.semantic_cache = SemanticCache(maxsize=8, threshold=0.95)
+        yield mock_service
+
+
+def _make_service():
+    """Create an enabled BatchPrewarmService regardless of settings."""
+    service = BatchPrewarmService()
+    service.enabled = True
+    return service
+
+
+def _submit(service):
+    """Submit two chunks of doc.pdf with orthogonal embeddings."""
+    vectors = np.eye(2, dtype=np.float32)
+    return service.submit("doc.pdf", ["a", "b"], ["alpha", "beta"], vectors)
+
+
+def test_submit_uploads_jsonl_batch(mock_llm_service):
+    """Test that one batch request line is uploaded per chunk."""
+    service = _make_service()
+    
+    assert _submit(service) == "batch_1"
+    
+    upload = mock_llm_service.llm.client.files.create.call_args.kwargs["file"][1]
+    lines = [orjson.loads(line) for line in upload.splitlines()]
+    assert [line["custom_id"] for line in lines] == ["doc.pdf:a", "doc.pdf:b"]
+    assert lines[0]["body"]["model"] == "test-model"
+    assert mock_llm_service.llm.client.batches.create.call_args.kwargs["input_file_id"] == "file_in"
+    assert service.pending == 1
+
+
+def test_poll_caches_completed_batch_results(mock_llm_service):
+    """Test that successful batch responses warm the semantic cache under chunk vectors."""
+    service = _make_service()
+    _submit(service)
+    client = mock_llm_service.llm.client
+    client.batches.retrieve.return_value = Mock(status="completed", output_file_id="file_out")
+    client.files.content.return_value.read.return_value = b"\n".join([
+        orjson.dumps({"custom_id": "doc.pdf:a", "response": {
+            "status_code": 200, "body": {"choices": [{"message": {"content": "summary a"}}]}
+        }}),
+        orjson.dumps({"custom_id": "doc.pdf:b", "response": {"status_code": 500, "body": {}}}),
+    ])
+    
+    assert service.poll() == 1
+    
+    cache = mock_llm_service.semantic_cache
+    assert cache.lookup(np.array([1.0, 0.0]), frozenset({"doc.pdf"})) == "summary a"
+    assert cache.lookup(np.array([0.0, 1.0]), frozenset({"doc.pdf"})) is None
+    assert service.pending == 0
+
+
+def test_poll_falls_back_to_online_calls_after_timeout(mock_llm_service):
+    """Test that a batch still running past the timeout is cancelled and answered online."""
+    service = _make_service()
+    _submit(service)
+    client = mock_llm_service.llm.client
+    client.batches.retrieve.return_value = Mock(status="in_progress")
+    mock_llm_service.llm._call.return_value = "online summary"
+    
+    assert service.poll() == 0
+    assert service.pending == 1
+    
+    with patch('services.prewarm.settings') as mock_settings:
+        mock_settings.batch_prewarm_timeout = -1
+        assert service.poll() == 2
+    
+    client.batches.cancel.assert_called_once_with("batch_1")
+    assert service.pending == 0
+
+
+def test_discarded_batches_are_not_cached(mock_llm_service):
+    """Test that deleting a file drops its pending batches."""
+    service = _make_service()
+    _submit(service)
+    
+    assert service.discard("other.pdf") == 0
+    assert service.discard("doc.pdf") == 1
+    assert service.poll() == 0
+    mock_llm_service.llm.client.batches.retrieve.assert_not_called()
+
+
+def test_discard_while_fetching_wins_over_store(mock_llm_service):
+    """Test that answers fetched off-loop are dropped if the file was discarded before storing."""
+    service = _make_service()
+    _submit(service)
+    mock_llm_service.llm.client.batches.retrieve.return_value = Mock(status="in_progress")
+    mock_llm_service.llm._call.return_value = "online summary"
+    
+    with patch('services.prewarm.settings') as mock_settings:
+        mock_settings.batch_prewarm_timeout = -1
+        finished = service._fetch_finished()
+    
+    assert len(mock_llm_service.semantic_cache) == 0
+    service.discard("doc.pdf")
+    assert service._store_finished(finished) == 0
+    assert len(mock_llm_service.semantic_cache) == 0
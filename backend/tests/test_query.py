@@ -0,0 +1,225 @@
+"""
+Test suite for KnowledgeExplorer query pipeline
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from pipeline.query import SOURCE_PREVIEW_CHARS, QueryPipeline
+
+
+@pytest.mark.asyncio
+async def test_query_coalesces_identical_inflight_questions():
+    """Concurrent identical questions should share a single pipeline run."""
+    pipeline = QueryPipeline(top_k=5)
+    calls = []
+    
+    async def fake_run(question, top_k, force_documents):
+        calls.append(question)
+        await asyncio.sleep(0.01)
+        return {"answer": "42", "sources": [], "metadata": {"mode": "rag"}}
+    
+    with patch.object(pipeline, '_run_query', side_effect=fake_run):
+        first, second, other = await asyncio.gather(
+            pipeline.query("What is this?"),
+            pipeline.query("What is this?"),
+            pipeline.query("Something else?")
+        )
+    
+    assert first is second
+    assert calls == ["What is this?", "Something else?"]
+    assert pipeline._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_query_inflight_error_propagates_to_all_callers():
+    """A failed shared run should raise for every waiting caller."""
+    pipeline = QueryPipeline(top_k=5)
+    
+    async def failing_run(question, top_k, force_documents):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+    
+    with patch.object(pipeline, '_run_query', side_effect=failing_run):
+        results = await asyncio.gather(
+            pipeline.query("What is this?"),
+            pipeline.query("What is this?"),
+            return_exceptions=True
+        )
+    
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert pipeline._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_query_answer_cache_respects_corpus_version():
+    """Cached answers are reused until the corpus changes; fallbacks are never cached."""
+    pipeline = QueryPipeline(top_k=5)
+    modes = ["rag", "rag", "general_fallback", "general_fallback"]
+    calls = []
+    
+    async def fake_run(question, top_k, force_documents):
+        calls.append(question)
+        return {"answer": "42", "sources": [], "metadata": {"mode": modes[len(calls) - 1]}}
+    
+    with patch.object(pipeline, '_run_query', side_effect=fake_run), \
+         patch('pipeline.query.vectorstore_service') as mock_store:
+        mock_store.corpus_version = 0
+        await pipeline.query("What is this?")
+        await pipeline.query("What is this?  ")
+        assert len(calls) == 1
+        
+        # An upload bumps the corpus version, retiring the cached answer
+        mock_store.corpus_version = 1
+        await pipeline.query("What is this?")
+        assert len(calls) == 2
+        
+        await pipeline.query("Unrelated?")
+        await pipeline.query("Unrelated?")
+        assert len(calls) == 4
+
+
+def test_retrieve_documents_labels_packed_and_legacy_chunk_ids():
+    """Packed chunk uids are reported as <doc>_<chunk>; older vectors keep their stored label."""
+    pipeline = QueryPipeline(top_k=5)
+    matches = [
+        {"id": "a", "score": 0.9, "metadata": {"filename": "a.pdf", "text": "x", "chunk_uid": float(3 << 32 | 7)}},
+        {"id": "b", "score": 0.8, "metadata": {"filename": "b.pdf", "text": "y", "chunk_id": "0_1"}},
+    ]
+    
+    with patch('pipeline.query.vectorstore_service') as mock_store:
+        mock_store.query_vector.return_value = matches
+        documents = pipeline.retrieve_documents([0.0], top_k=2, min_score=0.0)
+    
+    assert [doc["chunk_id"] for doc in documents] == ["3_7", "0_1"]
+    assert documents[0]["prompt_fragment"] == "[Document: a.pdf]\nx"
+    assert documents[1]["source"] == {"filename": "b.pdf", "chunk_id": "0_1", "score": 0.8, "preview": "y"}
+
+
+def test_format_sources_truncates_previews():
+    """Sources reuse the entry built at retrieval and only truncate long texts."""
+    prebuilt = {"filename": "a.pdf", "chunk_id": "0_0", "score": 0.9, "preview": "cached"}
+    documents = [
+        {"filename": "a.pdf", "chunk_id": "0_0", "score": 0.9, "text": "x", "source": prebuilt},
+        {"filename": "b.pdf", "chunk_id": "0_1", "score": 0.8, "text": "y" * (SOURCE_PREVIEW_CHARS + 1)},
+    ]
+    
+    sources = QueryPipeline._format_sources(documents)
+    
+    assert sources[0] is prebuilt
+    assert sources[1]["preview"] == "y" * SOURCE_PREVIEW_CHARS + "..."
+
+
+@pytest.mark.asyncio
+async def test_embed_question_normalizes_whitespace():
+    """Whitespace-only variants of a question are embedded under the same cache key."""
+    pipeline = QueryPipeline(top_k=5)
+    
+    with patch('pipeline.query.embeddings_service') as mock_embeddings:
+        mock_embeddings.embed_query = AsyncMock(return_value=[0.0])
+        await pipeline.embed_question("  What is\n this? ")
+    
+    mock_embeddings.embed_query.assert_awaited_once_with("What is this?")
+
+
+@pytest.mark.asyncio
+async def test_warmup_pins_hot_questions_until_the_corpus_changes():
+    """Warmed questions skip embedding, and retrieval is redone once per corpus version."""
+    pipeline = QueryPipeline(top_k=5)
+    match = {"id": "a", "score": 0.9, "metadata": {"filename": "a.pdf", "text": "x", "chunk_id": "0_0"}}
+    
+    with patch('pipeline.query.vectorstore_service') as mock_store, \
+         patch('pipeline.query.embeddings_service') as mock_embeddings:
+        mock_store.corpus_version = 0
+        mock_store.query_vector.return_value = [match]
+        mock_embeddings.embed_query = AsyncMock(return_value=[1.0])
+        
+        assert await pipeline.warmup(["What is  this?", "", "What is this?"]) == 1
+        vector = await pipeline.embed_question("What is this?")
+        documents = pipeline._retrieve("What is this?", vector, None)
+        assert mock_embeddings.embed_query.await_count == 1
+        assert mock_store.query_vector.call_count == 1
+        
+        mock_store.corpus_version = 1
+        assert pipeline._retrieve("What is this?", vector, None) == documents
+        assert mock_store.query_vector.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_run_query_reuses_answers_for_similar_questions():
+    """A paraphrase with a near-identical embedding skips retrieval and generation."""
+    pipeline = QueryPipeline(top_k=5)
+    match = {"id": "a", "score": 0.9, "metadata": {"filename": "a.pdf", "text": "x", "chunk_id": "0_0"}}
+    
+    with patch('pipeline.query.llm_service') as mock_llm, \
+         patch('pipeline.query.vectorstore_service') as mock_store, \
+         patch('pipeline.query.embeddings_service') as mock_embeddings:
+        mock_llm.is_document_related_question.return_value = True
+        mock_llm.agenerate = AsyncMock(return_value="Answer. Source: a.pdf")
+        mock_store.get_stats.return_value.total_vector_count = 1
+        mock_store.corpus_version = 0
+        mock_store.query_vector.return_value = [match]
+        mock_embeddings.embed_query = AsyncMock(side_effect=[[1.0, 0.0], [0.99, 0.01], [0.99, 0.01]])
+        
+        first = await pipeline._run_query("What is in the file?")
+        second = await pipeline._run_query("What's in the file?")
+        assert mock_llm.agenerate.await_count == 1
+        assert mock_store.query_vector.call_count == 1
+        assert second["answer"] == first["answer"]
+        assert second["metadata"]["question"] == "What's in the file?"
+        
+        # New documents retire the similar-question entry
+        mock_store.corpus_version = 1
+        await pipeline._run_query("What's in the file?")
+        assert mock_llm.agenerate.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_query_sends_one_metadata_frame():
+    """The general-knowledge stream carries a single metadata event before the tokens."""
+    pipeline = QueryPipeline(top_k=5)
+    
+    async def fake_sse(prompt, metadata=None, **kwargs):
+        yield b"event: metadata\n"
+        yield b"event: message\n"
+    
+    with patch('pipeline.query.llm_service') as mock_llm, \
+         patch('pipeline.query.vectorstore_service') as mock_store:
+        mock_llm.is_document_related_question.return_value = False
+        mock_llm.stream_sse_tokens.side_effect = fake_sse
+        mock_store.get_stats.return_value.total_vector_count = 0
+        events = [e async for e in pipeline.stream_query("What is 2 + 2?")]
+    
+    assert events == [b"event: metadata\n", b"event: message\n"]
+
+
+@pytest.mark.asyncio
+async def test_stream_query_sends_partial_sources_before_metadata():
+    """A provisional source list is streamed before the metadata frame with the final sources."""
+    pipeline = QueryPipeline(top_k=5)
+    old = {"id": "a", "score": 0.9, "metadata": {"filename": "a.pdf", "text": "x", "chunk_id": "0_0"}}
+    new = {"id": "b", "score": 0.9, "metadata": {"filename": "b.pdf", "text": "y", "chunk_id": "0_1"}}
+    sent_metadata = []
+    
+    async def fake_query_stream(**kwargs):
+        yield [old], False
+        yield [new], True
+    
+    async def fake_sse(prompt, metadata=None, **kwargs):
+        sent_metadata.append(metadata)
+        yield b"event: metadata\n"
+    
+    with patch('pipeline.query.llm_service') as mock_llm, \
+         patch('pipeline.query.vectorstore_service') as mock_store, \
+         patch('pipeline.query.embeddings_service') as mock_embeddings:
+        mock_llm.is_document_related_question.return_value = True
+        mock_llm.stream_sse_tokens.side_effect = fake_sse
+        mock_llm.format_sse_event.side_effect = lambda event, data: (event, data)
+        mock_store.get_stats.return_value.total_vector_count = 2
+        mock_store.query_vector_stream = fake_query_stream
+        mock_embeddings.embed_query = AsyncMock(return_value=[1.0])
+        events = [e async for e in pipeline.stream_query("What is in the file?")]
+    
+    assert events[0] == ("partial_sources", {"sources": [QueryPipeline._to_documents([old], 5, 0.0)[0]["source"]]})
+    assert events[1:] == [b"event: metadata\n"]
+    assert [s["filename"] for s in sent_metadata[0]["sources"]] == ["b.pdf"]
@@ -0,0 +1,48 @@
+"""
+Test suite for KnowledgeExplorer text splitter
+"""
+
+import pytest
+from pipeline.text_splitter import FastRecursiveSplitter
+
+
+def test_short_text_is_single_chunk():
+    """Test that text within chunk_size is returned unchanged (stripped)."""
+    splitter = FastRecursiveSplitter(chunk_size=100, chunk_overlap=10)
+    
+    assert splitter.split_text("  hello world \n") == ["hello world"]
+    assert splitter.split_text("") == []
+
+
+def test_prefers_paragraph_boundaries():
+    """Test that paragraphs are kept whole when they fit."""
+    splitter = FastRecursiveSplitter(chunk_size=20, chunk_overlap=0)
+    text = "first paragraph\n\nsecond paragraph\n\nthird one"
+    
+    assert splitter.split_text(text) == ["first paragraph", "second paragraph", "third one"]
+
+
+def test_chunks_respect_size_and_overlap():
+    """Test size bound, word-aligned overlap, and coverage of every word."""
+    splitter = FastRecursiveSplitter(chunk_size=30, chunk_overlap=10)
+    words = [f"word{i}" for i in range(40)]
+    chunks = splitter.split_text(" ".join(words))
+    
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    # Consecutive chunks share their boundary word
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous.split()[-1] == current.split()[0]
+    assert {w for chunk in chunks for w in chunk.split()} == set(words)
+
+
+def test_hard_cuts_text_without_separators():
+    """Test that text with no separators is sliced at chunk_size."""
+    splitter = FastRecursiveSplitter(chunk_size=10, chunk_overlap=0)
+    
+    assert splitter.split_text("a" * 25) == ["a" * 10, "a" * 10, "a" * 5]
+
+
+def test_rejects_overlap_not_smaller_than_size():
+    """Test configuration validation."""
+    with pytest.raises(ValueError):
+        FastRecursiveSplitter(chunk_size=10, chunk_overlap=10)
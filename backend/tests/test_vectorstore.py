@@ -2,121 +2,503 @@
 Test suite for KnowledgeExplorer vector store service
 """
 
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pytest
 from unittest.mock import Mock, patch
-from services.vectorstore import VectorStoreService
+from tenacity import wait_none
+from services.local_index import LocalVectorIndex
+from services.vectorstore import _KNOWN_INDEXES, UpsertBatchTuner, VectorStoreService, _generate_ids
 
 
-def test_vectorstore_init():
-    """Test vector store initialization."""
+@pytest.fixture(scope="module", autouse=True)
+def mock_pinecone():
+    """Patch the Pinecone client class once for the whole module."""
     with patch('services.vectorstore.Pinecone') as mock_pinecone:
-        mock_client = Mock()
-        mock_pinecone.return_value = mock_client
-        
+        yield mock_pinecone
+
+
+@pytest.fixture(autouse=True)
+def forget_known_indexes():
+    """Start every test without indexes remembered from earlier connects."""
+    _KNOWN_INDEXES.clear()
+
+
+@pytest.fixture
+def pinecone_client(mock_pinecone):
+    """Fresh mocked Pinecone client returned by Pinecone(...) for each test."""
+    mock_pinecone.reset_mock(return_value=True, side_effect=True)
+    return mock_pinecone.return_value
+
+
+@pytest.fixture(scope="module")
+def vector():
+    """A single float32 embedding, matching what the embeddings service returns."""
+    return np.full(768, 0.1, dtype=np.float32)
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    """A (2, 768) float32 embedding matrix of two different directions."""
+    return np.stack([np.full(768, 0.1), np.linspace(0.1, 0.3, 768)]).astype(np.float32)
+
+
+def test_vectorstore_init(mock_pinecone, pinecone_client):
+    """Test vector store initialization."""
+    with patch('services.vectorstore.settings') as mock_settings:
+        mock_settings.pinecone_api_key = "test_key"
+        mock_settings.pinecone_pool_size = 32
+        mock_settings.query_cache_size = 0
+        mock_settings.local_index_max_vectors = 0
+        mock_settings.pinecone_upsert_autotune = False
         service = VectorStoreService()
-        service.api_key = "test_key"
-        service.pc = Pinecone(api_key="test_key")
-        
-        assert service.pc is not None
+    
+    # The client is only built on first use, and only once
+    mock_pinecone.assert_not_called()
+    assert service.pc is pinecone_client
+    assert service.pc is pinecone_client
+    mock_pinecone.assert_called_once_with(api_key="test_key", connection_pool_maxsize=32)
 
 
-def test_init_index_creates_new():
+def test_init_index_creates_new(pinecone_client):
     """Test creating a new index."""
-    with patch('services.vectorstore.Pinecone') as mock_pinecone:
-        mock_client = Mock()
-        mock_client.list_indexes.return_value = []
-        mock_client.create_index = Mock()
-        mock_client.Index.return_value = Mock()
-        mock_pinecone.return_value = mock_client
-        
-        service = VectorStoreService()
-        service.api_key = "test_key"
-        service.pc = mock_client
-        
-        result = service.init_index(dimension=768)
-        
-        assert result is True
-        mock_client.create_index.assert_called_once()
+    pinecone_client.list_indexes.return_value = []
+    
+    service = VectorStoreService()
+    service.api_key = "test_key"
+    service.pc = pinecone_client
+    
+    result = service.init_index(dimension=768)
+    
+    assert result is True
+    pinecone_client.create_index.assert_called_once()
 
 
-def test_init_index_connects_existing():
+def test_init_index_connects_existing(pinecone_client):
     """Test connecting to existing index."""
-    with patch('services.vectorstore.Pinecone') as mock_pinecone:
-        mock_index_info = Mock()
-        mock_index_info.name = "knowledge-explorer"
-        
-        mock_client = Mock()
-        mock_client.list_indexes.return_value = [mock_index_info]
-        mock_index = Mock()
-        mock_index.describe_index_stats.return_value = {"total_vector_count": 100}
-        mock_client.Index.return_value = mock_index
-        mock_pinecone.return_value = mock_client
-        
-        service = VectorStoreService()
-        service.api_key = "test_key"
-        service.pc = mock_client
-        service.index_name = "knowledge-explorer"
-        
-        result = service.init_index(dimension=768)
-        
-        assert result is True
-        assert service.index is not None
+    mock_index_info = Mock()
+    mock_index_info.name = "knowledge-explorer"
+    pinecone_client.list_indexes.return_value = [mock_index_info]
+    pinecone_client.Index.return_value.describe_index_stats.return_value = {"total_vector_count": 100}
+    
+    service = VectorStoreService()
+    service.api_key = "test_key"
+    service.pc = pinecone_client
+    service.index_name = "knowledge-explorer"
+    
+    result = service.init_index(dimension=768)
+    
+    assert result is True
+    assert service.index is not None
+    pinecone_client.create_index.assert_not_called()
+    
+    # The stats fetched while connecting serve the first get_stats()
+    assert service.get_stats() == {"total_vector_count": 100}
+    pinecone_client.Index.return_value.describe_index_stats.assert_called_once()
+
+
+def test_init_index_skips_listing_known_indexes(pinecone_client):
+    """Test that reconnecting after close() doesn't list indexes again."""
+    pinecone_client.list_indexes.return_value = []
+    
+    service = VectorStoreService()
+    service.pc = pinecone_client
+    assert service.init_index(dimension=768)
+    service.close()
+    service.pc = pinecone_client
+    assert service.init_index(dimension=768)
+    
+    pinecone_client.list_indexes.assert_called_once()
+    pinecone_client.create_index.assert_called_once()
+    assert pinecone_client.Index.call_count == 2
+
+
+def test_ensure_index_connects_once(pinecone_client):
+    """Test that concurrent first writers initialize the index only once."""
+    service = VectorStoreService()
+    service.pc = pinecone_client
+    pinecone_client.list_indexes.return_value = []
+    
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: service.ensure_index(dimension=768), range(4)))
+    
+    assert results == [True] * 4
+    pinecone_client.create_index.assert_called_once()
+    pinecone_client.Index.assert_called_once()
+    assert pinecone_client.Index.call_args.kwargs["pool_threads"] == service.pool_size
+
+
+def test_close_releases_pooled_clients(pinecone_client):
+    """Test that shutdown closes the index and client exactly once."""
+    service = VectorStoreService()
+    service.pc = pinecone_client
+    index = service.index = Mock()
+    
+    service.close()
+    service.close()
+    
+    index.close.assert_called_once()
+    pinecone_client.close.assert_called_once()
+    assert service.index is None
 
 
-def test_upsert_vectors():
+def test_upsert_vectors(vectors):
     """Test upserting vectors."""
     mock_index = Mock()
-    mock_response = Mock()
-    mock_response.upserted_count = 2
-    mock_index.upsert.return_value = mock_response
+    mock_index.upsert.return_value = Mock(upserted_count=2, failed_item_count=0)
     
     service = VectorStoreService()
     service.index = mock_index
     
-    vectors = [[0.1] * 768, [0.2] * 768]
     metadata = [{"text": "doc1"}, {"text": "doc2"}]
     
     result = service.upsert_vectors(vectors, metadata)
     
     assert result["upserted_count"] == 2
     mock_index.upsert.assert_called_once()
+    kwargs = mock_index.upsert.call_args.kwargs
+    assert kwargs["batch_size"] == service.upsert_batch_size
+    assert kwargs["max_concurrency"] == service.upsert_concurrency
+    records = list(kwargs["vectors"])
+    assert [meta for _, _, meta in records] == metadata
+    # Rows are handed over as float32 arrays, never pre-converted to lists
+    assert all(values.dtype == np.float32 for _, values, _ in records)
+
+
+def test_vectors_and_queries_are_sent_unit_normalized(pinecone_client, vectors, vector):
+    """Test that new indexes use dotproduct over client-side normalized vectors."""
+    pinecone_client.list_indexes.return_value = []
+    index = pinecone_client.Index.return_value
+    index.upsert.return_value = Mock(upserted_count=2, failed_item_count=0)
+    index.query.return_value.matches = []
+    index.describe_index_stats.return_value = Mock(total_vector_count=0, dimension=768)
+    
+    service = VectorStoreService()
+    service.pc = pinecone_client
+    service.query_cache = None
+    assert service.init_index(dimension=768)
+    service.upsert_vectors(vectors, [{"text": "doc1"}, {"text": "doc2"}])
+    service.query_vector(vector * 3)
+    
+    assert pinecone_client.create_index.call_args.kwargs["metric"] == "dotproduct"
+    sent = np.array([values for _, values, _ in index.upsert.call_args.kwargs["vectors"]])
+    assert np.allclose(np.linalg.norm(sent, axis=1), 1.0)
+    assert np.linalg.norm(index.query.call_args.kwargs["vector"]) == pytest.approx(1.0)
+
+
+def test_upsert_vectors_rejects_unretryable_batch_failures(vectors):
+    """Test that a deterministic batch rejection is surfaced without retries."""
+    mock_index = Mock()
+    mock_index.upsert.return_value = Mock(
+        upserted_count=1,
+        failed_item_count=1,
+        errors=[Mock(error_message="dimension mismatch", retryable=False)]
+    )
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    
+    with pytest.raises(ValueError, match="dimension mismatch"):
+        service.upsert_vectors(vectors, [{"text": "doc1"}, {"text": "doc2"}], batch_size=1)
+    
+    mock_index.upsert.assert_called_once()
+    assert mock_index.upsert.call_args.kwargs["batch_size"] == 1
+
+
+def test_upsert_vectors_retries_only_failed_batches(vectors):
+    """Test that a transient batch failure resends only that batch's items."""
+    failed_items = [("id-1", [0.2] * 768, {"text": "doc2"})]
+    mock_index = Mock()
+    mock_index.upsert.side_effect = [
+        Mock(
+            upserted_count=1,
+            failed_item_count=1,
+            errors=[Mock(error_message="503 unavailable", retryable=True)],
+            failed_items=failed_items
+        ),
+        Mock(upserted_count=1, failed_item_count=0),
+    ]
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    
+    with patch.dict('services.vectorstore.PINECONE_RETRY_POLICY', wait=wait_none()):
+        result = service.upsert_vectors(vectors, [{"text": "doc1"}, {"text": "doc2"}], batch_size=1)
+    
+    assert result["upserted_count"] == 2
+    assert mock_index.upsert.call_count == 2
+    assert mock_index.upsert.call_args.kwargs["vectors"] is failed_items
+
+
+def test_batch_tuner_grows_on_fast_batches_and_halves_on_throttling(tmp_path):
+    """Test that the tuned batch size follows latency, stays in bounds and survives restarts."""
+    state_path = str(tmp_path / ".state" / "tuning.json")
+    tuner = UpsertBatchTuner(64, state_path)
+    
+    tuner.record(items=512, batch_size=64, concurrency=8, elapsed=0.1)
+    assert tuner.batch_size == 128
+    # A partial batch says nothing about larger ones
+    tuner.record(items=10, batch_size=128, concurrency=8, elapsed=0.01)
+    assert tuner.batch_size == 128
+    tuner.record(items=1024, batch_size=128, concurrency=8, elapsed=0.1, throttled=True)
+    assert tuner.batch_size == 64
+    tuner.record(items=512, batch_size=64, concurrency=8, elapsed=10.0)
+    assert tuner.batch_size == 32
+    
+    assert UpsertBatchTuner(64, state_path).batch_size == 32
+    assert UpsertBatchTuner(5000).batch_size == UpsertBatchTuner.MAX_BATCH_SIZE
+
+
+def test_upsert_vectors_retries_throttled_batches_smaller(vectors):
+    """Test that a throttled attempt halves the tuned batch size for the retry."""
+    mock_index = Mock()
+    mock_index.upsert.side_effect = [
+        Mock(
+            upserted_count=0,
+            failed_item_count=2,
+            errors=[Mock(error_message="429 too many requests", retryable=True)],
+            failed_items=[]
+        ),
+        Mock(upserted_count=2, failed_item_count=0),
+    ]
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    service.batch_tuner = UpsertBatchTuner(64)
+    
+    with patch.dict('services.vectorstore.PINECONE_RETRY_POLICY', wait=wait_none()):
+        service.upsert_vectors(vectors, [{"text": "doc1"}, {"text": "doc2"}])
+    
+    assert [c.kwargs["batch_size"] for c in mock_index.upsert.call_args_list] == [64, 32]
+
+
+def test_upsert_vectors_skips_duplicates_per_file(vectors):
+    """Test that repeated vectors of a file are uploaded once, until the file is deleted."""
+    mock_index = Mock()
+    mock_index.upsert.return_value = Mock(upserted_count=2, failed_item_count=0)
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    repeated = np.vstack([vectors, vectors[:1]])
+    metadata = [{"filename": "a.pdf"}] * 3
+    
+    assert service.upsert_vectors(repeated, metadata)["skipped_count"] == 1
+    assert len(list(mock_index.upsert.call_args.kwargs["vectors"])) == 2
+    
+    # Already stored for a.pdf, but new for b.pdf
+    assert service.upsert_vectors(vectors, metadata[:2]) == {"upserted_count": 0, "skipped_count": 2}
+    assert mock_index.upsert.call_count == 1
+    service.upsert_vectors(vectors, [{"filename": "b.pdf"}] * 2)
+    assert mock_index.upsert.call_count == 2
+    
+    service.delete_by_filename("a.pdf")
+    assert service.upsert_vectors(vectors, metadata[:2])["skipped_count"] == 0
+
+
+def test_delete_by_ids_batches_and_forgets_dedup_keys(vectors):
+    """Test that ids are deleted in Pinecone-sized batches and the file's vectors can be re-sent."""
+    mock_index = Mock()
+    mock_index.upsert.return_value = Mock(upserted_count=2, failed_item_count=0)
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    metadata = [{"filename": "a.pdf"}] * 2
+    service.upsert_vectors(vectors, metadata)
+    
+    with patch.object(VectorStoreService, 'DELETE_BATCH_SIZE', 2):
+        assert service.delete_by_ids(["a", "b", "c"], "a.pdf") == {"status": "deleted", "count": 3}
+    
+    assert [c.kwargs["ids"] for c in mock_index.delete.call_args_list] == [["a", "b"], ["c"]]
+    assert service.upsert_vectors(vectors, metadata)["skipped_count"] == 0
+
+
+def test_generated_ids_are_ordered_uuid7():
+    """Test that autogenerated ids are unique, time-ordered UUIDv7 strings."""
+    ids = _generate_ids(3000)
+    
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(uuid.UUID(vid).version == 7 for vid in ids)
+    assert all(uuid.UUID(vid).variant == uuid.RFC_4122 for vid in ids)
+
+    # Ordered across calls too, even within one millisecond or if the clock goes back
+    with patch('services.vectorstore.time.time_ns', return_value=0):
+        later = _generate_ids(3) + _generate_ids(3)
+    assert later == sorted(later) and later[0] > ids[-1]
 
 
-def test_upsert_vectors_validation():
+@pytest.mark.parametrize("n_vectors, n_metadata", [(1, 2), (2, 1)])
+def test_upsert_vectors_validation(vectors, n_vectors, n_metadata):
     """Test upsert validation."""
     service = VectorStoreService()
     service.index = Mock()
     
-    vectors = [[0.1] * 768]
-    metadata = [{"text": "doc1"}, {"text": "doc2"}]
+    metadata = [{"text": f"doc{i}"} for i in range(n_metadata)]
     
     with pytest.raises(ValueError):
-        service.upsert_vectors(vectors, metadata)
+        service.upsert_vectors(vectors[:n_vectors], metadata)
 
 
-def test_query_vector():
+def test_query_vector(vector):
     """Test querying vectors."""
     mock_match = Mock()
     mock_match.id = "doc1"
     mock_match.score = 0.95
     mock_match.metadata = {"text": "test"}
     
-    mock_response = Mock()
-    mock_response.matches = [mock_match]
-    
     mock_index = Mock()
-    mock_index.query.return_value = mock_response
+    mock_index.query.return_value.matches = [mock_match]
     
     service = VectorStoreService()
     service.index = mock_index
     
-    query_vector = [0.1] * 768
-    results = service.query_vector(query_vector, top_k=5)
+    results = service.query_vector(vector, top_k=5)
     
     assert len(results) == 1
     assert results[0]["id"] == "doc1"
     assert results[0]["score"] == 0.95
     assert results[0]["metadata"]["text"] == "test"
+    assert isinstance(mock_index.query.call_args.kwargs["vector"], list)
+
+
+def test_query_vector_reuses_results_for_similar_vectors(vector):
+    """Test that a near-identical query is served from the query cache until the next write."""
+    mock_index = Mock()
+    mock_index.query.return_value.matches = [Mock(id="doc1", score=0.9, metadata={"text": "test"})]
+    mock_index.upsert.return_value = Mock(upserted_count=1, failed_item_count=0)
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    nudged = vector.copy()
+    nudged[0] += 0.01
+    
+    first = service.query_vector(vector, top_k=5)
+    assert service.query_vector(nudged, top_k=5) == first
+    assert mock_index.query.call_count == 1
+    
+    # Different options or a write in between go back to Pinecone
+    service.query_vector(vector, top_k=3)
+    assert mock_index.query.call_count == 2
+    service.upsert_vectors(vector[np.newaxis, :], [{"text": "doc2"}])
+    service.query_vector(vector, top_k=5)
+    assert mock_index.query.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_query_vector_stream_previews_similar_cached_matches(vector):
+    """Test that a cache miss yields a similar query's matches before Pinecone's answer."""
+    mock_index = Mock()
+    mock_index.query.return_value.matches = [Mock(id="doc1", score=0.9, metadata={"text": "old"})]
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    service.query_vector(vector, top_k=5)
+    
+    # Similar enough for a preview, not for a query cache hit
+    related = vector.copy()
+    related[:200] = 0.0
+    mock_index.query.return_value.matches = [Mock(id="doc2", score=0.8, metadata={"text": "new"})]
+    events = [event async for event in service.query_vector_stream(related, top_k=5)]
+    
+    assert [([r["id"] for r in results], final) for results, final in events] == [
+        (["doc1"], False),
+        (["doc2"], True),
+    ]
+    assert mock_index.query.call_count == 2
+    
+    # An exact cache hit is final straight away, without a worker thread
+    with patch('services.vectorstore.asyncio.to_thread') as to_thread:
+        events = [final async for _, final in service.query_vector_stream(related, top_k=5)]
+    assert events == [True]
+    to_thread.assert_not_called()
+    assert mock_index.query.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_query_vector_stream_scans_local_index_in_a_worker_thread(vector):
+    """Test that a local-index answer is computed off the event loop and not previewed."""
+    service = VectorStoreService()
+    service.index = Mock()
+    service.query_cache = None
+    service.local_index = Mock(ready=True)
+    service.local_index.query.return_value = [{"id": "a", "score": 0.9}]
+    
+    with patch('services.vectorstore.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+        events = [event async for event in service.query_vector_stream(vector, top_k=1)]
+    
+    assert events == [([{"id": "a", "score": 0.9}], True)]
+    assert to_thread.call_args.args[0] == service.query_vector
+    service.index.query.assert_not_called()
+
+
+def test_query_vector_served_by_loaded_local_index(pinecone_client):
+    """Test that a loaded local index answers queries and follows writes and deletes."""
+    index = pinecone_client.Index.return_value
+    index.describe_index_stats.return_value = Mock(total_vector_count=2, dimension=2)
+    index.list.return_value = [Mock(vectors=[Mock(id="a"), Mock(id="b")])]
+    index.fetch.return_value.vectors = {
+        "a": Mock(id="a", values=[1.0, 0.0], metadata={"filename": "a.pdf"}),
+        "b": Mock(id="b", values=[0.0, 1.0], metadata={"filename": "b.pdf"}),
+    }
+    index.upsert.return_value = Mock(upserted_count=1, failed_item_count=0)
+    pinecone_client.list_indexes.return_value = []
+    
+    service = VectorStoreService()
+    service.pc = pinecone_client
+    service.query_cache = None
+    service.local_index = LocalVectorIndex(capacity=10)
+    assert service.init_index(dimension=2)
+    
+    assert [r["id"] for r in service.query_vector(np.array([0.9, 0.1]), top_k=2)] == ["a", "b"]
+    service.upsert_vectors(np.array([[0.8, 0.2]]), [{"filename": "c.pdf"}], ids=["c"])
+    assert [r["id"] for r in service.query_vector(np.array([0.8, 0.2]), top_k=1)] == ["c"]
+    service.delete_by_filename("c.pdf")
+    assert [r["id"] for r in service.query_vector(np.array([0.8, 0.2]), top_k=1)] == ["a"]
+    index.query.assert_not_called()
+    
+    # A filter the local copy can't evaluate goes to Pinecone
+    index.query.return_value.matches = []
+    service.query_vector(np.array([1.0, 0.0]), filter={"chunk_index": {"$gt": 1}})
+    index.query.assert_called_once()
+
+
+@pytest.mark.parametrize("filter", [
+    {"filename": {"$like": "a%"}},
+    {"$where": "filename == 'a.pdf'"},
+    {"filename": {"$in": "a.pdf"}},
+    {"$and": []},
+    {"filename": ["a.pdf"]},
+])
+def test_invalid_filters_fail_before_reaching_pinecone(vector, filter):
+    """Test that filters Pinecone would reject are refused without a request."""
+    mock_index = Mock()
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    
+    with pytest.raises(ValueError):
+        service.query_vector(vector, filter=filter)
+    with pytest.raises(ValueError):
+        service.delete_by_filter(filter)
+    
+    mock_index.query.assert_not_called()
+    mock_index.delete.assert_not_called()
+
+
+def test_valid_filters_are_sent_unchanged(vector):
+    """Test that shorthand, operator and logical filters pass validation."""
+    mock_index = Mock()
+    mock_index.query.return_value.matches = []
+    filter = {"$or": [{"filename": "a.pdf"}, {"chunk_index": {"$gte": 2, "$in": [2, 3]}}]}
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    service.query_vector(vector, filter=filter)
+    
+    assert mock_index.query.call_args.kwargs["filter"] is filter
 
 
 def test_get_stats():
@@ -136,10 +518,42 @@ def test_get_stats():
     assert stats["dimension"] == 768
 
 
-def test_query_without_index():
+def test_get_stats_is_cached_until_write(vectors):
+    """Test that stats are cached and refetched after an upsert."""
+    mock_index = Mock()
+    mock_index.describe_index_stats.return_value = {"total_vector_count": 100}
+    mock_index.upsert.return_value = Mock(upserted_count=1, failed_item_count=0)
+    
+    service = VectorStoreService()
+    service.index = mock_index
+    
+    service.get_stats()
+    service.get_stats()
+    assert mock_index.describe_index_stats.call_count == 1
+    
+    service.upsert_vectors(vectors[:1], [{"text": "doc1"}])
+    service.get_stats()
+    assert mock_index.describe_index_stats.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_query_rejects_mismatched_dimension(vector):
+    """Test that both query paths reject an embedding from the wrong model before querying."""
+    service = VectorStoreService()
+    service.index = Mock()
+    service.dimension = 1024
+    
+    with pytest.raises(ValueError, match="Query dimension 768 != index dimension 1024"):
+        service.query_vector(vector)
+    with pytest.raises(ValueError, match="Query dimension 768 != index dimension 1024"):
+        [event async for event in service.query_vector_stream(vector)]
+    service.index.query.assert_not_called()
+
+
+def test_query_without_index(vector):
     """Test querying without initialized index."""
     service = VectorStoreService()
     service.index = None
     
     with pytest.raises(RuntimeError):
-        service.query_vector([0.1] * 768)
+        service.query_vector(vector)